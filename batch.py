@@ -0,0 +1,172 @@
+"""
+Generates G-code for a whole catalogue of drawings in one go, using all cores.
+
+The input is either a directory of images, or a JSONL file with one prompt per line
+(e.g. {"id": "cat", "prompt": "a cat playing piano"}), in which case the drawing is generated first.
+Tracing, scaling and G-code generation run in a process pool; each worker loads the settings once.
+Every input gets <output-dir>/<id>.gcode, and a line with its timings and stats is appended to
+<output-dir>/manifest.jsonl. Items whose G-code already exists are skipped, so an interrupted
+batch can simply be started again.
+
+Usage:
+    python batch.py --input images/ --output-dir gcode/
+    python batch.py --input prompts.jsonl --output-dir gcode/ --workers 4
+"""
+from project_init import SharedLogger, ArgParser
+
+log = SharedLogger.get_logger()
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"}
+
+# loaded once per worker process by _init_worker
+_worker_settings = {}
+
+
+def list_items(input_path: Path, prompt_field: str = "prompt", id_field: str = "id") -> list[dict]:
+    """Returns one dict per input, with an "id" and either an "image" path or a "prompt"."""
+    if input_path.is_dir():
+        return [
+            {"id": path.stem, "image": str(path)}
+            for path in sorted(input_path.iterdir())
+            if path.suffix.lower() in IMAGE_SUFFIXES
+        ]
+    items = []
+    with open(input_path, "r") as f:
+        for idx, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            items.append({"id": str(record.get(id_field, idx)), "prompt": record[prompt_field]})
+    return items
+
+
+def load_settings() -> dict:
+    """
+    Settings used by the workers. Loaded once in the parent process and handed to the workers,
+    as loading a settings section for the first time writes it to the settings file.
+    """
+    from drawing.canvas_scale import CanvasScaleSettings
+    from drawing.gcode import GcodeGenerator
+    from drawing.gcode_analysis import GcodeAnalysisSettings
+    from drawing.trace_edges import TraceSettings
+
+    return {
+        "trace": TraceSettings.load(),
+        "canvas": CanvasScaleSettings.load(),
+        "gcode": GcodeGenerator.load(),
+        "machine_profile": GcodeAnalysisSettings.load().profile(),
+    }
+
+
+def _init_worker(settings_name: str, settings: dict):
+    os.environ["SETTINGS_NAME"] = settings_name
+    _worker_settings.update(settings)
+
+
+def process_item(item: dict, output_dir: Path) -> dict:
+    """Runs one input through the pipeline. Never raises: errors are reported in the returned record."""
+    from drawing.image_io import read_grayscale
+    from drawing.trace_edges import trace_image
+    from drawing.canvas_scale import scale_contours_to_canvas
+    from drawing.gcode_analysis import analyze_file
+    from drawing.toolpath_index import index_path
+
+    record = {"id": item["id"], "source": item.get("image") or item.get("prompt"), "pid": os.getpid()}
+    timings = {}
+    try:
+        t0 = perf_counter()
+        if "image" in item:
+            img = read_grayscale(item["image"])
+            timings["load_s"] = perf_counter() - t0
+        else:
+            from drawing.generate_img import generate_drawing
+
+            img = generate_drawing(item["prompt"], output_dir / f"{item['id']}.png")
+            timings["generate_s"] = perf_counter() - t0
+
+        t0 = perf_counter()
+        contours = trace_image(img, _worker_settings["trace"])
+        timings["trace_s"] = perf_counter() - t0
+
+        t0 = perf_counter()
+        canvas_contours = scale_contours_to_canvas(contours, _worker_settings["canvas"])
+        timings["scale_s"] = perf_counter() - t0
+
+        t0 = perf_counter()
+        # write under a temporary name, so an interrupted item is never mistaken for a finished one
+        gcode_file = output_dir / f"{item['id']}.gcode"
+        tmp_file = output_dir / f".{item['id']}.gcode.tmp"
+        _worker_settings["gcode"].make_gcode_from_countours(canvas_contours, tmp_file, _worker_settings["machine_profile"])
+        if index_path(tmp_file).exists():
+            index_path(tmp_file).replace(index_path(gcode_file))
+        tmp_file.replace(gcode_file)
+        timings["gcode_s"] = perf_counter() - t0
+
+        t0 = perf_counter()
+        stats = analyze_file(gcode_file, _worker_settings["machine_profile"])
+        timings["analyze_s"] = perf_counter() - t0
+
+        gcode_bytes = gcode_file.read_bytes()
+        record.update(
+            status="done",
+            gcode=str(gcode_file),
+            contours=len(contours),
+            gcode_lines=gcode_bytes.count(b"\n") + 1,
+            gcode_bytes=len(gcode_bytes),
+            estimated_time_s=stats.estimated_time_s,
+            draw_distance_mm=stats.draw_distance_mm,
+            travel_distance_mm=stats.travel_distance_mm,
+            pen_lifts=stats.pen_lifts,
+        )
+    except Exception as e:
+        record.update(status="failed", error=repr(e))
+    record["timings"] = timings
+    record["total_s"] = sum(timings.values())
+    return record
+
+
+def run_batch(input_path: Path, output_dir: Path, workers: int = None, prompt_field="prompt", id_field="id") -> list[dict]:
+    output_dir.mkdir(exist_ok=True, parents=True)
+    items = list_items(input_path, prompt_field, id_field)
+    todo = [item for item in items if not (output_dir / f"{item['id']}.gcode").exists()]
+    log.info(f"{len(items)} inputs, {len(items) - len(todo)} already done, {len(todo)} to process")
+    if not todo:
+        return []
+
+    records = []
+    t0 = perf_counter()
+    settings = load_settings()
+    settings_name = os.environ.get("SETTINGS_NAME", "default")
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(settings_name, settings)) as pool, \
+            open(output_dir / "manifest.jsonl", "a") as manifest:
+        futures = [pool.submit(process_item, item, output_dir) for item in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            manifest.write(json.dumps(record) + "\n")
+            manifest.flush()
+            records.append(record)
+            if record["status"] == "done":
+                log.info(f"[{len(records)}/{len(todo)}] {record['id']}: {record['gcode_lines']} lines in {record['total_s']:.2f}s")
+            else:
+                log.error(f"[{len(records)}/{len(todo)}] {record['id']} failed: {record['error']}")
+    elapsed = perf_counter() - t0
+    done = sum(record["status"] == "done" for record in records)
+    log.info(f"Processed {done}/{len(todo)} items in {elapsed:.1f}s ({done / elapsed:.2f} items/s)")
+    return records
+
+
+if __name__ == "__main__":
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--input", required=True, type=Path, help="Directory of images or JSONL file of prompts")
+    parser.add_argument("--output-dir", required=True, type=Path, help="Where to write the G-code files and the manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to the number of cores)")
+    parser.add_argument("--prompt-field", type=str, default="prompt", help="JSONL field holding the prompt")
+    parser.add_argument("--id-field", type=str, default="id", help="JSONL field used to name the outputs (defaults to the line number)")
+    args = parser.parse_args()
+    run_batch(args.input, args.output_dir, args.workers, args.prompt_field, args.id_field)
@@ -0,0 +1,97 @@
+"""
+Benchmarks fan-out status polling (job_info + printer) of a fleet of OctoPrint servers,
+synchronous OctoRest (one printer after the other) vs AsyncOctoRest (all printers at once).
+
+Runs entirely offline against simulation.fake_octoprint servers, one of which can be made slow.
+Example:
+    python benchmarks/octoprint_polling.py --printers 12 --latency-s 0.02 --slow-latency-s 0.5
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import asyncio
+import json
+from time import perf_counter
+from statistics import mean, median
+
+from third_party.octorest import OctoRest
+from octoprint_async import AsyncOctoRest, poll_status
+from simulation.fake_octoprint import FakeOctoPrint
+
+
+def bench_sync(urls, rounds):
+    clients = [OctoRest(url=url, apikey="key", lazy=True) for url in urls]
+    timings = []
+    for _ in range(rounds):
+        t0 = perf_counter()
+        for client in clients:
+            client.job_info()
+            client.printer()
+        timings.append(perf_counter() - t0)
+    for client in clients:
+        client.session.close()
+    return timings
+
+
+def bench_async(urls, rounds):
+
+    async def run():
+        clients = [AsyncOctoRest(url=url, apikey="key") for url in urls]
+        timings = []
+        for _ in range(rounds):
+            t0 = perf_counter()
+            await poll_status(clients)
+            timings.append(perf_counter() - t0)
+        for client in clients:
+            await client.close()
+        return timings
+
+    return asyncio.run(run())
+
+
+def summarize(timings):
+    return {
+        "mean_s": mean(timings),
+        "median_s": median(timings),
+        "max_s": max(timings),
+    }
+
+
+def run_benchmark(printers=12, rounds=20, latency_s=0.02, slow_latency_s=0.2):
+    servers = [
+        FakeOctoPrint(latency_s=slow_latency_s if i == 0 else latency_s, api_key="key").start()
+        for i in range(printers)
+    ]
+    try:
+        urls = [server.url for server in servers]
+        results = {
+            "printers": printers,
+            "rounds": rounds,
+            "latency_s": latency_s,
+            "slow_latency_s": slow_latency_s,
+            "sync": summarize(bench_sync(urls, rounds)),
+            "async": summarize(bench_async(urls, rounds)),
+        }
+    finally:
+        for server in servers:
+            server.stop()
+    results["speedup"] = results["sync"]["median_s"] / results["async"]["median_s"]
+    return results
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--printers", type=int, default=12, help="Number of fake OctoPrint servers")
+    parser.add_argument("--rounds", type=int, default=20, help="Number of polling rounds per client type")
+    parser.add_argument("--latency-s", type=float, default=0.02, help="Per request latency of the servers")
+    parser.add_argument("--slow-latency-s", type=float, default=0.2, help="Per request latency of one slow server")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+    results = run_benchmark(args.printers, args.rounds, args.latency_s, args.slow_latency_s)
+    log.info(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,260 @@
+"""
+Stage level benchmarks of the image -> G-code pipeline (decoding the PNG, trace_image,
+scale_contours_to_canvas, make_gcode_from_countours and the whole path end to end).
+
+Inputs are synthetic line-art images of controlled complexity (number of strokes, resolution)
+plus a few fixed reference drawings, all generated procedurally so the suite runs offline
+(no OpenAI, no RoboDK). For every case the suite records the median time and peak traced memory of
+each stage, and the number of lines and bytes of the resulting G-code.
+The "decode_pil" stage is the previous ingest path (PIL image -> "L" -> numpy) for reference;
+memory PIL allocates internally is not seen by tracemalloc, so its peak memory is a lower bound.
+The settings are loaded once, before any timing. "trace" and "end_to_end" always trace the whole image at once,
+so every resolution is compared on the same code path. Images above TraceSettings.tiled_above_px also get a
+"trace_tiled" stage (the tiled path on its process pool, pool startup included); its peak memory only covers
+the parent process, not the workers tracing the tiles.
+
+Results are written as JSON. With --compare, the run is checked against a previous result file
+and the script exits with an error if any stage got slower than the allowed threshold.
+
+Examples:
+    python benchmarks/pipeline.py --output bench.json
+    python benchmarks/pipeline.py --quick --compare bench.json --threshold 0.2
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import json
+import platform
+import sys
+import tempfile
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from drawing.image_io import decode_grayscale
+from drawing.trace_edges import TraceSettings, trace_image
+from drawing.canvas_scale import CanvasScaleSettings, scale_contours_to_canvas
+from drawing.gcode import GcodeGenerator
+
+RESOLUTIONS = [512, 1024, 2048, 4096]
+STROKE_COUNTS = [10, 100, 500]
+QUICK_RESOLUTIONS = [512, 1024]
+QUICK_STROKE_COUNTS = [10, 100]
+
+
+def synthetic_line_art(resolution: int, strokes: int, seed: int = 0) -> np.ndarray:
+    """White grayscale image with `strokes` random black curves, of thickness proportional to the resolution."""
+    rng = np.random.default_rng(seed)
+    img = np.full((resolution, resolution), 255, dtype=np.uint8)
+    thickness = max(1, resolution // 256)
+    for _ in range(strokes):
+        # smooth random walk
+        n_points = rng.integers(5, 40)
+        start = rng.uniform(0.1, 0.9, size=2) * resolution
+        steps = rng.normal(0, resolution / 40, size=(n_points, 2)).cumsum(axis=0)
+        points = np.clip(start + steps, 0, resolution - 1).astype(np.int32)
+        cv2.polylines(img, [points.reshape(-1, 1, 2)], False, 0, thickness, cv2.LINE_AA)
+    return img
+
+
+def reference_drawings(resolution: int = 1024) -> dict[str, np.ndarray]:
+    """Fixed drawings that look like typical inputs: one long spiral line, a grid and nested circles"""
+    thickness = max(1, resolution // 256)
+    center = resolution // 2
+    drawings = {}
+
+    spiral = np.full((resolution, resolution), 255, dtype=np.uint8)
+    t = np.linspace(0, 12 * np.pi, 4000)
+    r = t / t.max() * resolution * 0.45
+    points = np.stack([center + r * np.cos(t), center + r * np.sin(t)], axis=1).astype(np.int32)
+    cv2.polylines(spiral, [points.reshape(-1, 1, 2)], False, 0, thickness, cv2.LINE_AA)
+    drawings["spiral"] = spiral
+
+    grid = np.full((resolution, resolution), 255, dtype=np.uint8)
+    for pos in np.linspace(resolution * 0.05, resolution * 0.95, 20).astype(int):
+        cv2.line(grid, (int(pos), int(resolution * 0.05)), (int(pos), int(resolution * 0.95)), 0, thickness)
+        cv2.line(grid, (int(resolution * 0.05), int(pos)), (int(resolution * 0.95), int(pos)), 0, thickness)
+    drawings["grid"] = grid
+
+    circles = np.full((resolution, resolution), 255, dtype=np.uint8)
+    for radius in np.linspace(resolution * 0.02, resolution * 0.45, 30).astype(int):
+        cv2.circle(circles, (center, center), int(radius), 0, thickness, cv2.LINE_AA)
+    drawings["circles"] = circles
+    return drawings
+
+
+def _timed(fn, *args):
+    """returns (result, seconds)"""
+    t0 = perf_counter()
+    result = fn(*args)
+    return result, perf_counter() - t0
+
+
+def _peak_memory(fn, *args):
+    """returns (result, peak memory allocated during the call in MB).
+    Measured in a separate run, as tracing allocations slows down python code a lot."""
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1e6
+
+
+def decode_pil(png_bytes: bytes) -> np.ndarray:
+    return np.asarray(Image.open(BytesIO(png_bytes)).convert("L"))
+
+
+def bench_case(
+    name: str,
+    img_array: np.ndarray,
+    trace_settings: TraceSettings,
+    canvas_settings: CanvasScaleSettings,
+    gcode_generator: GcodeGenerator,
+    out_dir: Path,
+    repeat: int = 3,
+) -> dict:
+    """
+    Times every stage with the given settings, tracing the whole image at once.
+    The tiled path is timed too ("trace_tiled") when the image is above trace_settings.tiled_above_px.
+    """
+    png_bytes = cv2.imencode(".png", img_array)[1].tobytes()
+    gcode_path = out_dir / f"{name}.gcode"
+    tiled = img_array.shape[0] * img_array.shape[1] > trace_settings.tiled_above_px
+    whole_image = trace_settings.model_copy(update={"tiled_above_px": img_array.size})
+    tiled_image = trace_settings.model_copy(update={"tiled_above_px": 0})
+    stages = ("decode", "decode_pil", "trace") + (("trace_tiled",) if tiled else ()) + ("scale", "gcode", "end_to_end")
+    timings = {stage: [] for stage in stages}
+    peak_mem = {}
+
+    def end_to_end(png_bytes):
+        return gcode_generator.make_gcode_from_countours(
+            scale_contours_to_canvas(trace_image(decode_grayscale(png_bytes), whole_image), canvas_settings), gcode_path
+        )
+
+    for _ in range(repeat):
+        img, t = _timed(decode_grayscale, png_bytes)
+        timings["decode"].append(t)
+        _, t = _timed(decode_pil, png_bytes)
+        timings["decode_pil"].append(t)
+        contours, t = _timed(trace_image, img, whole_image)
+        timings["trace"].append(t)
+        if tiled:
+            _, t = _timed(trace_image, img, tiled_image)
+            timings["trace_tiled"].append(t)
+        canvas_contours, t = _timed(scale_contours_to_canvas, contours, canvas_settings)
+        timings["scale"].append(t)
+        _, t = _timed(gcode_generator.make_gcode_from_countours, canvas_contours, gcode_path)
+        timings["gcode"].append(t)
+        _, t = _timed(end_to_end, png_bytes)
+        timings["end_to_end"].append(t)
+
+    _, peak_mem["decode"] = _peak_memory(decode_grayscale, png_bytes)
+    _, peak_mem["decode_pil"] = _peak_memory(decode_pil, png_bytes)
+    _, peak_mem["trace"] = _peak_memory(trace_image, img, whole_image)
+    if tiled:
+        # the parent process only: tiles are traced in the pool's worker processes
+        _, peak_mem["trace_tiled"] = _peak_memory(trace_image, img, tiled_image)
+    _, peak_mem["scale"] = _peak_memory(scale_contours_to_canvas, contours, canvas_settings)
+    _, peak_mem["gcode"] = _peak_memory(gcode_generator.make_gcode_from_countours, canvas_contours, gcode_path)
+    _, peak_mem["end_to_end"] = _peak_memory(end_to_end, png_bytes)
+
+    gcode_bytes = gcode_path.read_bytes()
+    result = {
+        "name": name,
+        "resolution": img_array.shape[0],
+        "png_bytes": len(png_bytes),
+        "contours": len(contours),
+        "gcode_lines": gcode_bytes.count(b"\n") + 1,
+        "gcode_bytes": len(gcode_bytes),
+        "stages": {
+            stage: {"time_s": median(timings[stage]), "peak_mem_mb": peak_mem[stage]}
+            for stage in timings
+        },
+    }
+    log.info(
+        f"{name}: " + ", ".join(f"{stage} {values['time_s'] * 1000:.1f}ms" for stage, values in result["stages"].items())
+    )
+    return result
+
+
+def run_suite(resolutions, stroke_counts, repeat=3, reference_resolution=1024) -> dict:
+    # loaded once: loading reads (and may write) the settings file
+    trace_settings = TraceSettings.load()
+    canvas_settings = CanvasScaleSettings.load()
+    gcode_generator = GcodeGenerator.load()
+    settings = (trace_settings, canvas_settings, gcode_generator)
+    cases = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = Path(tmp_dir)
+        for resolution in resolutions:
+            for strokes in stroke_counts:
+                img = synthetic_line_art(resolution, strokes)
+                cases.append(bench_case(f"synthetic_{resolution}px_{strokes}strokes", img, *settings, out_dir, repeat))
+        for name, img in reference_drawings(reference_resolution).items():
+            cases.append(bench_case(f"reference_{name}", img, *settings, out_dir, repeat))
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "tiled_above_px": trace_settings.tiled_above_px,
+        },
+        "cases": cases,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_s: float = 0.005) -> list[str]:
+    """
+    Returns a description of every stage that got slower than baseline * (1 + threshold).
+    Differences smaller than min_delta_s are ignored, as they are within timer noise.
+    """
+    regressions = []
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    for case in results["cases"]:
+        base = baseline_cases.get(case["name"])
+        if base is None:
+            continue
+        for stage, values in case["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            old, new = base["stages"][stage]["time_s"], values["time_s"]
+            if new > old * (1 + threshold) and new - old > min_delta_s:
+                regressions.append(f"{case['name']} {stage}: {old * 1000:.1f}ms -> {new * 1000:.1f}ms (+{(new / old - 1):.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    parser.add_argument("--quick", action="store_true", help="Run a small subset of the cases")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case (the median time is kept)")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown per stage")
+    args = parser.parse_args()
+
+    resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+    stroke_counts = QUICK_STROKE_COUNTS if args.quick else STROKE_COUNTS
+    results = run_suite(resolutions, stroke_counts, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        log.info(f"Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            log.error("Performance regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+        log.info(f"No stage slower than {args.threshold:.0%} of the baseline")
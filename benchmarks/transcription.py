@@ -0,0 +1,164 @@
+"""
+Accuracy / latency benchmark of the speech to text step, over a folder of recorded prompts.
+
+The folder holds one recording per prompt and, next to it, a .txt file with what was said
+(e.g. cat.wav and cat.txt). Every configuration transcribes all recordings (after one warm-up run that is not timed),
+and the suite records the median latency, the real time factor (processing time / audio duration)
+and the word error rate against the reference text.
+
+Configurations:
+    default:  TranscriptionSettings defaults (fp32, whisper's default decoding)
+    cpu:      the CPU mode (int8 quantized linear layers, greedy decoding, 48 tokens, one thread per core)
+    settings: the TranscriptionSettings of the current settings file
+
+Example:
+    python benchmarks/transcription.py --prompts speech_to_text/recordings/prompts --output transcription.json
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import json
+import os
+import re
+import sys
+import platform
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import torch
+import whisper
+
+from speech_to_text.transcribe import TranscriptionSettings, transcribe_audio
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".m4a", ".flac", ".ogg"}
+SAMPLE_RATE = 16000
+
+
+def cpu_mode(settings: TranscriptionSettings) -> TranscriptionSettings:
+    return settings.model_copy(
+        update={"device": "cpu", "quantize": True, "greedy": True, "max_tokens": 48, "num_threads": os.cpu_count()}
+    )
+
+
+def _words(text: str) -> list[str]:
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference: str, hypothesis: str) -> tuple[int, int]:
+    """returns (substitutions + insertions + deletions, number of reference words)"""
+    ref, hyp = _words(reference), _words(hypothesis)
+    # edit distance over words, one row at a time
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (ref_word != hyp_word))
+    return row[-1], len(ref)
+
+
+def list_prompts(prompts_dir: Path) -> list[dict]:
+    prompts = []
+    for path in sorted(prompts_dir.iterdir()):
+        reference = path.with_suffix(".txt")
+        if path.suffix.lower() not in AUDIO_SUFFIXES:
+            continue
+        if not reference.exists():
+            log.warning(f"No reference text for {path.name}, skipped")
+            continue
+        prompts.append({
+            "name": path.stem,
+            "audio": path,
+            "reference": reference.read_text().strip(),
+            "duration_s": len(whisper.load_audio(str(path))) / SAMPLE_RATE,
+        })
+    return prompts
+
+
+def bench_config(name: str, settings: TranscriptionSettings, prompts: list[dict], repeat: int, default_threads: int) -> dict:
+    # num_threads = 0 means torch's default, which an earlier configuration may have changed
+    torch.set_num_threads(settings.num_threads or default_threads)
+    # loads the model and warms up
+    transcribe_audio(prompts[0]["audio"], settings)
+    files = []
+    for prompt in prompts:
+        latencies = []
+        for _ in range(repeat):
+            t0 = perf_counter()
+            text = transcribe_audio(prompt["audio"], settings)
+            latencies.append(perf_counter() - t0)
+        errors, words = word_errors(prompt["reference"], text)
+        files.append({
+            "name": prompt["name"],
+            "latency_s": median(latencies),
+            "transcription": text.strip(),
+            "errors": errors,
+            "words": words,
+        })
+    result = {
+        "name": name,
+        "settings": settings.model_dump(),
+        "threads": torch.get_num_threads(),
+        "median_latency_s": median(f["latency_s"] for f in files),
+        "real_time_factor": sum(f["latency_s"] for f in files) / sum(p["duration_s"] for p in prompts),
+        "wer": sum(f["errors"] for f in files) / max(1, sum(f["words"] for f in files)),
+        "files": files,
+    }
+    log.info(
+        f"{name}: median latency {result['median_latency_s'] * 1000:.0f}ms, "
+        f"real time factor {result['real_time_factor']:.3f}, WER {result['wer']:.1%}"
+    )
+    return result
+
+
+def run_suite(prompts_dir: Path, repeat: int = 3) -> dict:
+    prompts = list_prompts(prompts_dir)
+    if not prompts:
+        raise ValueError(f"No recordings with a reference text in {prompts_dir}")
+    settings = TranscriptionSettings.load()
+    configs = {
+        "default": TranscriptionSettings(model=settings.model),
+        "cpu": cpu_mode(settings),
+        "settings": settings,
+    }
+    default_threads = torch.get_num_threads()
+    results = [bench_config(name, config, prompts, repeat, default_threads) for name, config in configs.items()]
+    baseline = results[0]["median_latency_s"]
+    for result in results:
+        result["speedup"] = baseline / result["median_latency_s"]
+    log.info(
+        "\n".join(
+            f"{result['name']:>10}: {result['speedup']:.2f}x speedup, WER {result['wer']:.1%} "
+            f"({result['wer'] - results[0]['wer']:+.1%})"
+            for result in results
+        )
+    )
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "prompts": len(prompts),
+            "audio_s": sum(p["duration_s"] for p in prompts),
+            "repeat": repeat,
+        },
+        "configs": results,
+    }
+
+
+if __name__ == "__main__":
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--prompts", type=str, required=True, help="Folder of recordings (with a .txt reference next to each)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per recording (the median time is kept)")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_suite(Path(args.prompts), args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        log.info(f"Results saved to {args.output}")
@@ -0,0 +1,411 @@
+"""
+Dispatches G-code jobs to a fleet of OctoPrint machines.
+
+Jobs are submitted to a queue (a file dropped in the inbox directory, so any process can submit),
+and the dispatcher polls every configured OctoPrint instance (job_info + printer state).
+Each queued job is sent to the idle machine that is expected to finish it first,
+based on the job's estimated drawing time and how fast each machine has been compared to its estimates.
+The queue and the per-machine statistics are persisted to a json file, so the dispatcher can be restarted
+at any time without losing jobs.
+
+Usage:
+    python dispatcher.py submit path/to/drawing_toolpath.gcode
+    python dispatcher.py run
+    python dispatcher.py status
+    python dispatcher.py simulate --printers 3 --jobs 10
+"""
+from project_init import SharedLogger, ArgParser
+
+log = SharedLogger.get_logger()
+
+import asyncio
+import shutil
+import uuid
+from enum import Enum
+from pathlib import Path
+from time import time
+from typing import Optional, Union
+
+from pydantic import BaseModel, SecretStr
+
+from settings.settings_base import BaseSettingsModel
+from octoprint_async import AsyncOctoRest, poll_status
+from drawing.gcode_analysis import GcodeAnalysisSettings, MachineProfile, analyze_file
+
+DISPATCH_DIR = Path(__file__).parent / "dispatch"
+
+
+class PrinterConfig(BaseModel):
+    """
+    name: str
+        - Name used in logs and metrics.
+
+    base_url: str
+        - Base URL of the OctoPrint server.
+
+    api_key: SecretStr
+        - Application key generated on the OctoPrint server.
+    """
+    name: str
+    base_url: str
+    api_key: SecretStr = SecretStr("YOUR_API_KEY")
+
+
+class DispatcherSettings(BaseSettingsModel):
+    """Dispatcher settings:
+
+    printers: list[PrinterConfig]
+        - OctoPrint instances jobs can be sent to.
+
+    poll_interval_s: float = 5.0
+        - Seconds between two polls of the machines.
+
+    max_attempts: int = 3
+        - How many times a job is sent to a machine before it is marked as failed.
+
+    default_feedrate_mm_per_min: float = 3000.0
+        - Feedrate used to estimate drawing time when the G-code does not set one.
+
+    offline_timeout_s: float = 600.0
+        - A running job whose machine has been offline (unreachable or not ready) for longer than this
+          counts as a failed attempt, and is requeued on another machine (or failed after max_attempts).
+    """
+    printers: list[PrinterConfig] = [PrinterConfig(name="3dprinter", base_url="http://3dprinter/")]
+    poll_interval_s: float = 5.0
+    max_attempts: int = 3
+    default_feedrate_mm_per_min: float = 3000.0
+    offline_timeout_s: float = 600.0
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    id: str
+    gcode_file: Path
+    estimated_time_s: float
+    status: JobStatus = JobStatus.QUEUED
+    printer: Optional[str] = None
+    attempts: int = 0
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class PrinterStats(BaseModel):
+    jobs_done: int = 0
+    jobs_failed: int = 0
+    busy_s: float = 0.0
+    idle_s: float = 0.0
+    offline_s: float = 0.0
+    # ratio of actual to estimated drawing time, learned from finished jobs
+    speed_ratio: float = 1.0
+
+
+class QueueState(BaseModel):
+    started_at: float
+    jobs: list[Job] = []
+    printers: dict[str, PrinterStats] = {}
+
+    @classmethod
+    def load_or_create(cls, path: Path):
+        if path.exists():
+            with open(path, "r") as f:
+                return cls.model_validate_json(f.read())
+        return cls(started_at=time())
+
+    def save(self, path: Path):
+        # write to a temporary file first so a crash never leaves a truncated state file
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self.model_dump_json(indent=4))
+        tmp_path.replace(path)
+
+
+def estimate_print_time_s(gcode_file: Path, default_feedrate_mm_per_min: float = 3000.0, profile: MachineProfile = None) -> float:
+    """Drawing time estimate with acceleration and cornering (see drawing/gcode_analysis.py)."""
+    return analyze_file(gcode_file, profile or MachineProfile(), default_feedrate_mm_per_min).estimated_time_s
+
+
+def submit(gcode_file: Union[str, Path], dispatch_dir: Path = DISPATCH_DIR) -> str:
+    """Add a G-code file to the dispatcher queue. Safe to call while the dispatcher is running."""
+    inbox_dir = dispatch_dir / "inbox"
+    inbox_dir.mkdir(exist_ok=True, parents=True)
+    job_id = uuid.uuid4().hex[:12]
+    # copy then rename, so the dispatcher never picks up a half written file
+    tmp_path = inbox_dir / f".{job_id}.tmp"
+    shutil.copy(gcode_file, tmp_path)
+    tmp_path.rename(inbox_dir / f"{job_id}.gcode")
+    log.info(f"Submitted {gcode_file} as job {job_id}")
+    return job_id
+
+
+class Dispatcher:
+    """Keeps the job queue and assigns jobs to machines."""
+
+    def __init__(self, settings: DispatcherSettings, dispatch_dir: Path = DISPATCH_DIR):
+        self.settings = settings
+        self.inbox_dir = dispatch_dir / "inbox"
+        self.jobs_dir = dispatch_dir / "jobs"
+        self.state_file = dispatch_dir / "queue.json"
+        self.jobs_dir.mkdir(exist_ok=True, parents=True)
+        self.state = QueueState.load_or_create(self.state_file)
+        self.machine_profile = GcodeAnalysisSettings.load().profile()
+        self.clients = {
+            printer.name: AsyncOctoRest(url=printer.base_url, apikey=printer.api_key.get_secret_value(), timeout=10)
+            for printer in settings.printers
+        }
+        for name in self.clients:
+            self.state.printers.setdefault(name, PrinterStats())
+        self._last_step = None
+        # printer name -> time it was first seen offline, reset when it is back
+        self._offline_since = {}
+        self._requeue_orphans()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+
+    def _queue(self, job_file: Path) -> Job:
+        job = Job(
+            id=job_file.stem,
+            gcode_file=job_file,
+            estimated_time_s=estimate_print_time_s(job_file, self.settings.default_feedrate_mm_per_min, self.machine_profile),
+            submitted_at=time(),
+        )
+        self.state.jobs.append(job)
+        log.info(f"Queued job {job.id} (estimated {job.estimated_time_s:.0f}s)")
+        return job
+
+    def _ingest_inbox(self):
+        """Move submitted files from the inbox into the queue"""
+        if not self.inbox_dir.exists():
+            return
+        for path in sorted(self.inbox_dir.glob("*.gcode"), key=lambda p: p.stat().st_mtime):
+            job_file = self.jobs_dir / path.name
+            path.replace(job_file)
+            self._queue(job_file)
+            # saved right away: a job file out of the inbox must be in the state file
+            self.state.save(self.state_file)
+
+    def _requeue_orphans(self):
+        """Queue the job files a crash left in the jobs directory without a job in the state file"""
+        known = {job.id for job in self.state.jobs}
+        orphans = [path for path in sorted(self.jobs_dir.glob("*.gcode"), key=lambda p: p.stat().st_mtime) if path.stem not in known]
+        for path in orphans:
+            log.warning(f"Job file {path.name} is not in the queue, requeueing it")
+            self._queue(path)
+        if orphans:
+            self.state.save(self.state_file)
+
+    def _running_job(self, printer_name) -> Optional[Job]:
+        for job in self.state.jobs:
+            if job.status == JobStatus.RUNNING and job.printer == printer_name:
+                return job
+        return None
+
+    def _finish_job(self, job: Job, success: bool):
+        stats = self.state.printers[job.printer]
+        job.finished_at = time()
+        if success:
+            job.status = JobStatus.DONE
+            stats.jobs_done += 1
+            if job.estimated_time_s > 0:
+                ratio = (job.finished_at - job.started_at) / job.estimated_time_s
+                # exponential moving average, so one odd job does not skew the estimate
+                stats.speed_ratio = 0.7 * stats.speed_ratio + 0.3 * ratio
+            log.info(f"Job {job.id} finished on {job.printer}")
+        else:
+            stats.jobs_failed += 1
+            if job.attempts >= self.settings.max_attempts:
+                job.status = JobStatus.FAILED
+                log.error(f"Job {job.id} failed on {job.printer}, giving up after {job.attempts} attempts")
+            else:
+                log.warning(f"Job {job.id} failed on {job.printer}, requeueing")
+                job.status = JobStatus.QUEUED
+                job.printer = None
+                job.started_at = None
+
+    def _update_printers(self, statuses: dict[str, dict], dt: float) -> list[str]:
+        """Update jobs and statistics from a poll. Returns the names of the idle printers."""
+        idle = []
+        # a machine may not report "printing" right after a job was sent to it
+        start_grace_s = 2 * self.settings.poll_interval_s
+        for name, status in statuses.items():
+            stats = self.state.printers[name]
+            job = self._running_job(name)
+            if "error" in status:
+                stats.offline_s += dt
+                self._offline(name, job)
+                continue
+            flags = status["printer"]["state"]["flags"]
+            # job info and printer state are fetched concurrently: a job that finishes in between
+            # still reports its progress as printing, the next poll has its final state
+            busy = flags.get("printing") or flags.get("paused") or status["job"].get("state") in ("Printing", "Paused", "Pausing")
+            if job is not None and not busy:
+                completion = status["job"]["progress"]["completion"]
+                file_name = status["job"]["job"]["file"]["name"]
+                success = file_name == job.gcode_file.name and completion is not None and completion >= 99.9
+                if success or time() - job.started_at > start_grace_s:
+                    self._finish_job(job, success)
+                    job = None
+                else:
+                    busy = True
+            if busy:
+                stats.busy_s += dt
+            elif flags.get("ready") and job is None:
+                stats.idle_s += dt
+                idle.append(name)
+            else:
+                stats.offline_s += dt
+                self._offline(name, job)
+                continue
+            self._offline_since.pop(name, None)
+        return idle
+
+    def _offline(self, printer_name: str, job: Optional[Job]):
+        """Requeue the job of a machine offline for longer than offline_timeout_s"""
+        since = self._offline_since.setdefault(printer_name, time())
+        if job is not None and time() - since > self.settings.offline_timeout_s:
+            log.warning(f"{printer_name} has been offline for {time() - since:.0f}s while running job {job.id}")
+            self._finish_job(job, success=False)
+
+    def _assign(self, idle: list[str]) -> list[tuple[Job, str]]:
+        """Pick a machine for queued jobs (oldest first) among the idle ones:
+        the one with the shortest expected completion time for that job."""
+        assignments = []
+        idle = list(idle)
+        for job in self.state.jobs:
+            if not idle:
+                break
+            if job.status != JobStatus.QUEUED:
+                continue
+            best = min(idle, key=lambda name: job.estimated_time_s * self.state.printers[name].speed_ratio)
+            idle.remove(best)
+            assignments.append((job, best))
+        return assignments
+
+    async def _start_job(self, job: Job, printer_name: str):
+        client = self.clients[printer_name]
+        job.attempts += 1
+        try:
+            await client.upload(str(job.gcode_file), select=True, print=True)
+        except Exception as e:
+            log.error(f"Could not start job {job.id} on {printer_name}: {e}")
+            job.printer = printer_name
+            self._finish_job(job, success=False)
+            return
+        job.status = JobStatus.RUNNING
+        job.printer = printer_name
+        job.started_at = time()
+        log.info(f"Started job {job.id} on {printer_name}")
+
+    async def step(self):
+        """One dispatch cycle: ingest new jobs, poll machines, start jobs on idle machines, save state."""
+        now = time()
+        dt = 0.0 if self._last_step is None else now - self._last_step
+        self._last_step = now
+        self._ingest_inbox()
+        names = list(self.clients)
+        statuses = await poll_status([self.clients[name] for name in names])
+        idle = self._update_printers(dict(zip(names, statuses)), dt)
+        assignments = self._assign(idle)
+        await asyncio.gather(*[self._start_job(job, name) for job, name in assignments])
+        self.state.save(self.state_file)
+
+    def pending(self) -> int:
+        return sum(job.status in (JobStatus.QUEUED, JobStatus.RUNNING) for job in self.state.jobs)
+
+    async def run(self, until_empty: bool = False):
+        """Run dispatch cycles forever (or until all jobs are done or failed)."""
+        try:
+            while True:
+                await self.step()
+                if until_empty and self.pending() == 0:
+                    break
+                await asyncio.sleep(self.settings.poll_interval_s)
+        finally:
+            await self.close()
+
+    def metrics(self) -> dict:
+        return queue_metrics(self.state)
+
+
+def queue_metrics(state: QueueState) -> dict:
+    """Throughput metrics since the queue was created"""
+    elapsed_h = max(time() - state.started_at, 1e-9) / 3600
+    done = [job for job in state.jobs if job.status == JobStatus.DONE]
+    printers = {}
+    for name, stats in state.printers.items():
+        tracked_s = stats.busy_s + stats.idle_s + stats.offline_s
+        printers[name] = {
+            **stats.model_dump(),
+            "utilization": stats.busy_s / tracked_s if tracked_s else 0.0,
+        }
+    return {
+        "jobs_per_hour": len(done) / elapsed_h,
+        "jobs_done": len(done),
+        "jobs_failed": sum(job.status == JobStatus.FAILED for job in state.jobs),
+        "queue_depth": sum(job.status == JobStatus.QUEUED for job in state.jobs),
+        "running": sum(job.status == JobStatus.RUNNING for job in state.jobs),
+        "printers": printers,
+    }
+
+
+def simulate(n_printers: int, n_jobs: int, seconds_per_line: float = 0.001):
+    """Run the dispatcher against fake OctoPrint servers with synthetic jobs (no hardware needed)."""
+    import json
+    import tempfile
+    import random
+    from simulation.fake_octoprint import FakeOctoPrint
+
+    # machines of different speeds, so the load balancing is visible in the metrics
+    servers = [
+        FakeOctoPrint(seconds_per_line=seconds_per_line * (1 + i), api_key="key").start()
+        for i in range(n_printers)
+    ]
+    settings = DispatcherSettings(
+        printers=[PrinterConfig(name=f"sim_{i}", base_url=server.url, api_key="key") for i, server in enumerate(servers)],
+        poll_interval_s=0.05,
+    )
+    tmp_dir = Path(tempfile.mkdtemp())
+    for i in range(n_jobs):
+        gcode_file = tmp_dir / f"job_{i}.gcode"
+        with open(gcode_file, "w") as f:
+            f.write("G0 F3000\n" + "G1 X10 Y10 Z0\nG1 X0 Y0 Z0\n" * random.randint(100, 1000))
+        submit(gcode_file, dispatch_dir=tmp_dir)
+    dispatcher = Dispatcher(settings, dispatch_dir=tmp_dir)
+    try:
+        asyncio.run(dispatcher.run(until_empty=True))
+    finally:
+        for server in servers:
+            server.stop()
+        shutil.rmtree(tmp_dir)
+    log.info(json.dumps(dispatcher.metrics(), indent=4))
+
+
+if __name__ == "__main__":
+    import json
+
+    # a long running process: stage timings only with --trace
+    parser = ArgParser(description=__doc__, trace=False)
+    parser.add_argument("command", choices=["submit", "run", "status", "simulate"], help="What to do")
+    parser.add_argument("files", nargs="*", help="G-code files to submit")
+    parser.add_argument("--printers", type=int, default=3, help="Number of simulated printers (simulate only)")
+    parser.add_argument("--jobs", type=int, default=10, help="Number of simulated jobs (simulate only)")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        for file in args.files:
+            submit(file)
+    elif args.command == "simulate":
+        simulate(args.printers, args.jobs)
+    elif args.command == "status":
+        # read only: a Dispatcher would requeue orphaned job files and rewrite the state file
+        log.info(json.dumps(queue_metrics(QueueState.load_or_create(DISPATCH_DIR / "queue.json")), indent=4))
+    else:
+        asyncio.run(Dispatcher(DispatcherSettings.load()).run())
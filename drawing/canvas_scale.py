@@ -2,6 +2,7 @@ import numpy as np
 import cv2
 from typing import Union
 from settings.settings_base import BaseSettingsModel
+from tracing import traced
 
 class CanvasScaleSettings(BaseSettingsModel):
     canvas_width_mm: float = 550.0
@@ -14,12 +15,14 @@ class CanvasScaleSettings(BaseSettingsModel):
         return (self.canvas_width_mm-2*self.margin_mm, self.canvas_height_mm-2*self.margin_mm)
 
 
-def scale_contours_to_canvas(contours):
+@traced()
+def scale_contours_to_canvas(contours, settings:Union[CanvasScaleSettings,None]=None):
     """
     Scales a list of contours to fit within a canvas of a given size,
     with a margin around the edges.
+    The settings are loaded from the settings file unless given.
     """
-    SETTINGS:CanvasScaleSettings = CanvasScaleSettings.load()
+    SETTINGS:CanvasScaleSettings = settings or CanvasScaleSettings.load()
     canvas_dims = SETTINGS.canvas_dims
 
     # find the pixel space bounding box of all of the contours
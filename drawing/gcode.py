@@ -7,6 +7,10 @@ log = SharedLogger.get_logger()
 from scipy.ndimage import gaussian_filter1d
 from settings.settings_base import BaseSettingsModel
 from typing import Union
+from pathlib import Path
+from tracing import traced
+from drawing.gcode_analysis import MachineProfile
+from drawing.toolpath_index import write_index
 
 class GcodeGenerator(BaseSettingsModel):
     """Gcode settings:
@@ -23,6 +27,12 @@ class GcodeGenerator(BaseSettingsModel):
     min_step_mm: float = 0.2
         - The minimum distance in millimeters between two consecutive points on the contour. If the distance is greater than this value, the robot will move to the next point.
 
+    smoothing_sigma: float = 1.0
+        - Standard deviation (in contour points) of the gaussian filter applied to each contour before it is drawn. 0 disables the smoothing.
+
+    smoothing_radius: int = 3
+        - Radius (in contour points) of the gaussian filter.
+
     xy_offset_mm: tuple[float,float] = (0.0, 0.0)
         - The offset in millimeters in the X and Y directions. It allows you to adjust the position of the drawing on the canvas.
 
@@ -37,20 +47,30 @@ class GcodeGenerator(BaseSettingsModel):
 
     end_command: str = None
         - The Gcode command to execute at the end of the program. It can be a string representing a valid Gcode command or an empty string if no command is needed.
+
+    write_index: bool = False
+        - Also write a contour index next to the Gcode file (<file>.idx.npy), used to resume an interrupted drawing (see toolpath_index.py).
+          Otherwise the index is built the first time it is needed.
     """
 
     feedrate_mm_per_min: int = 30000
     pen_up_mm: int = 25
     pen_down_mm: int = 0
     min_step_mm: float = 0.2
+    smoothing_sigma: float = 1.0
+    smoothing_radius: int = 3
     xy_offset_mm: tuple[float,float] = (0.0, 0.0)
     pen_down_command: str = ""
     pen_up_command: str = "" 
     start_command: str = "G28\nG21\nG90"
     end_command: str = ""
+    write_index: bool = False
 
-    def make_gcode_from_countours(self,contours):
-        """Makes gcode from a list of contours and writes it to a file."""
+    @traced()
+    def make_gcode_from_countours(self,contours, filepath:Union[Path,None]=None, profile:Union[MachineProfile,None]=None):
+        """Makes gcode from a list of contours and writes it to a file
+        (LOG_DIR/drawing_toolpath.gcode unless filepath is given).
+        The contour index uses the machine profile for its time estimates (the one selected in GcodeAnalysisSettings unless given)."""
         commands = [
             f"G0 F{self.feedrate_mm_per_min}",
         ]
@@ -64,8 +84,9 @@ class GcodeGenerator(BaseSettingsModel):
             # apply a 1D gaussian filter to the contour
             y_points = [-point[0][1] + self.xy_offset_mm[1] for point in contour]
             x_points = [point[0][0] + self.xy_offset_mm[0] for point in contour]
-            x_points = gaussian_filter1d(x_points, 1, radius=3)
-            y_points = gaussian_filter1d(y_points, 1, radius=3)
+            if self.smoothing_sigma > 0:
+                x_points = gaussian_filter1d(x_points, self.smoothing_sigma, radius=self.smoothing_radius)
+                y_points = gaussian_filter1d(y_points, self.smoothing_sigma, radius=self.smoothing_radius)
             # draw on canvas
             for idx, (point_x, point_y) in enumerate(zip(x_points, y_points)):
                 if idx == 0:
@@ -98,9 +119,14 @@ class GcodeGenerator(BaseSettingsModel):
                     if self.pen_up_command:
                         commands.append(self.pen_up_command)
 
-        filepath = LOG_DIR / "drawing_toolpath.gcode"
+        if filepath is None:
+            filepath = LOG_DIR / "drawing_toolpath.gcode"
         gcode_str = self.start_command + "\n" + "\n".join(commands) + "\n" + self.end_command
-        with open(filepath, "w") as f:
-            f.write(gcode_str)
-        log.info(f"Saved gcode to {filepath}")
+        # written as bytes, so that the byte offsets in the index match the file on every platform
+        data = gcode_str.encode()
+        with open(filepath, "wb") as f:
+            f.write(data)
+        log.debug(f"Saved gcode to {filepath}")
+        if self.write_index:
+            write_index(filepath, data, profile)
         return filepath
@@ -0,0 +1,364 @@
+"""
+Vectorized G-code analysis and drawing time estimation.
+
+The whole file is tokenized at once (numbers are the runs of numeric characters, their letter is the
+character before the run), then the modal state (position, feedrate, motion mode, absolute/relative
+positioning) is forward filled with numpy, so multi-megabyte files are parsed without a python loop over lines.
+
+The drawing time is estimated with the model used by GRBL/Marlin planners: every move accelerates and
+decelerates with a trapezoidal speed profile, and the speed through the corner between two moves
+is limited by the junction deviation. Entry speeds are solved exactly in v² space, where the
+"can still reach / can still stop" constraints become running minimums (np.minimum.accumulate).
+
+Usage:
+    python drawing/gcode_analysis.py --file logs/run_drawing_robot/<timestamp>/drawing_toolpath.gcode
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import re
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+from settings.settings_base import BaseSettingsModel
+from tracing import traced
+
+
+class MachineProfile(BaseModel):
+    """
+    max_feedrate_mm_per_min: tuple[float,float,float] = (30000, 30000, 6000)
+        - Maximum speed of each axis (X, Y, Z). Moves are slowed down to respect every axis limit.
+
+    acceleration_mm_per_s2: tuple[float,float,float] = (1000, 1000, 500)
+        - Acceleration of each axis (X, Y, Z).
+
+    junction_deviation_mm: float = 0.05
+        - Cornering tolerance of the planner (GRBL $11). Higher values take corners faster.
+
+    rapid_feedrate_mm_per_min: float = None
+        - Speed of G0 moves. If not set, G0 moves use the programmed feedrate (Marlin behaviour);
+          GRBL moves G0 at the axis maximum speed.
+    """
+    max_feedrate_mm_per_min: tuple[float, float, float] = (30000.0, 30000.0, 6000.0)
+    acceleration_mm_per_s2: tuple[float, float, float] = (1000.0, 1000.0, 500.0)
+    junction_deviation_mm: float = 0.05
+    rapid_feedrate_mm_per_min: Optional[float] = None
+
+
+class GcodeAnalysisSettings(BaseSettingsModel):
+    """G-code analysis settings:
+
+    machine_profiles: dict[str, MachineProfile]
+        - Kinematic limits of each machine the drawings can be sent to.
+
+    machine_profile: str = "default"
+        - Profile used to estimate the drawing time.
+
+    time_budget_s: float = 0.0
+        - Maximum estimated drawing time. 0 disables the check.
+
+    reject_over_budget: bool = False
+        - Stop the pipeline when a drawing exceeds the time budget (otherwise only a warning is logged).
+    """
+    machine_profiles: dict[str, MachineProfile] = {"default": MachineProfile()}
+    machine_profile: str = "default"
+    time_budget_s: float = 0.0
+    reject_over_budget: bool = False
+
+    def profile(self) -> MachineProfile:
+        if self.machine_profile not in self.machine_profiles:
+            raise ValueError(f"Unknown machine profile {self.machine_profile}, available: {list(self.machine_profiles)}")
+        return self.machine_profiles[self.machine_profile]
+
+
+class Toolpath(NamedTuple):
+    """Linear moves of a G-code file, one row per move."""
+    line: np.ndarray  # [N] line index (0 based) of the move in the file
+    start: np.ndarray  # [N,3] start position (X, Y, Z)
+    end: np.ndarray  # [N,3] end position
+    feedrate: np.ndarray  # [N] programmed feedrate (mm/min)
+    rapid: np.ndarray  # [N] True for G0 moves
+    n_lines: int
+
+
+class GcodeStats(BaseModel):
+    lines: int
+    moves: int
+    draw_distance_mm: float
+    travel_distance_mm: float
+    pen_lifts: int
+    estimated_time_s: float
+    # time at the programmed feedrates, ignoring acceleration
+    nominal_time_s: float
+    bbox_mm: tuple[float, float, float, float]
+
+
+class TimeBudgetExceeded(Exception):
+    pass
+
+
+_COMMENT_RE = re.compile(r";[^\n]*|\([^)\n]*\)")
+_NUMERIC = np.zeros(256, dtype=bool)
+_NUMERIC[np.frombuffer(b"0123456789.-+", dtype=np.uint8)] = True
+# keeps the characters of numbers, everything else becomes a separator
+_NUMBERS_ONLY = bytes(c if _NUMERIC[c] else ord(" ") for c in range(256))
+
+
+def _parse_numbers(text: bytes) -> np.ndarray:
+    tokens = text.translate(_NUMBERS_ONLY).split()
+    try:
+        return np.array(tokens, dtype=float)
+    except ValueError:
+        # malformed numbers ("-", "1.2.3", ...) are ignored
+        def to_float(token):
+            try:
+                return float(token)
+            except ValueError:
+                return np.nan
+
+        return np.array([to_float(token) for token in tokens], dtype=float)
+
+
+def _tokenize(text: str):
+    """
+    Splits G-code into words (letter + number) without a python loop over the words:
+    numbers are the runs of numeric characters, their letter is the character right before the run.
+    Returns (letters [uint8], values, line index of each word, number of lines).
+    """
+    if ";" in text or "(" in text:
+        text = _COMMENT_RE.sub("", text)
+    data = text.upper().encode()
+    chars = np.frombuffer(data, dtype=np.uint8)
+    numeric = _NUMERIC[chars]
+    run_starts = np.flatnonzero(numeric & ~np.concatenate([[False], numeric[:-1]]))
+    values = _parse_numbers(data)
+    letters = chars[np.maximum(run_starts - 1, 0)]
+    newlines = np.flatnonzero(chars == ord("\n"))
+    lines = np.searchsorted(newlines, run_starts)
+    # numbers without a letter right before them (and malformed numbers) are not words
+    is_word = (run_starts > 0) & (letters >= ord("A")) & (letters <= ord("Z")) & ~np.isnan(values)
+    return letters[is_word], values[is_word], lines[is_word], len(newlines) + 1
+
+
+def _ffill_index(mask: np.ndarray) -> np.ndarray:
+    """index of the last True at or before each position (-1 if none)"""
+    idx = np.where(mask, np.arange(len(mask)), -1)
+    return np.maximum.accumulate(idx)
+
+
+def parse_gcode(text: str, default_feedrate_mm_per_min: float = 3000.0) -> Toolpath:
+    """Parses G0/G1 moves (G2/G3 arcs are treated as straight lines to their end point)."""
+    letters, values, token_line, n_lines = _tokenize(text)
+
+    def per_line(letter):
+        """value of `letter` on every line (NaN where absent, the last one wins)"""
+        out = np.full(n_lines, np.nan)
+        mask = letters == ord(letter)
+        out[token_line[mask]] = values[mask]
+        return out
+
+    g_values = np.where(letters == ord("G"), values, -1.0)
+
+    def line_has_g(*codes):
+        out = np.zeros(n_lines, dtype=bool)
+        out[token_line[np.isin(g_values, codes)]] = True
+        return out
+
+    motion_code = np.full(n_lines, np.nan)
+    motion_mask = np.isin(g_values, (0, 1, 2, 3))
+    motion_code[token_line[motion_mask]] = g_values[motion_mask]
+    # modal motion mode (G0/G1 stay active on lines with only coordinates)
+    idx = _ffill_index(~np.isnan(motion_code))
+    motion = np.where(idx >= 0, motion_code[np.maximum(idx, 0)], np.nan)
+
+    # absolute (G90) / relative (G91) positioning, absolute by default
+    abs_mark, rel_mark = line_has_g(90), line_has_g(91)
+    idx = _ffill_index(abs_mark | rel_mark)
+    relative = (idx >= 0) & rel_mark[np.maximum(idx, 0)]
+    # G28 (home) and G92 (set position) reset the position without a planned move
+    reset = line_has_g(28, 92)
+
+    feedrate = per_line("F")
+    idx = _ffill_index(~np.isnan(feedrate))
+    feedrate = np.where(idx >= 0, feedrate[np.maximum(idx, 0)], default_feedrate_mm_per_min)
+
+    axis_values = [per_line(letter) for letter in "XYZ"]
+    has_coordinates = np.any([~np.isnan(value) for value in axis_values], axis=0)
+    # G28 without coordinates homes every axis, G92 without coordinates zeroes every axis
+    reset_all = reset & ~has_coordinates
+    positions = np.zeros((n_lines, 3))
+    present_any = np.zeros(n_lines, dtype=bool)
+    for axis, value in enumerate(axis_values):
+        present = ~np.isnan(value) | reset_all
+        value = np.where(reset_all, 0.0, value)
+        absolute_set = present & (~relative | reset)
+        delta = np.where(present & ~absolute_set, value, 0.0)
+        cumulative = np.cumsum(delta)
+        idx = _ffill_index(absolute_set)
+        safe_idx = np.maximum(idx, 0)
+        positions[:, axis] = np.where(
+            idx >= 0, value[safe_idx] + cumulative - cumulative[safe_idx], cumulative
+        )
+        present_any |= present
+
+    is_move = present_any & ~reset & ~np.isnan(motion)
+    move_lines = np.flatnonzero(is_move)
+    # start of each move: position after the previous line
+    previous = np.vstack([np.zeros((1, 3)), positions])[move_lines]
+    return Toolpath(
+        line=move_lines,
+        start=previous,
+        end=positions[move_lines],
+        feedrate=feedrate[move_lines],
+        rapid=motion[move_lines] == 0,
+        n_lines=n_lines,
+    )
+
+
+def move_times(toolpath: Toolpath, profile: MachineProfile) -> np.ndarray:
+    """Duration (s) of every move with trapezoidal acceleration and junction deviation cornering."""
+    n = len(toolpath.line)
+    times = np.zeros(n)
+    delta = toolpath.end - toolpath.start
+    length = np.linalg.norm(delta, axis=1)
+    moving = length > 1e-9
+    if not moving.any():
+        return times
+    delta, length = delta[moving], length[moving]
+    unit = delta / length[:, None]
+    abs_unit = np.abs(unit)
+
+    max_rate = np.asarray(profile.max_feedrate_mm_per_min, dtype=float) / 60
+    max_accel = np.asarray(profile.acceleration_mm_per_s2, dtype=float)
+    with np.errstate(divide="ignore"):
+        # limit along the move direction so that no axis exceeds its own limit
+        rate_limit = np.min(np.where(abs_unit > 0, max_rate / abs_unit, np.inf), axis=1)
+        accel = np.min(np.where(abs_unit > 0, max_accel / abs_unit, np.inf), axis=1)
+    programmed = toolpath.feedrate[moving] / 60
+    if profile.rapid_feedrate_mm_per_min is not None:
+        programmed = np.where(toolpath.rapid[moving], profile.rapid_feedrate_mm_per_min / 60, programmed)
+    nominal = np.minimum(programmed, rate_limit)
+    nominal_sq = nominal**2
+
+    # maximum speed² at every junction (node i is the start of move i, node m is the end of the last move)
+    m = len(length)
+    limit = np.zeros(m + 1)
+    if m > 1:
+        cos_theta = -np.einsum("ij,ij->i", unit[:-1], unit[1:])
+        sin_theta_d2 = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+        junction_accel = np.minimum(accel[:-1], accel[1:])
+        # a (nearly) straight continuation has no cornering limit
+        straight = sin_theta_d2 >= 1 - 1e-6
+        with np.errstate(divide="ignore"):
+            junction_sq = np.where(
+                straight,
+                np.inf,
+                junction_accel * profile.junction_deviation_mm * sin_theta_d2 / (1 - sin_theta_d2),
+            )
+        limit[1:-1] = np.minimum(junction_sq, np.minimum(nominal_sq[:-1], nominal_sq[1:]))
+
+    # v²[j] <= v²[i] + 2 a d(i, j) in both directions; with S the cumulative 2*a*L,
+    # the solution is v²[i] = min_j(limit[j] + |S[i] - S[j]|), i.e. two running minimums
+    budget = np.concatenate([[0.0], np.cumsum(2 * accel * length)])
+    forward = np.minimum.accumulate(limit - budget) + budget
+    backward = np.minimum.accumulate((limit + budget)[::-1])[::-1] - budget
+    v_sq = np.minimum(forward, backward)
+    entry_sq, exit_sq = v_sq[:-1], v_sq[1:]
+
+    accel_dist = (nominal_sq - entry_sq) / (2 * accel)
+    decel_dist = (nominal_sq - exit_sq) / (2 * accel)
+    cruise = length - accel_dist - decel_dist
+    entry, exit_ = np.sqrt(entry_sq), np.sqrt(exit_sq)
+    # trapezoid: accelerate, cruise at the nominal speed, decelerate
+    trapezoid = (nominal - entry) / accel + (nominal - exit_) / accel + np.maximum(cruise, 0) / nominal
+    # triangle: the nominal speed is never reached
+    peak = np.sqrt(np.maximum((2 * accel * length + entry_sq + exit_sq) / 2, 0))
+    triangle = (peak - entry) / accel + (peak - exit_) / accel
+    times[moving] = np.where(cruise >= 0, trapezoid, triangle)
+    return times
+
+
+def pen_down_mask(toolpath: Toolpath, pen_down_z_mm: float = None) -> np.ndarray:
+    """Moves drawn with the pen on the paper: both ends at or below pen_down_z_mm (the lowest Z of the file by default)."""
+    if len(toolpath.line) == 0:
+        return np.zeros(0, dtype=bool)
+    if pen_down_z_mm is None:
+        pen_down_z_mm = toolpath.end[:, 2].min()
+    tolerance = 1e-3
+    return (toolpath.start[:, 2] <= pen_down_z_mm + tolerance) & (toolpath.end[:, 2] <= pen_down_z_mm + tolerance)
+
+
+def analyze(toolpath: Toolpath, profile: MachineProfile, pen_down_z_mm: float = None) -> GcodeStats:
+    times = move_times(toolpath, profile)
+    length = np.linalg.norm(toolpath.end - toolpath.start, axis=1)
+    xy_length = np.linalg.norm(toolpath.end[:, :2] - toolpath.start[:, :2], axis=1)
+    pen_down = pen_down_mask(toolpath, pen_down_z_mm)
+    # a lift is a pen down move followed by a pen up move
+    pen_lifts = int(np.count_nonzero(pen_down[:-1] & ~pen_down[1:])) + int(bool(len(pen_down)) and pen_down[-1])
+    drawn = toolpath.end[pen_down]
+    bbox = (*drawn[:, :2].min(axis=0), *drawn[:, :2].max(axis=0)) if len(drawn) else (0.0, 0.0, 0.0, 0.0)
+    return GcodeStats(
+        lines=toolpath.n_lines,
+        moves=len(toolpath.line),
+        draw_distance_mm=float(xy_length[pen_down].sum()),
+        travel_distance_mm=float(length[~pen_down].sum() + (length - xy_length)[pen_down].sum()),
+        pen_lifts=pen_lifts,
+        estimated_time_s=float(times.sum()),
+        nominal_time_s=float((length / (toolpath.feedrate / 60)).sum()) if len(length) else 0.0,
+        bbox_mm=tuple(float(v) for v in bbox),
+    )
+
+
+@traced()
+def analyze_file(gcode_file: Union[str, Path], profile: MachineProfile = None, default_feedrate_mm_per_min: float = 3000.0) -> GcodeStats:
+    """Parses and analyzes a G-code file (with the profile selected in GcodeAnalysisSettings unless given)."""
+    if profile is None:
+        profile = GcodeAnalysisSettings.load().profile()
+    with open(gcode_file, "r") as f:
+        text = f.read()
+    return analyze(parse_gcode(text, default_feedrate_mm_per_min), profile)
+
+
+def check_time_budget(gcode_file: Union[str, Path, list], settings: GcodeAnalysisSettings = None) -> GcodeStats:
+    """
+    Analyzes the G-code and compares its estimated drawing time to the budget in the settings.
+    gcode_file can also be a list of files drawn at the same time (the shards of a drawing):
+    the longest one is the drawing time, and its stats are returned.
+    Raises TimeBudgetExceeded if the drawing is too long and reject_over_budget is set.
+    """
+    if settings is None:
+        settings = GcodeAnalysisSettings.load()
+    files = [gcode_file] if isinstance(gcode_file, (str, Path)) else list(gcode_file)
+    profile = settings.profile()
+    gcode_file, stats = max(((file, analyze_file(file, profile)) for file in files), key=lambda item: item[1].estimated_time_s)
+    log.info(
+        f"{Path(gcode_file).name}{f' (longest of {len(files)} shards)' if len(files) > 1 else ''}: estimated drawing time {stats.estimated_time_s:.0f}s, "
+        f"{stats.draw_distance_mm / 1000:.1f}m drawn, {stats.travel_distance_mm / 1000:.1f}m travel, {stats.pen_lifts} pen lifts"
+    )
+    if settings.time_budget_s > 0 and stats.estimated_time_s > settings.time_budget_s:
+        message = f"estimated drawing time {stats.estimated_time_s:.0f}s exceeds the budget of {settings.time_budget_s:.0f}s"
+        if settings.reject_over_budget:
+            raise TimeBudgetExceeded(message)
+        log.warning(message)
+    return stats
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--file", required=True, help="G-code file to analyze")
+    parser.add_argument("--machine", type=str, default=None, help="Machine profile (defaults to the settings file)")
+    args = parser.parse_args()
+
+    settings = GcodeAnalysisSettings.load()
+    if args.machine:
+        settings.machine_profile = args.machine
+    t0 = perf_counter()
+    stats = analyze_file(args.file, settings.profile())
+    log.info(f"Analyzed in {perf_counter() - t0:.3f}s:\n{stats.model_dump_json(indent=4)}")
@@ -7,8 +7,11 @@ from pydantic import SecretStr
 
 from openai import OpenAI
 import requests
-from PIL import Image
-from io import BytesIO
+import numpy as np
+from pathlib import Path
+from functools import lru_cache
+from tracing import traced
+from drawing.image_io import archive, decode_grayscale
 
 class ImageGenerationSettings(BaseSettingsModel):
     open_ai_api_key: SecretStr = SecretStr("YOUR_API_KEY")
@@ -25,25 +28,30 @@ def make_prompt(human_prompt):
     return drawing_prompt
 
 
-def get_img_from_url(url: str) -> Image:
-
-    # Get the content of the image
+def download_image(url: str) -> bytes:
+    """Encoded image bytes, as served (not decoded)"""
     response = requests.get(url)
+    if response.status_code != 200:
+        raise Exception(f"failed to retreive image. status code: {response.status_code} content: {response.content[:200]}")
+    return response.content
+
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Open the image
-        image = Image.open(BytesIO(response.content))
-    else:
-        raise Exception("failed to retreive image. status msg: " + response.status_code + " content: " + response.content)
-    return image
+@lru_cache(maxsize=None)
+def get_client() -> OpenAI:
+    """OpenAI client, created once per process so its connection pool is reused between drawings."""
+    SETTINGS = ImageGenerationSettings.load()
+    return OpenAI(api_key=SETTINGS.open_ai_api_key.get_secret_value())
 
 
-def generate_drawing(human_prompt: str) -> Image:
+@traced()
+def generate_drawing(human_prompt: str, save_path: Path = LOG_DIR / "drawing.png") -> np.ndarray:
+    """
+    Generates a drawing and returns it as a grayscale uint8 array, ready for trace_image.
+    The downloaded PNG is saved to save_path as is, in the background.
+    """
     log.info(f"Generating drawing for prompt: {human_prompt}")
     prompt = make_prompt(human_prompt)
-    SETTINGS = ImageGenerationSettings.load()
-    client = OpenAI(api_key=SETTINGS.open_ai_api_key.get_secret_value())
+    client = get_client()
     response = client.images.generate(
         model="dall-e-3",
         prompt=prompt,
@@ -53,12 +61,10 @@ def generate_drawing(human_prompt: str) -> Image:
     )
     image_url = response.data[0].url
     log.debug(f"Generated image at {image_url}")
-    img = get_img_from_url(image_url)
-    # save
-    save_path = LOG_DIR / "drawing.png"
-    img.save(save_path)
-    log.info(f"Saved image to {save_path}")
-    return img
+    data = download_image(image_url)
+    archive(data, save_path)
+    log.info(f"Saving image to {save_path}")
+    return decode_grayscale(data)
 
 
 if __name__ == "__main__":
@@ -69,5 +75,7 @@ if __name__ == "__main__":
         "--prompt", type=str, default="a cat", help="Prompt for the drawing"
     )
     args = parser.parse_args()
+    from PIL import Image
+
     img = generate_drawing(args.prompt)
-    img.show()
+    Image.fromarray(img).show()
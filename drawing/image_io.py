@@ -0,0 +1,73 @@
+"""
+Image ingest for the drawing pipeline.
+
+Drawings are decoded straight from their encoded bytes (or file) to the single channel uint8 array
+that trace_image works on, without going through PIL. Grayscale images are used as decoded; color images are
+converted with PIL's luma weights and rounding, so the result is exactly PIL's convert("L")
+(OpenCV's own grayscale decoding differs by up to 1 level for PNG and more for JPEG).
+The original bytes are archived as they were downloaded, by a background thread, so saving a
+drawing never re-encodes it and never delays the tracing.
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import cv2
+import numpy as np
+
+# a single thread keeps the writes in order; pending writes are finished when the interpreter exits
+_archive_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+
+def _to_grayscale(img: np.ndarray, decode_color) -> np.ndarray:
+    """8 bit grayscale of an image decoded with IMREAD_UNCHANGED (decode_color() decodes it again as 8 bit BGR)"""
+    if img.dtype != np.uint8 or (img.ndim == 3 and img.shape[2] not in (3, 4)):
+        # 16 bit, or gray + alpha
+        img = decode_color()
+    if img.ndim == 2:
+        return img
+    # ITU-R 601-2 luma, in the same fixed point arithmetic as PIL (alpha is ignored, as in PIL)
+    luma = img[:, :, 2] * np.uint32(19595)
+    luma += img[:, :, 1] * np.uint32(38470)
+    luma += img[:, :, 0] * np.uint32(7471)
+    luma += np.uint32(0x8000)
+    luma >>= 16
+    return luma.astype(np.uint8)
+
+
+def decode_grayscale(data: bytes) -> np.ndarray:
+    """Decodes encoded image bytes (PNG, JPEG, ...) to a grayscale uint8 array (the bytes are not copied)."""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"Could not decode image ({len(data)} bytes)")
+    return _to_grayscale(img, lambda: cv2.imdecode(buffer, cv2.IMREAD_COLOR))
+
+
+def read_grayscale(path: Union[str, Path]) -> np.ndarray:
+    """Reads an image file as a grayscale uint8 array."""
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"Could not read image {path}")
+    return _to_grayscale(img, lambda: cv2.imread(str(path), cv2.IMREAD_COLOR))
+
+
+def _write(data: bytes, path: Path):
+    path.write_bytes(data)
+    log.debug(f"Archived {len(data)} bytes to {path}")
+
+
+def _report_failure(future: Future):
+    if future.exception() is not None:
+        log.error(f"Failed to archive image: {future.exception()!r}")
+
+
+def archive(data: bytes, path: Union[str, Path]) -> Future:
+    """Writes the bytes to path in the background. The returned future can be waited on if the file is needed."""
+    future = _archive_pool.submit(_write, data, Path(path))
+    future.add_done_callback(_report_failure)
+    return future
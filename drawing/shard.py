@@ -0,0 +1,183 @@
+"""
+Splits one drawing into regions that are drawn at the same time by several machines.
+
+The contours coming out of scale_contours_to_canvas are partitioned into N regions of roughly equal
+estimated drawing time, either with a balanced k-d split (recursive cut along the longest side)
+or with a grid of balanced tiles (columns, then rows inside each column).
+Contours are never cut: each contour is assigned to the region containing its centroid,
+so every machine draws whole strokes and no seam artifacts appear where regions meet.
+Each region gets its own G-code file, offset so that the machine drawing it is centered on its region
+(or on the origin given for that machine in the settings).
+"""
+from project_init import SharedLogger, LOG_DIR
+
+log = SharedLogger.get_logger()
+
+import numpy as np
+from math import ceil, sqrt
+from pathlib import Path
+from typing import NamedTuple, Union
+
+from settings.settings_base import BaseSettingsModel
+from drawing.gcode import GcodeGenerator
+
+
+class ShardSettings(BaseSettingsModel):
+    """Sharding settings:
+
+    num_machines: int = 1
+        - Number of machines drawing the canvas at the same time (1 disables sharding).
+
+    method: str = "kd"
+        - "kd" for a balanced k-d split, "tiles" for a grid of balanced tiles.
+
+    machine_origins_mm: list[tuple[float,float]] = None
+        - Position of each machine's origin in canvas coordinates (mm, relative to the canvas center).
+          If not set, each machine is centered on its own region.
+
+    pen_lift_cost_mm: float = 5.0
+        - Extra drawing distance counted for every contour, to account for the pen lifts and travel moves.
+    """
+    num_machines: int = 1
+    method: str = "kd"
+    machine_origins_mm: Union[None, list[tuple[float, float]]] = None
+    pen_lift_cost_mm: float = 5.0
+
+
+class Shard(NamedTuple):
+    contours: list
+    bbox: tuple[float, float, float, float]
+    cost_mm: float
+
+    @property
+    def center(self):
+        return ((self.bbox[0] + self.bbox[2]) / 2, (self.bbox[1] + self.bbox[3]) / 2)
+
+
+def contour_stats(contours, pen_lift_cost_mm=5.0):
+    """
+    Vectorized per-contour centroids and drawing cost (closed path length + pen lift cost).
+    Returns (centroids [N,2], costs [N])
+    """
+    if not contours:
+        return np.zeros((0, 2)), np.zeros(0)
+    lengths = np.array([len(contour) for contour in contours])
+    points = np.concatenate([contour.reshape(-1, 2) for contour in contours]).astype(float)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    centroids = np.add.reduceat(points, starts, axis=0) / lengths[:, None]
+    # closed path length: consecutive points, plus the segment back to the first point
+    steps = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    steps = np.append(steps, 0.0)
+    ends = starts + lengths - 1
+    steps[ends] = np.linalg.norm(points[ends] - points[starts], axis=1)
+    costs = np.add.reduceat(steps, starts) + pen_lift_cost_mm
+    return centroids, costs
+
+
+def _weighted_cut(values, costs, fraction):
+    """index in the sorted order where the cumulative cost reaches fraction of the total"""
+    order = np.argsort(values, kind="stable")
+    if len(order) == 0:
+        return order, order
+    cumulative = np.cumsum(costs[order])
+    cut = int(np.searchsorted(cumulative, fraction * cumulative[-1]))
+    cut = min(max(cut, 1), len(order) - 1) if len(order) > 1 else len(order)
+    return order[:cut], order[cut:]
+
+
+def _kd_split(indices, centroids, costs, n):
+    if n == 1 or len(indices) <= 1:
+        return [indices] + [indices[:0]] * (n - 1)
+    n_left = n // 2
+    pts = centroids[indices]
+    axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+    left, right = _weighted_cut(pts[:, axis], costs[indices], n_left / n)
+    return (
+        _kd_split(indices[left], centroids, costs, n_left)
+        + _kd_split(indices[right], centroids, costs, n - n_left)
+    )
+
+
+def _tile_split(indices, centroids, costs, n):
+    n_cols = int(ceil(sqrt(n)))
+    groups = []
+    remaining_idx, remaining_machines = indices, n
+    for col in range(n_cols):
+        cols_left = n_cols - col
+        n_rows = int(ceil(remaining_machines / cols_left))
+        if cols_left == 1:
+            column = remaining_idx
+        else:
+            column, remaining_idx = (
+                remaining_idx[part]
+                for part in _weighted_cut(centroids[remaining_idx, 0], costs[remaining_idx], n_rows / remaining_machines)
+            )
+        remaining_machines -= n_rows
+        rows_idx = column
+        for row in range(n_rows):
+            rows_left = n_rows - row
+            if rows_left == 1:
+                groups.append(rows_idx)
+            else:
+                top, rows_idx = (
+                    rows_idx[part]
+                    for part in _weighted_cut(centroids[rows_idx, 1], costs[rows_idx], 1 / rows_left)
+                )
+                groups.append(top)
+    return groups
+
+
+def shard_contours(contours, num_machines: int, method: str = "kd", pen_lift_cost_mm: float = 5.0) -> list[Shard]:
+    """
+    Partitions contours into num_machines shards with roughly equal drawing cost.
+    Runs in O(N log N) over the number of contours (all per-point work is vectorized).
+    """
+    if method not in ("kd", "tiles"):
+        raise ValueError(f"Unknown sharding method: {method}")
+    centroids, costs = contour_stats(contours, pen_lift_cost_mm)
+    indices = np.arange(len(contours))
+    split = _kd_split if method == "kd" else _tile_split
+    shards = []
+    for group in split(indices, centroids, costs, num_machines):
+        shard_contours_ = [contours[i] for i in sorted(group)]
+        if shard_contours_:
+            points = np.concatenate([contour.reshape(-1, 2) for contour in shard_contours_])
+            bbox = (*points.min(axis=0), *points.max(axis=0))
+        else:
+            bbox = (0.0, 0.0, 0.0, 0.0)
+        shards.append(Shard(shard_contours_, tuple(float(v) for v in bbox), float(costs[group].sum())))
+    costs_per_shard = [shard.cost_mm for shard in shards]
+    log.info(
+        f"Split {len(contours)} contours into {len(shards)} shards, "
+        f"cost balance (max/mean): {max(costs_per_shard) / max(np.mean(costs_per_shard), 1e-9):.2f}"
+    )
+    return shards
+
+
+def make_shard_gcode(shards: list[Shard], gcode_generator: GcodeGenerator, machine_origins_mm=None, output_dir: Path = LOG_DIR) -> list[Path]:
+    """
+    Writes one G-code file per shard (<output_dir>/drawing_toolpath_<i>.gcode).
+    The xy offset of machine i is shifted so that its origin (machine_origins_mm[i], or the
+    center of its shard by default) lands on the machine's configured xy_offset_mm.
+    """
+    if machine_origins_mm and len(machine_origins_mm) < len(shards):
+        raise ValueError(f"machine_origins_mm lists {len(machine_origins_mm)} origins for {len(shards)} machines")
+    files = []
+    for i, shard in enumerate(shards):
+        origin = machine_origins_mm[i] if machine_origins_mm else shard.center
+        # gcode y axis is flipped with respect to the canvas (image) y axis
+        xy_offset = (
+            gcode_generator.xy_offset_mm[0] - origin[0],
+            gcode_generator.xy_offset_mm[1] + origin[1],
+        )
+        generator = gcode_generator.model_copy(update={"xy_offset_mm": xy_offset})
+        files.append(generator.make_gcode_from_countours(shard.contours, output_dir / f"drawing_toolpath_{i}.gcode"))
+    return files
+
+
+def shard_to_gcode(canvas_contours, gcode_generator: GcodeGenerator, settings: ShardSettings = None, output_dir: Path = LOG_DIR) -> list[Path]:
+    """Partitions the scaled contours according to ShardSettings and writes one G-code file per machine."""
+    if settings is None:
+        settings = ShardSettings.load()
+    shards = shard_contours(canvas_contours, settings.num_machines, settings.method, settings.pen_lift_cost_mm)
+    return make_shard_gcode(shards, gcode_generator, settings.machine_origins_mm, output_dir)
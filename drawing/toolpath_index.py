@@ -0,0 +1,201 @@
+"""
+Sidecar index of a G-code file, to resume an interrupted drawing without starting over.
+
+For every contour the index stores where it starts in the file (line and byte offset), the distance
+and estimated time (see gcode_analysis) drawn before it, and the machine state when it starts.
+It is written next to the G-code (drawing_toolpath.gcode -> drawing_toolpath.gcode.idx.npy) as a
+numpy structured array, and opened with a memory map, so finding contour N, or the contour being
+drawn after a given time, does not read the G-code or the rest of the index.
+
+A contour starts with the last pen-up move before the pen goes down (the travel to its first point).
+Resume programs start with the modal setup of the file header (units, positioning, feedrate), lift the pen
+(GcodeGenerator.pen_up_command, then Z), travel to the first point of the contour, and continue with the file
+from the contour start (which lowers the pen).
+
+Usage:
+    python drawing/toolpath_index.py --file drawing_toolpath.gcode --elapsed 3600 --output resume.gcode
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import mmap
+import shutil
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+from drawing.gcode_analysis import MachineProfile, GcodeAnalysisSettings, parse_gcode, move_times, pen_down_mask, _ffill_index
+
+INDEX_DTYPE = np.dtype([
+    ("line", np.int64),  # line (0 based) of the contour's first move
+    ("offset", np.int64),  # byte offset of that line
+    ("distance_mm", np.float64),  # distance moved before the contour (drawing and travel)
+    ("time_s", np.float64),  # estimated time before the contour
+    ("x", np.float64),  # machine position when the contour starts
+    ("y", np.float64),
+    ("z", np.float64),
+    ("pen_down", np.bool_),  # pen state when the contour starts
+    ("start_x", np.float64),  # first point of the contour
+    ("start_y", np.float64),
+    ("pen_up_z", np.float64),  # height of the travel to the first point
+    ("feedrate", np.float64),  # modal feedrate (mm/min) when the contour starts
+])
+
+_SETUP_CODES = ("G20", "G21", "G90", "G91")
+
+
+def index_path(gcode_file: Union[str, Path]) -> Path:
+    gcode_file = Path(gcode_file)
+    return gcode_file.with_name(gcode_file.name + ".idx.npy")
+
+
+def build_index(data: bytes, profile: MachineProfile) -> np.ndarray:
+    """One INDEX_DTYPE row per contour of the G-code in data"""
+    toolpath = parse_gcode(data.decode())
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    line_offsets = np.concatenate([[0], newlines + 1])
+
+    pen_down = pen_down_mask(toolpath)
+    previous_down = np.concatenate([[False], pen_down[:-1]])
+    # first move of every pen-down run, and first move of the pen-up run before it
+    run_starts = np.flatnonzero(pen_down & ~previous_down)
+    up_run_starts = _ffill_index(~pen_down & previous_down)[np.maximum(run_starts - 1, 0)]
+    up_run_starts = np.where(run_starts > 0, np.maximum(up_run_starts, 0), 0)
+    # the contour starts with the last travel in xy of the pen-up run (lift, travel, lower the pen),
+    # or with the pen-up run itself if it has no travel
+    travel = ~pen_down & np.any(np.abs(toolpath.end[:, :2] - toolpath.start[:, :2]) > 1e-9, axis=1)
+    last_travel = _ffill_index(travel)[np.maximum(run_starts - 1, 0)]
+    entries = np.where((run_starts > 0) & (last_travel >= up_run_starts), last_travel, up_run_starts)
+
+    distance = np.concatenate([[0.0], np.cumsum(np.linalg.norm(toolpath.end - toolpath.start, axis=1))])
+    time = np.concatenate([[0.0], np.cumsum(move_times(toolpath, profile))])
+    pen_down_z = toolpath.end[:, 2].min() if len(toolpath.line) else 0.0
+
+    index = np.zeros(len(entries), dtype=INDEX_DTYPE)
+    index["line"] = toolpath.line[entries]
+    index["offset"] = line_offsets[index["line"]]
+    index["distance_mm"] = distance[entries]
+    index["time_s"] = time[entries]
+    index["x"], index["y"], index["z"] = toolpath.start[entries].T
+    index["pen_down"] = toolpath.start[entries, 2] <= pen_down_z + 1e-3
+    index["start_x"], index["start_y"], index["pen_up_z"] = toolpath.end[entries].T
+    index["feedrate"] = toolpath.feedrate[entries]
+    return index
+
+
+def write_index(gcode_file: Union[str, Path], data: bytes = None, profile: MachineProfile = None) -> Path:
+    """Indexes a G-code file (data: its content, if already in memory) and saves the index next to it."""
+    if data is None:
+        data = Path(gcode_file).read_bytes()
+    if profile is None:
+        profile = GcodeAnalysisSettings.load().profile()
+    path = index_path(gcode_file)
+    np.save(path, build_index(data, profile))
+    return path
+
+
+class ToolpathIndex:
+    """
+    Memory mapped index of a G-code file.
+
+    gcode_file: the indexed G-code file (its index is built if missing)
+    """
+
+    def __init__(self, gcode_file: Union[str, Path]):
+        self.gcode_file = Path(gcode_file)
+        path = index_path(gcode_file)
+        if not path.exists() or path.stat().st_mtime < self.gcode_file.stat().st_mtime:
+            log.info(f"Indexing {self.gcode_file}")
+            write_index(self.gcode_file)
+        self.entries = np.load(path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def contour_at(self, elapsed_s: float) -> int:
+        """Contour being drawn elapsed_s seconds (estimated) after the start"""
+        return max(0, int(np.searchsorted(self.entries["time_s"], elapsed_s, side="right")) - 1)
+
+    def contour_of_line(self, line: int) -> int:
+        """Contour the line (0 based) belongs to"""
+        return max(0, int(np.searchsorted(self.entries["line"], line, side="right")) - 1)
+
+    def _check(self, contour: int):
+        if not 0 <= contour < len(self.entries):
+            raise IndexError(f"contour {contour} out of range, the file has {len(self.entries)} contours")
+
+    def header_lines(self) -> list[str]:
+        """Lines before the first contour (start commands)"""
+        with open(self.gcode_file, "rb") as f:
+            header = f.read(int(self.entries["offset"][0]) if len(self.entries) else 0)
+        return header.decode().splitlines()
+
+    def resume_preamble(self, contour: int, pen_up_mm: float = None, pen_up_command: str = None) -> list[str]:
+        """
+        Commands that bring the machine, from any state, to the start of the contour with the pen up:
+        modal setup, pen up, travel to the first point of the contour. Homing and other header commands are not repeated.
+        pen_up_command lifts a servo or solenoid pen (GcodeGenerator.pen_up_command unless given).
+        """
+        self._check(contour)
+        entry = self.entries[contour]
+        pen_up_mm = float(entry["pen_up_z"]) if pen_up_mm is None else pen_up_mm
+        if pen_up_command is None:
+            from drawing.gcode import GcodeGenerator
+
+            pen_up_command = GcodeGenerator.load().pen_up_command
+        preamble = []
+        for line in self.header_lines():
+            line = line.split(";", 1)[0].strip()
+            if line.upper().startswith(_SETUP_CODES):
+                preamble.append(line)
+        preamble.append(f"G0 F{round(float(entry['feedrate']), 3)}")
+        if pen_up_command:
+            preamble.extend(pen_up_command.splitlines())
+        preamble.append(f"G0 Z{round(float(pen_up_mm), 3)}")
+        preamble.append(f"G0 X{round(float(entry['start_x']), 3)} Y{round(float(entry['start_y']), 3)}")
+        return preamble
+
+    def resume_lines(self, contour: int, pen_up_mm: float = None, pen_up_command: str = None) -> tuple[list[str], list[str], int]:
+        """returns (preamble, lines of the file from the contour start, line number of the first of those lines)"""
+        preamble = self.resume_preamble(contour, pen_up_mm, pen_up_command)
+        entry = self.entries[contour]
+        with open(self.gcode_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            lines = data[int(entry["offset"]):].decode().splitlines()
+        return preamble, lines, int(entry["line"])
+
+    def write_resume_program(self, contour: int, output: Union[str, Path], pen_up_mm: float = None, pen_up_command: str = None) -> Path:
+        """Writes a G-code file that resumes the drawing at the contour (preamble, then the file from the contour start)."""
+        preamble = self.resume_preamble(contour, pen_up_mm, pen_up_command)
+        output = Path(output)
+        with open(self.gcode_file, "rb") as src, open(output, "wb") as dst:
+            dst.write(("\n".join(preamble) + "\n").encode())
+            src.seek(int(self.entries["offset"][contour]))
+            shutil.copyfileobj(src, dst)
+        entry = self.entries[contour]
+        log.info(
+            f"Resume program saved to {output}: contour {contour}/{len(self.entries)} (line {entry['line']}), "
+            f"skipping {entry['time_s']:.0f}s and {entry['distance_mm'] / 1000:.1f}m of the drawing"
+        )
+        return output
+
+
+if __name__ == "__main__":
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--file", required=True, help="G-code file (indexed first if it has no index)")
+    parser.add_argument("--contour", type=int, default=None, help="Resume from this contour (0 based)")
+    parser.add_argument("--elapsed", type=float, default=None, help="Resume from the contour being drawn after this many seconds")
+    parser.add_argument("--output", type=str, default=None, help="Resume program to write (defaults to <file>.resume.gcode)")
+    args = parser.parse_args()
+
+    index = ToolpathIndex(args.file)
+    log.info(
+        f"{len(index)} contours, estimated drawing time of the last contour start: "
+        f"{index.entries['time_s'][-1] if len(index) else 0:.0f}s"
+    )
+    if args.contour is not None or args.elapsed is not None:
+        contour = args.contour if args.contour is not None else index.contour_at(args.elapsed)
+        index.write_resume_program(contour, args.output or Path(args.file).with_suffix(".resume.gcode"))
@@ -1,19 +1,313 @@
+"""
+Traces the outlines of the strokes of a drawing with OpenCV's findContours.
+
+Large images (scans of several thousand pixels per side) are traced in tiles on a process pool,
+so that peak memory is proportional to the tile size instead of the image size:
+- the grayscale image is written to a memory mapped file, that every worker reads its window from
+- every tile traces its window (the tile plus a margin) and keeps the contours that do not touch the
+  inner edges of the window: those are exactly the contours the whole image would give.
+  A contour complete in several windows is kept by one of them only (decided from its bounding box).
+- contours that are cut in every window (longer than the margin) are traced again in grown regions:
+  pieces traced by neighbouring tiles that share pixels near the seams are grouped,
+  and the bounding box of each group is traced as a whole.
+The result is the same set of contours as tracing the whole image at once.
+Memory is bounded by the tile size, except for strokes that cross tiles: those need their whole
+bounding box in one worker (one byte per pixel plus OpenCV's working copy).
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from pathlib import Path
+from typing import Union
+
 from PIL import Image
 import cv2
 import numpy as np
 
-def trace_image(img:Image):
+from settings.settings_base import BaseSettingsModel
+from tracing import traced
+
+
+class TraceSettings(BaseSettingsModel):
+    """Tracing settings:
+
+    tiled_above_px: int = 16000000
+        - Images with more pixels than this are traced in tiles (about 4000x4000).
+
+    tile_size_px: int = 2048
+        - Side of the tiles.
+
+    tile_margin_px: int = 256
+        - Overlap added around each tile. Contours smaller than the margin never need to be traced again.
+
+    workers: int = 0
+        - Processes tracing tiles in parallel (0 uses every core).
+
+    threshold: int = 220
+        - Pixels darker than this (0-255) are part of a stroke.
+    """
+    tiled_above_px: int = 16_000_000
+    tile_size_px: int = 2048
+    tile_margin_px: int = 256
+    workers: int = 0
+    threshold: int = 220
+
+
+def _find_contours(gray: np.ndarray, threshold: int, method=cv2.CHAIN_APPROX_SIMPLE, in_place=False):
+    # dark strokes on a white background (thresholded in place when the array is a throwaway copy)
+    _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV, dst=gray if in_place else None)
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, method)
+    return contours
+
+
+def _compress(contour: np.ndarray) -> np.ndarray:
+    """CHAIN_APPROX_NONE contour -> the CHAIN_APPROX_SIMPLE one (only the points where the direction changes)"""
+    points = contour.reshape(-1, 2)
+    if len(points) <= 2:
+        return contour
+    step_in = points - np.roll(points, 1, axis=0)
+    step_out = np.roll(points, -1, axis=0) - points
+    return contour[np.any(step_in != step_out, axis=1)]
+
+
+def _sort_contours(contours):
+    """longest first (ties by start point and points, so the order does not depend on how the image was traced)"""
+    keys = [
+        (-cv2.arcLength(contour, False), int(contour[0, 0, 1]), int(contour[0, 0, 0]), len(contour))
+        for contour in contours
+    ]
+    order = sorted(range(len(contours)), key=keys.__getitem__)
+    sorted_contours = []
+    for _, group in groupby(order, key=keys.__getitem__):
+        group = [contours[i] for i in group]
+        if len(group) > 1:
+            # same length and start point (e.g. the outer and inner border of a thin line)
+            group.sort(key=lambda contour: contour.tobytes())
+        sorted_contours.extend(group)
+    return sorted_contours
+
+
+def _bbox(contour) -> tuple[int, int, int, int]:
+    """(x0, y0, x1, y1), max inclusive"""
+    points = contour.reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+class _TileGrid:
+    """Tiles of `size` pixels, traced in windows grown by `margin` pixels."""
+
+    def __init__(self, width: int, height: int, size: int, margin: int):
+        self.width, self.height, self.size = width, height, size
+        # a contour crossing from one tile to the next must be traced over at least two pixels in both windows
+        self.margin = max(margin, 2)
+        self.cols = -(-width // size)
+        self.rows = -(-height // size)
+
+    def core(self, row: int, col: int) -> tuple[int, int, int, int]:
+        """(x0, y0, x1, y1), max exclusive"""
+        return (
+            col * self.size,
+            row * self.size,
+            min((col + 1) * self.size, self.width),
+            min((row + 1) * self.size, self.height),
+        )
+
+    def window(self, row: int, col: int) -> tuple[int, int, int, int]:
+        """(x0, y0, x1, y1), max exclusive"""
+        x0, y0, x1, y1 = self.core(row, col)
+        return (
+            max(x0 - self.margin, 0),
+            max(y0 - self.margin, 0),
+            min(x1 + self.margin, self.width),
+            min(y1 + self.margin, self.height),
+        )
+
+    def _holding_range(self, low: int, high: int, n: int, extent: int) -> range:
+        """tiles along one axis whose window contains [low, high] without touching an inner edge"""
+        # window i spans [i*size - margin, (i+1)*size + margin), clipped to the image.
+        # low side: low > i*size - margin, or the window starts at the image edge (i*size <= margin)
+        last = max((low + self.margin - 1) // self.size, self.margin // self.size)
+        # high side: high < (i+1)*size + margin - 1, or the window ends at the image edge
+        first = min((high - self.margin + 1) // self.size, -(-(extent - self.margin) // self.size) - 1)
+        return range(max(first, 0), min(last, n - 1) + 1)
+
+    def canonical_tile(self, bbox):
+        """
+        The one tile that keeps a contour: the tile containing the top left corner of its bounding box
+        if its window holds the whole contour, otherwise the first tile whose window does.
+        None if no window holds it.
+        """
+        x0, y0, x1, y1 = bbox
+        cols = self._holding_range(x0, x1, self.cols, self.width)
+        rows = self._holding_range(y0, y1, self.rows, self.height)
+        if not cols or not rows:
+            return None
+        row, col = y0 // self.size, x0 // self.size
+        if row in rows and col in cols:
+            return (row, col)
+        return (rows[0], cols[0])
+
+
+def _touches_inner_edge(bbox, window, width, height) -> bool:
+    x0, y0, x1, y1 = bbox
+    wx0, wy0, wx1, wy1 = window
+    return (
+        (wx0 > 0 and x0 <= wx0)
+        or (wy0 > 0 and y0 <= wy0)
+        or (wx1 < width and x1 >= wx1 - 1)
+        or (wy1 < height and y1 >= wy1 - 1)
+    )
+
+
+def _trace_tile(gray_file: str, grid: _TileGrid, row: int, col: int, threshold: int):
+    """
+    Returns (contours kept by this tile, contours cut by the window edges).
+    Cut contours are returned as (bounding box, their points near the tile seams), the points
+    are used to find the pieces of the same contour traced by the neighbouring tiles.
+    """
+    wx0, wy0, wx1, wy1 = window = grid.window(row, col)
+    cx0, cy0, cx1, cy1 = grid.core(row, col)
+    gray = np.load(gray_file, mmap_mode="r")
+    contours = _find_contours(np.array(gray[wy0:wy1, wx0:wx1]), threshold, cv2.CHAIN_APPROX_NONE, in_place=True)
+    offset = np.array([wx0, wy0], dtype=np.int32)
+    kept, cut = [], []
+    for contour in contours:
+        contour = contour + offset
+        bbox = _bbox(contour)
+        if _touches_inner_edge(bbox, window, grid.width, grid.height):
+            points = contour.reshape(-1, 2)
+            near_seam = (
+                (points[:, 0] < cx0 + 2) | (points[:, 0] >= cx1 - 2)
+                | (points[:, 1] < cy0 + 2) | (points[:, 1] >= cy1 - 2)
+            )
+            cut.append((bbox, points[near_seam]))
+        elif grid.canonical_tile(bbox) == (row, col):
+            kept.append(_compress(contour))
+    return kept, cut
+
+
+def _first_holding_region(bbox, regions: np.ndarray) -> int:
+    x0, y0, x1, y1 = bbox
+    holding = (regions[:, 0] <= x0) & (regions[:, 1] <= y0) & (regions[:, 2] >= x1) & (regions[:, 3] >= y1)
+    return int(np.argmax(holding)) if holding.any() else -1
+
+
+def _trace_region(gray_file: str, grid: _TileGrid, regions: np.ndarray, index: int, threshold: int):
+    """Contours of region `index` (x0, y0, x1, y1 inclusive) that no tile window holds completely"""
+    x0, y0, x1, y1 = regions[index]
+    # one pixel of context around the region, so that contours inside it do not touch the edges
+    wx0, wy0, wx1, wy1 = max(x0 - 1, 0), max(y0 - 1, 0), min(x1 + 2, grid.width), min(y1 + 2, grid.height)
+    gray = np.load(gray_file, mmap_mode="r")
+    contours = _find_contours(np.array(gray[wy0:wy1, wx0:wx1]), threshold, in_place=True)
+    offset = np.array([wx0, wy0], dtype=np.int32)
+    kept = []
+    for contour in contours:
+        contour = contour + offset
+        bbox = _bbox(contour)
+        # regions can overlap: a contour is kept by the first region holding it
+        if grid.canonical_tile(bbox) is None and _first_holding_region(bbox, regions) == index:
+            kept.append(contour)
+    return kept
+
+
+def _group_cut_contours(cut: list, width: int) -> np.ndarray:
+    """
+    Pieces of the same contour traced by neighbouring tiles share pixels near the seams.
+    Groups the pieces sharing pixels, and returns the bounding box of every group.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(cut)
+    points = np.concatenate([piece_points for _, piece_points in cut])
+    piece = np.repeat(np.arange(n), [len(piece_points) for _, piece_points in cut])
+    keys = points[:, 1].astype(np.int64) * width + points[:, 0]
+    order = np.argsort(keys, kind="stable")
+    keys, piece = keys[order], piece[order]
+    shared = keys[1:] == keys[:-1]
+    links = coo_matrix((np.ones(shared.sum()), (piece[:-1][shared], piece[1:][shared])), shape=(n, n))
+    _, labels = connected_components(links, directed=False)
+    boxes = np.array([bbox for bbox, _ in cut])
+    regions = np.full((labels.max() + 1, 4), -1, dtype=np.int64)
+    regions[:, :2] = np.iinfo(np.int64).max
+    np.minimum.at(regions[:, 0], labels, boxes[:, 0])
+    np.minimum.at(regions[:, 1], labels, boxes[:, 1])
+    np.maximum.at(regions[:, 2], labels, boxes[:, 2])
+    np.maximum.at(regions[:, 3], labels, boxes[:, 3])
+    return regions
+
+
+def _image_size(img: Union[Image.Image, np.ndarray]) -> tuple[int, int]:
+    return (img.shape[1], img.shape[0]) if isinstance(img, np.ndarray) else img.size
+
+
+def _write_grayscale(img: Union[Image.Image, np.ndarray], path: Path, strip_px: int = 1024) -> tuple[int, int]:
+    """Converts the image to grayscale strip by strip, into a memory mapped .npy file"""
+    width, height = _image_size(img)
+    gray = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(height, width))
+    for y0 in range(0, height, strip_px):
+        y1 = min(y0 + strip_px, height)
+        if isinstance(img, np.ndarray):
+            gray[y0:y1] = img[y0:y1]
+        else:
+            gray[y0:y1] = np.asarray(img.crop((0, y0, width, y1)).convert("L"))
+    gray.flush()
+    del gray
+    return width, height
+
+
+def trace_image_tiled(img: Union[Image.Image, np.ndarray], settings: TraceSettings):
+    workers = settings.workers or os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gray_file = str(Path(tmp_dir) / "grayscale.npy")
+        width, height = _write_grayscale(img, gray_file)
+        grid = _TileGrid(width, height, settings.tile_size_px, settings.tile_margin_px)
+        contours, cut = [], []
+        with ProcessPoolExecutor(workers) as pool:
+            tiles = [
+                pool.submit(_trace_tile, gray_file, grid, row, col, settings.threshold)
+                for row in range(grid.rows) for col in range(grid.cols)
+            ]
+            for tile in tiles:
+                kept, cut_pieces = tile.result()
+                contours.extend(kept)
+                cut.extend(cut_pieces)
+            regions = _group_cut_contours(cut, width) if cut else np.zeros((0, 4), dtype=np.int64)
+            largest = int(((regions[:, 2] - regions[:, 0] + 1) * (regions[:, 3] - regions[:, 1] + 1)).max()) if len(regions) else 0
+            log.debug(
+                f"traced {grid.rows}x{grid.cols} tiles, {len(contours)} contours inside tiles, "
+                f"{len(regions)} regions traced again for contours crossing tiles (largest {largest} px)"
+            )
+            for region_contours in pool.map(
+                _trace_region, *zip(*[(gray_file, grid, regions, i, settings.threshold) for i in range(len(regions))])
+            ):
+                contours.extend(region_contours)
+    return contours
+
+
+@traced()
+def trace_image(img: Union[Image.Image, np.ndarray], settings: Union[TraceSettings, None] = None):
     """
     Traces the edges of an image using OpenCV's findContours function.
+    img is a PIL image or a grayscale uint8 array (as returned by drawing.image_io), which is used as is.
+    Images larger than TraceSettings.tiled_above_px are traced in tiles.
     """
-    # as grayscale
-    img_grayscale = img.convert('L')
-    # as array
-    img_array = np.asarray(img_grayscale)
-    # Convert image to binary using thresholding
-    _, binary = cv2.threshold(img_array, 220, 255, cv2.THRESH_BINARY_INV)
-    # Use cv2.findContours to find the outlines of the strokes
-    contours, _ = cv2.findContours((binary * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    if settings is None:
+        settings = TraceSettings.load()
+    width, height = _image_size(img)
+    if width * height > settings.tiled_above_px:
+        contours = trace_image_tiled(img, settings)
+    else:
+        # as grayscale array
+        img_array = img if isinstance(img, np.ndarray) else np.asarray(img.convert("L"))
+        # Use cv2.findContours to find the outlines of the strokes
+        contours = _find_contours(img_array, settings.threshold)
     # sort contours by length
-    contours = sorted(contours, key=lambda x: cv2.arcLength(x, False), reverse=True)
-    return contours
\ No newline at end of file
+    return _sort_contours(contours)
@@ -0,0 +1,456 @@
+"""
+Long running drawing service, for kiosks where every visitor starts a new drawing.
+
+Running run_drawing_robot.py for every drawing reloads Whisper, the OpenAI clients, the voice prompts,
+the settings and the RoboDK station each time. The service loads them once at startup and then accepts
+drawing jobs over a local HTTP API. Jobs go through two pipelined stages, each on its own thread:
+- prepare: listen + transcribe (optional), generate the image, trace, scale and write the G-code
+- draw: execute the G-code with the configured MODE (see robot_modes.py)
+so job N+1 is generated and traced while job N is being drawn.
+
+API:
+    POST /jobs          {"prompt": "a cat"}, {"img_path": "cat.png"} or {"listen": true} -> 202 {"id": ...}
+    GET  /jobs          all jobs
+    GET  /jobs/<id>     one job (status, prompt, G-code file, per-stage timings, error)
+    GET  /metrics       queue depth and per-stage latency (count, mean, p50, p95, max)
+    GET  /health
+
+Usage:
+    python drawing_service.py --mode octoprint
+    curl -X POST localhost:8765/jobs -d '{"prompt": "a cat playing piano"}'
+"""
+from project_init import SharedLogger, ArgParser, LOG_DIR
+
+log = SharedLogger.get_logger()
+
+import json
+import uuid
+from collections import deque
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from queue import Empty, Full, Queue
+from statistics import mean
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from settings.settings_base import BaseSettingsModel
+
+JOBS_DIR = LOG_DIR / "jobs"
+
+
+class ServiceSettings(BaseSettingsModel):
+    """Drawing service settings:
+
+    host: str = "127.0.0.1"
+        - Address the HTTP API listens on.
+
+    port: int = 8765
+        - Port the HTTP API listens on.
+
+    mode: str = "no_robot"
+        - How drawings are executed (robodk, octoprint, no_robot, dispatch, serial).
+
+    max_queued_jobs: int = 16
+        - Jobs waiting to be prepared. New jobs are rejected (HTTP 503) when the queue is full.
+
+    prepared_jobs_buffer: int = 1
+        - Jobs that can be prepared ahead of the drawing in progress.
+
+    voice_prompts: bool = True
+        - Load Whisper and the spoken prompts at startup, so jobs can be submitted with {"listen": true}.
+
+    listen_duration_s: int = 10
+        - Seconds of audio recorded for {"listen": true} jobs.
+
+    latency_window: int = 100
+        - Number of recent jobs the latency metrics are computed over.
+
+    finished_jobs_retained: int = 100
+        - Done and failed jobs kept for GET /jobs; older ones are forgotten (their files stay in the jobs directory).
+    """
+    host: str = "127.0.0.1"
+    port: int = 8765
+    mode: str = "no_robot"
+    max_queued_jobs: int = 16
+    prepared_jobs_buffer: int = 1
+    voice_prompts: bool = True
+    listen_duration_s: int = 10
+    latency_window: int = 100
+    finished_jobs_retained: int = 100
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    PREPARING = "preparing"
+    READY = "ready"
+    DRAWING = "drawing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ServiceJob(BaseModel):
+    id: str
+    prompt: Optional[str] = None
+    img_path: Optional[str] = None
+    listen: bool = False
+    status: JobStatus = JobStatus.QUEUED
+    submitted_at: float
+    finished_at: Optional[float] = None
+    gcode_file: Optional[Path] = None
+    estimated_time_s: Optional[float] = None
+    shard_files: list[Path] = []
+    timings: dict[str, float] = {}
+    error: Optional[str] = None
+
+
+class StageLatency:
+    """Durations of the last `window` runs of each stage."""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._durations: dict[str, deque] = {}
+        self._lock = Lock()
+
+    def record(self, stage: str, duration_s: float):
+        with self._lock:
+            self._durations.setdefault(stage, deque(maxlen=self.window)).append(duration_s)
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "mean_s": mean(values),
+                "p50_s": values[len(values) // 2],
+                "p95_s": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max_s": values[-1],
+            }
+            for stage, values in durations.items()
+        }
+
+
+class DrawingService:
+    """
+    Keeps the models, clients, settings and robot connection loaded, and runs submitted jobs
+    through the prepare and draw stages.
+    """
+
+    def __init__(self, settings: ServiceSettings):
+        from robot_modes import MODE
+
+        self.settings = settings
+        self.mode = MODE(settings.mode)
+        self.jobs: dict[str, ServiceJob] = {}
+        self._jobs_lock = Lock()
+        self._prepare_queue: Queue = Queue(settings.max_queued_jobs)
+        self._draw_queue: Queue = Queue(settings.prepared_jobs_buffer)
+        self.latency = StageLatency(settings.latency_window)
+        self.started_at = time()
+        self._threads = []
+        self._stopping = Event()
+        self.rdk = None
+        self.recordings = None
+        JOBS_DIR.mkdir(exist_ok=True, parents=True)
+
+    def warm_up(self):
+        """Load everything the pipeline needs once, instead of once per drawing."""
+        from drawing.canvas_scale import CanvasScaleSettings
+        from drawing.gcode import GcodeGenerator
+        from drawing.shard import ShardSettings
+        from drawing.gcode_analysis import GcodeAnalysisSettings
+        from drawing.trace_edges import TraceSettings
+        from drawing.generate_img import get_client
+        from robot_modes import MODE, uses_shards
+
+        t0 = perf_counter()
+        self.trace_settings = TraceSettings.load()
+        self.canvas_settings = CanvasScaleSettings.load()
+        self.gcode_generator = GcodeGenerator.load()
+        self.shard_settings = ShardSettings.load()
+        self.use_shards = uses_shards(self.mode, self.shard_settings.num_machines)
+        self.analysis_settings = GcodeAnalysisSettings.load()
+        get_client()
+        if self.settings.voice_prompts:
+            from speech_to_text.transcribe import TranscriptionSettings, load_model
+            from text_to_speech.dictate import RecordingSetting, Recordings
+
+            self.recordings = Recordings.load()
+            for text in self._voice_prompt_texts():
+                self.recordings.get_or_create(RecordingSetting(text=text))
+            self.transcription_settings = TranscriptionSettings.load()
+            load_model(self.transcription_settings)
+        if self.mode == MODE.ROBODK:
+            from simulation.launch_rdk import load_station
+
+            self.rdk = load_station()
+        log.info(f"Service ready in {perf_counter() - t0:.1f}s")
+
+    @staticmethod
+    def _voice_prompt_texts():
+        return (
+            "Hello! I am a drawing robot. What would you like me to draw?",
+            "Great! I will draw that for you. Please wait a moment.",
+        )
+
+    def _play(self, text):
+        from text_to_speech.dictate import RecordingSetting
+
+        self.recordings.get_or_create(RecordingSetting(text=text)).play()
+
+    def start(self):
+        self._threads = [
+            Thread(target=self._prepare_worker, name="prepare", daemon=True),
+            Thread(target=self._draw_worker, name="draw", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Finish the jobs already queued, then stop the stage threads."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, prompt: str = None, img_path: str = None, listen: bool = False) -> ServiceJob:
+        """Queue a new job. Raises Full when the queue is full or the service is stopping."""
+        if self._stopping.is_set():
+            raise Full("the service is stopping")
+        if [prompt is not None, img_path is not None, listen].count(True) != 1:
+            raise ValueError("a job needs exactly one of prompt, img_path or listen")
+        if listen and self.recordings is None:
+            raise ValueError("voice prompts are disabled in ServiceSettings")
+        if img_path is not None and not Path(img_path).exists():
+            raise ValueError(f"image not found: {img_path}")
+        job = ServiceJob(id=uuid.uuid4().hex[:12], prompt=prompt, img_path=img_path, listen=listen, submitted_at=time())
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            try:
+                self._prepare_queue.put_nowait(job.id)
+            except Full:
+                del self.jobs[job.id]
+                raise
+        log.info(f"Queued job {job.id}")
+        return job
+
+    def _timed(self, job: ServiceJob, stage: str, fn, *args, **kwargs):
+        t0 = perf_counter()
+        result = fn(*args, **kwargs)
+        duration = perf_counter() - t0
+        # replaced rather than updated, as the HTTP handler may be serializing the job
+        with self._jobs_lock:
+            job.timings = {**job.timings, stage: duration}
+        self.latency.record(stage, duration)
+        return result
+
+    def _fail(self, job: ServiceJob, e: Exception):
+        log.exception(f"Job {job.id} failed")
+        job.status = JobStatus.FAILED
+        job.error = repr(e)
+        job.finished_at = time()
+        self._finished()
+
+    def _finished(self):
+        """Forget the oldest finished jobs beyond the retention count, and write the stage timings so far"""
+        import tracing
+
+        with self._jobs_lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.status in (JobStatus.DONE, JobStatus.FAILED)]
+            for job_id in finished[:max(0, len(finished) - self.settings.finished_jobs_retained)]:
+                del self.jobs[job_id]
+        # a no-op unless the service runs with --trace
+        tracing.write_results(log_table=False)
+
+    def _prepare(self, job: ServiceJob):
+        from drawing.image_io import read_grayscale
+        from drawing.trace_edges import trace_image
+        from drawing.canvas_scale import scale_contours_to_canvas
+        from drawing.shard import shard_to_gcode
+        from drawing.gcode_analysis import check_time_budget
+
+        job_dir = JOBS_DIR / job.id
+        job_dir.mkdir(exist_ok=True)
+        if job.listen:
+            from speech_to_text.transcribe import record_and_transcribe
+
+            texts = self._voice_prompt_texts()
+            self._play(texts[0])
+            job.prompt = self._timed(
+                job, "listen", record_and_transcribe, self.settings.listen_duration_s, job_dir / "response.wav", True,
+                self.transcription_settings,
+            ).strip()
+            log.info(f"Job {job.id} transcription: {job.prompt}")
+            self._play(texts[1])
+        if job.img_path is not None:
+            img = self._timed(job, "load_image", read_grayscale, job.img_path)
+        else:
+            from drawing.generate_img import generate_drawing
+
+            img = self._timed(job, "generate", generate_drawing, job.prompt, job_dir / "drawing.png")
+        contours = self._timed(job, "trace", trace_image, img, self.trace_settings)
+        canvas_contours = self._timed(job, "scale", scale_contours_to_canvas, contours, self.canvas_settings)
+        job.gcode_file = self._timed(
+            job, "gcode", self.gcode_generator.make_gcode_from_countours, canvas_contours, job_dir / "drawing_toolpath.gcode",
+            self.analysis_settings.profile(),
+        )
+        if self.use_shards:
+            job.shard_files = self._timed(
+                job, "shard", shard_to_gcode, canvas_contours, self.gcode_generator, self.shard_settings, job_dir
+            )
+        # raises TimeBudgetExceeded (the job fails) when the drawing would take too long;
+        # shards are drawn at the same time, the longest one is the drawing time
+        stats = self._timed(job, "analyze", check_time_budget, job.shard_files or job.gcode_file, self.analysis_settings)
+        job.estimated_time_s = stats.estimated_time_s
+
+    def _prepare_worker(self):
+        while True:
+            try:
+                job_id = self._prepare_queue.get(timeout=0.1)
+            except Empty:
+                if self._stopping.is_set():
+                    # queue drained, let the draw stage finish
+                    self._draw_queue.put(None)
+                    return
+                continue
+            job = self.jobs[job_id]
+            self.latency.record("queue_wait", time() - job.submitted_at)
+            job.status = JobStatus.PREPARING
+            try:
+                self._prepare(job)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            job.status = JobStatus.READY
+            # blocks while the buffer of prepared jobs is full, i.e. while the robot is busy
+            self._draw_queue.put(job_id)
+
+    def _draw_worker(self):
+        from robot_modes import run_on_robot
+
+        while True:
+            job_id = self._draw_queue.get()
+            if job_id is None:
+                return
+            job = self.jobs[job_id]
+            job.status = JobStatus.DRAWING
+            try:
+                self._timed(job, "draw", run_on_robot, self.mode, job.gcode_file, job.shard_files, self.rdk)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            job.status = JobStatus.DONE
+            job.finished_at = time()
+            self.latency.record("end_to_end", job.finished_at - job.submitted_at)
+            log.info(f"Job {job.id} done in {job.finished_at - job.submitted_at:.1f}s")
+            self._finished()
+
+    def job_info(self, job_id: str = None):
+        """JSON ready copy of one job (None if unknown), or of all jobs if job_id is not given"""
+        with self._jobs_lock:
+            if job_id is None:
+                return [job.model_dump(mode="json") for job in self.jobs.values()]
+            job = self.jobs.get(job_id)
+            return None if job is None else job.model_dump(mode="json")
+
+    def metrics(self) -> dict:
+        with self._jobs_lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "uptime_s": time() - self.started_at,
+            "queue_depth": self._prepare_queue.qsize(),
+            "prepared_waiting": self._draw_queue.qsize(),
+            "jobs": {status.value: statuses.count(status) for status in JobStatus},
+            "stage_latency": self.latency.summary(),
+        }
+
+
+def _make_handler(service: DrawingService):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            log.debug("drawing service: " + format % args)
+
+        def _reply(self, status=200, body=None):
+            payload = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/health":
+                self._reply(200, {"status": "ok"})
+            elif path == "/metrics":
+                self._reply(200, service.metrics())
+            elif path == "/jobs":
+                self._reply(200, service.job_info())
+            elif path.startswith("/jobs/"):
+                job = service.job_info(path[len("/jobs/"):])
+                if job is None:
+                    self._reply(404, {"error": "Job not found"})
+                else:
+                    self._reply(200, job)
+            else:
+                self._reply(404, {"error": "Not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            if self.path.rstrip("/") != "/jobs":
+                self._reply(404, {"error": "Not found"})
+                return
+            try:
+                data = json.loads(body or b"{}")
+                job = service.submit(data.get("prompt"), data.get("img_path"), bool(data.get("listen", False)))
+            except (ValueError, AttributeError) as e:
+                self._reply(400, {"error": str(e)})
+            except Full:
+                self._reply(503, {"error": "Queue is full"})
+            else:
+                self._reply(202, {"id": job.id, "status": job.status.value})
+
+    return Handler
+
+
+def serve(settings: ServiceSettings):
+    service = DrawingService(settings)
+    service.warm_up()
+    service.start()
+    server = ThreadingHTTPServer((settings.host, settings.port), _make_handler(service))
+    server.daemon_threads = True
+    log.info(f"Drawing service listening on http://{settings.host}:{server.server_address[1]}/ (mode: {settings.mode})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Stopping, finishing queued jobs...")
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    # stage timings only with --trace, they are then written after every job
+    parser = ArgParser(description=__doc__, trace=False)
+    parser.add_argument("--mode", type=str, default=None, help="Overrides the mode in ServiceSettings")
+    parser.add_argument("--port", type=int, default=None, help="Overrides the port in ServiceSettings")
+    parser.add_argument("--no-voice", action="store_true", help="Do not load Whisper and the spoken prompts")
+    args = parser.parse_args()
+
+    settings = ServiceSettings.load()
+    if args.mode:
+        settings.mode = args.mode
+    if args.port is not None:
+        settings.port = args.port
+    if args.no_voice:
+        settings.voice_prompts = False
+    serve(settings)
@@ -3,20 +3,103 @@ from project_init import SharedLogger
 log = SharedLogger.get_logger()
 
 import os
+from threading import Lock
+from typing import Union
 
 from third_party.octorest import OctoRest
 from settings.settings_base import BaseSettingsModel
 from pydantic import SecretStr
+from tracing import traced
 
 class OctoprintSettings(BaseSettingsModel):
+    """Octoprint settings:
+
+    octoprint_api_key: SecretStr
+        - Application key generated on the OctoPrint server.
+
+    octoprint_base_url: str
+        - Base URL of the OctoPrint server.
+
+    connect_timeout_s: float = 3.05
+        - Seconds to wait for a connection to the server.
+
+    read_timeout_s: float = 30.0
+        - Seconds to wait for the server to answer (uploads of large files may need more).
+
+    max_retries: int = 3
+        - Retries for failed connections and idempotent requests (GET, PUT, DELETE).
+
+    retry_backoff_s: float = 0.5
+        - Backoff factor between retries (0.5 -> 0.5s, 1s, 2s, ...).
+
+    pool_maxsize: int = 4
+        - Number of keep-alive connections kept open to each server.
+    """
     octoprint_api_key: SecretStr = SecretStr("YOUR_API_KEY")
     octoprint_base_url: str = "http://3dprinter/"
+    connect_timeout_s: float = 3.05
+    read_timeout_s: float = 30.0
+    max_retries: int = 3
+    retry_backoff_s: float = 0.5
+    pool_maxsize: int = 4
+
+
+# process wide cache of clients, keyed by (base url, api key)
+_clients: dict[tuple[str, str], OctoRest] = {}
+_clients_lock = Lock()
+_settings: Union[OctoprintSettings, None] = None
+
+
+def get_settings() -> OctoprintSettings:
+    """Load the OctoprintSettings once per process."""
+    global _settings
+    if _settings is None:
+        _settings = OctoprintSettings.load()
+    return _settings
+
+
+def get_client(base_url: str = None, api_key: str = None, settings: OctoprintSettings = None) -> OctoRest:
+    """
+    Returns a cached OctoRest client for the given server.
+    Clients keep their connection pool alive between calls and skip the version handshake,
+    so repeated calls to the same printer only pay for the request itself.
+    base_url and api_key default to the values in the settings file.
+    """
+    if settings is None:
+        settings = get_settings()
+    base_url = base_url or settings.octoprint_base_url
+    api_key = api_key or settings.octoprint_api_key.get_secret_value()
+    key = (base_url.rstrip("/"), api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            log.debug(f"creating OctoPrint client for {base_url}")
+            client = OctoRest(
+                url=base_url,
+                apikey=api_key,
+                timeout=(settings.connect_timeout_s, settings.read_timeout_s),
+                retries=settings.max_retries,
+                backoff_factor=settings.retry_backoff_s,
+                pool_maxsize=settings.pool_maxsize,
+                lazy=True,
+            )
+            _clients[key] = client
+    return client
+
+
+def clear_clients():
+    """Close and forget all cached clients."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
 
 
-def upload_file(file_path):
-    """Upload a file to OctoPrint."""
-    SETTINGS : OctoprintSettings = OctoprintSettings.load()
-    client = OctoRest(url=SETTINGS.octoprint_base_url, apikey=SETTINGS.octoprint_api_key.get_secret_value())
+@traced()
+def upload_file(file_path, client: OctoRest = None):
+    """Upload a file to OctoPrint and start printing it."""
+    if client is None:
+        client = get_client()
     response = client.upload(file_path, select=True, print=True)
     return response
 
@@ -0,0 +1,284 @@
+"""
+asyncio counterpart of third_party.octorest.OctoRest, for talking to many OctoPrint servers at once.
+
+Requests are built by the same OctoRequests helpers as the synchronous client,
+so both clients send exactly the same API calls.
+Each host gets a concurrency limit (semaphore) shared by every client that talks to it,
+so one slow printer only ever stalls its own requests.
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import asyncio
+import os
+from pathlib import Path
+from weakref import WeakKeyDictionary
+from urllib import parse as urlparse
+from typing import Union
+
+import aiohttp
+
+from third_party.octorest import OctoRequests, RequestSpec, check_status
+from octoprint import OctoprintSettings, get_settings
+
+# per host semaphores, shared by all clients running on the same event loop
+_host_limits: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def _host_limit(netloc: str, limit: int) -> asyncio.Semaphore:
+    limits = _host_limits.setdefault(asyncio.get_running_loop(), {})
+    if netloc not in limits:
+        limits[netloc] = asyncio.Semaphore(limit)
+    return limits[netloc]
+
+
+class AsyncOctoRest:
+    """
+    Encapsulates asynchronous communication with one OctoPrint instance
+
+    Usage:
+        async with AsyncOctoRest(url=url, apikey=key) as client:
+            job = await client.job_info()
+    """
+
+    def __init__(
+        self,
+        *,
+        url: str = None,
+        apikey: str = None,
+        session: aiohttp.ClientSession = None,
+        timeout: Union[float, tuple[float, float]] = None,
+        retries: int = 0,
+        backoff_factor: float = 0.0,
+        max_concurrency_per_host: int = 2,
+    ):
+        """
+        Same arguments as OctoRest, plus max_concurrency_per_host:
+        the maximum number of requests in flight to this client's host.
+        The session is created lazily (it needs a running event loop) unless one is provided.
+        """
+        if not url:
+            raise TypeError("Required argument 'url' not found or empty")
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme not in ["http", "https"]:
+            raise TypeError("Provided URL is not HTTP(S)")
+        if not parsed.netloc:
+            raise TypeError("Provided URL is empty")
+
+        self.url = "{}://{}".format(parsed.scheme, parsed.netloc)
+        self._netloc = parsed.netloc
+        self._apikey = apikey
+        self._session = session
+        self._owns_session = session is None
+        if isinstance(timeout, tuple):
+            timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        elif timeout is not None:
+            timeout = aiohttp.ClientTimeout(total=timeout)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrency_per_host = max_concurrency_per_host
+
+    @classmethod
+    def from_settings(cls, base_url: str = None, api_key: str = None, settings: OctoprintSettings = None):
+        """Create a client configured like octoprint.get_client"""
+        if settings is None:
+            settings = get_settings()
+        return cls(
+            url=base_url or settings.octoprint_base_url,
+            apikey=api_key or settings.octoprint_api_key.get_secret_value(),
+            timeout=(settings.connect_timeout_s, settings.read_timeout_s),
+            retries=settings.max_retries,
+            backoff_factor=settings.retry_backoff_s,
+            max_concurrency_per_host=settings.pool_maxsize,
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            headers = {"X-Api-Key": self._apikey} if self._apikey else {}
+            connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency_per_host)
+            self._session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, spec: RequestSpec, data=None, ret=True):
+        """
+        Perform the request described by spec.
+        Idempotent (GET) requests are retried with exponential backoff on connection errors
+        and on 429/502/503/504 replies; other requests are sent once.
+
+        Raises a RuntimeError when not 20x OK-ish
+
+        Returns JSON decoded data
+        """
+        url = urlparse.urljoin(self.url, spec.path)
+        attempts = 1 + (self.retries if spec.method == "GET" else 0)
+        async with _host_limit(self._netloc, self.max_concurrency_per_host):
+            for attempt in range(attempts):
+                last_attempt = attempt == attempts - 1
+                try:
+                    async with self.session.request(
+                        spec.method, url, params=spec.params, json=spec.json, data=data
+                    ) as response:
+                        if response.status in (429, 502, 503, 504) and not last_attempt:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history, status=response.status
+                            )
+                        text = await response.text()
+                        check_status(str(response.url), response.status, text)
+                        if ret and text:
+                            return await response.json(content_type=None)
+                        return None
+                except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                    if last_attempt:
+                        raise
+                    delay = self.backoff_factor * 2**attempt
+                    log.debug(f"{spec.method} {url} failed ({e}), retrying in {delay}s")
+                    await asyncio.sleep(delay)
+
+    ###########################
+    ### VERSION INFORMATION ###
+    ###########################
+
+    async def get_version(self):
+        """Retrieve information regarding server and API version"""
+        return await self._request(OctoRequests.version())
+
+    ###########################
+    ### CONNECTION HANDLING ###
+    ###########################
+
+    async def connection_info(self):
+        """Retrieve the current connection settings"""
+        return await self._request(OctoRequests.connection_info())
+
+    async def state(self):
+        """A shortcut to get the current state."""
+        return (await self.connection_info())["current"]["state"]
+
+    async def connect(self, *, port=None, baudrate=None, printer_profile=None, save=None, autoconnect=None):
+        """Instructs OctoPrint to connect to the printer (see OctoRest.connect)"""
+        spec = OctoRequests.connect(
+            port=port,
+            baudrate=baudrate,
+            printer_profile=printer_profile,
+            save=save,
+            autoconnect=autoconnect,
+        )
+        await self._request(spec, ret=False)
+
+    async def disconnect(self):
+        """Instructs OctoPrint to disconnect from the printer"""
+        await self._request(OctoRequests.disconnect(), ret=False)
+
+    #######################
+    ### FILE OPERATIONS ###
+    #######################
+
+    async def upload(self, file, *, location="local", select=False, print=False, userdata=None, path=None):
+        """
+        Upload a given file
+        It can be a path or a tuple with a filename and a file-like object (or bytes)
+        """
+        form = aiohttp.FormData()
+        for name, (_, value) in OctoRequests.upload_fields(
+            select=select, print=print, userdata=userdata, path=path
+        ).items():
+            form.add_field(name, str(value))
+        spec = OctoRequests.upload(location)
+        if isinstance(file, (str, os.PathLike)):
+            # read in a worker thread, so a large file does not stall the requests to the other printers
+            content = await asyncio.get_running_loop().run_in_executor(None, Path(file).read_bytes)
+            form.add_field("file", content, filename=os.path.basename(file), content_type="application/octet-stream")
+        else:
+            filename, content = file
+            if hasattr(content, "read"):
+                content = content.read()
+            form.add_field("file", content, filename=filename, content_type="application/octet-stream")
+        return await self._request(spec, data=form)
+
+    async def select(self, location, *, print=False):
+        """Selects a file for printing. If print is True, the file starts to print immediately"""
+        await self._request(OctoRequests.select(location, print=print), ret=False)
+
+    ######################
+    ### JOB OPERATIONS ###
+    ######################
+
+    async def start(self):
+        """Starts the print of the currently selected file"""
+        await self._request(OctoRequests.job_command("start"), ret=False)
+
+    async def cancel(self):
+        """Cancels the current print job"""
+        await self._request(OctoRequests.job_command("cancel"), ret=False)
+
+    async def pause_command(self, action):
+        """Pauses/resumes/toggles the current print job"""
+        await self._request(OctoRequests.job_command("pause", action=action), ret=False)
+
+    async def pause(self):
+        await self.pause_command(action="pause")
+
+    async def resume(self):
+        await self.pause_command(action="resume")
+
+    async def job_info(self):
+        """Retrieve information about the current job (if there is one)"""
+        return await self._request(OctoRequests.job_info())
+
+    ##########################
+    ### PRINTER OPERATIONS ###
+    ##########################
+
+    async def printer(self, *, exclude=None, history=False, limit=None):
+        """Retrieves the current state of the printer"""
+        return await self._request(OctoRequests.printer(exclude=exclude, history=history, limit=limit))
+
+
+async def poll_status(clients: list[AsyncOctoRest]) -> list[dict]:
+    """
+    Fetch job_info and printer state of every client concurrently.
+    Returns one dict per client with "job" and "printer" keys,
+    or an "error" key when that printer could not be reached.
+    """
+
+    async def one(client: AsyncOctoRest):
+        try:
+            job, printer = await asyncio.gather(client.job_info(), client.printer())
+            return {"url": client.url, "job": job, "printer": printer}
+        except Exception as e:
+            log.warning(f"could not poll {client.url}: {e}")
+            return {"url": client.url, "error": str(e)}
+
+    return await asyncio.gather(*[one(client) for client in clients])
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--url", action="append", required=True, help="OctoPrint base url (can be repeated)")
+    parser.add_argument("--apikey", help="API key (defaults to the settings file)")
+    args = parser.parse_args()
+
+    async def main():
+        clients = [AsyncOctoRest.from_settings(base_url=url, api_key=args.apikey) for url in args.url]
+        for status in await poll_status(clients):
+            log.info(status)
+        for client in clients:
+            await client.close()
+
+    asyncio.run(main())
@@ -59,12 +59,21 @@ def get_log_level(log_level:str="INFO"):
     return log_level_map[log_level]
 
 class ArgParser:
-    """A class to parse command line arguments"""
-    def __init__(self, description=""):
+    """A class to parse command line arguments
+
+    Stage timings are recorded unless --no-trace is given. Long running processes (services, daemons)
+    pass trace=False: they only record them with --trace.
+    """
+    def __init__(self, description="", trace=True):
         self.parser = ArgumentParser(description=description, formatter_class=RawDescriptionHelpFormatter)
         # set default parameters for all scripts
         self.parser.add_argument("--settings-name", default=os.environ.get("SETTINGS_NAME","default"), help="Set the settings name")
         self.parser.add_argument("--log-level", default="INFO", help="Set the log level")
+        if trace:
+            self.parser.add_argument("--no-trace", dest="trace", action="store_false", help="Do not record stage timings (trace.json, timing_summary.txt) in the log directory")
+        else:
+            self.parser.add_argument("--trace", action="store_true", help="Record stage timings (trace.json, timing_summary.txt) in the log directory")
+        self.parser.add_argument("--profile", default=None, metavar="STAGE", help="Run a sampling profiler during the given stage (e.g. trace_image, make_gcode_from_countours)")
         
     def add_argument(self, *args, **kwargs):
         self.parser.add_argument(*args, **kwargs)
@@ -77,6 +86,12 @@ class ArgParser:
             logger.setLevel(get_log_level(args.log_level))
         # set the settings name environment variable
         os.environ["SETTINGS_NAME"] = args.settings_name
+        # stage timings
+        import tracing
+        if args.profile:
+            tracing.profile_stage(args.profile)
+        elif args.trace:
+            tracing.enable()
         return args
 
 if __name__ == "__main__":
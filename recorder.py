@@ -1,100 +1,327 @@
-"""records a video stream from a simulated camera"""
+"""
+records a video stream from a simulated camera
+
+The output video plays at a fixed rate (default_fps), each frame covering timelapse_multiplier / default_fps
+seconds of real time. With adaptive capture (RecorderSettings.adaptive), frames are compared on small grayscale
+thumbnails and the camera is polled less and less often while nothing changes (station loading, pauses),
+going back to the full rate as soon as the canvas or the robot moves. Skipped frames are either filled with
+copies of the last frame (mode "duplicate", the video keeps real time) or left out (mode "drop", the video
+only shows activity and a timestamps file with the real time of each frame is written next to it; when mkvmerge
+is installed, the video is also remuxed into an mkv that plays each frame at its real time).
+"""
 from project_init import SharedLogger
-from threading import Thread, Lock
+from threading import Thread, Event
 from time import sleep, monotonic
 log = SharedLogger.get_logger()
 
-from robodk import robolink
 import numpy as np
 import cv2
 from datetime import datetime
+import shutil
+import subprocess
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional, Union
+from settings.settings_base import BaseSettingsModel
+from tracing import span
+
+if TYPE_CHECKING:
+    from robodk import robolink
 
 RECORDINGS_DIR = Path(__file__).parent / "recordings"
 RECORDINGS_DIR.mkdir(exist_ok=True, parents=True)
 
 
-class RDKCameraRecorder:
+class RecorderSettings(BaseSettingsModel):
+    """Video recording settings:
+
+    adaptive: bool = True
+        - Poll the camera less often while the picture does not change (False records every frame).
+
+    mode: str = "duplicate"
+        - What to write for frames that were not captured: "duplicate" repeats the last frame (the video keeps
+          real time, the repeated frames take little space), "drop" writes only the frames that changed: the mp4 plays
+          them at a constant rate, their real times are saved in <video>.timestamps.txt and, when mkvmerge is installed,
+          <video>.mkv plays them at those times.
+
+    thumbnail_width_px: int = 160
+        - Width of the grayscale thumbnails frames are compared on.
+
+    pixel_change_threshold: int = 16
+        - Thumbnail pixels that changed by more than this (0-255) count as changed.
+
+    min_changed_pixels: int = 2
+        - A frame is different from the last one when at least this many thumbnail pixels changed.
+
+    idle_interval_s: float = 0.5
+        - Longest time between two snapshots while nothing changes. Also the longest delay before a change is noticed:
+          the strokes drawn in that time show up at once in the first frame after a pause.
+    """
+    adaptive: bool = True
+    mode: str = "duplicate"
+    thumbnail_width_px: int = 160
+    pixel_change_threshold: int = 16
+    min_changed_pixels: int = 2
+    idle_interval_s: float = 0.5
+
+
+class FrameRecorder:
+    """
+    Records the frames returned by frame_source (a callable returning a BGR image, or None if no frame
+    is available) into an mp4 file. RDKCameraRecorder uses the RoboDK camera; any other source (e.g. SyntheticFrames)
+    can be used to test the capture logic.
+    """
 
     default_fps = 20
 
     def __init__(
             self,
-            camera_name:str,
-            rdk:robolink.Robolink,
-            timelapse_multiplier:float = 1.0):
-        self.camera = rdk.Item(camera_name,robolink.ITEM_TYPE_CAMERA)
-        self.rdk = rdk
-        # Optimal settings: undocked, minimized, fixed sensor size
-        rdk.Cam2D_SetParams("SIZE=640x480 WINDOWFIXED", self.camera)
-        assert self.camera.Valid(),"Camera not found"
+            frame_source: Callable[[], Optional[np.ndarray]],
+            timelapse_multiplier: float = 1.0,
+            settings: Union[RecorderSettings, None] = None,
+            save_file: Union[Path, None] = None):
+        if settings is None:
+            settings = RecorderSettings.load()
+        if settings.mode not in ("duplicate", "drop"):
+            raise ValueError(f"Unknown recording mode: {settings.mode}")
+        self.frame_source = frame_source
+        self.settings = settings
+        self.save_file = save_file or RECORDINGS_DIR / (datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".mp4")
         self._recording_thread = None
-        self._recording_state = False
-        self._recording_state_lock = Lock()
+        self._stopped = Event()
         self.frame_delay = timelapse_multiplier / self.default_fps
         log.info("frame delay: %s", self.frame_delay)
-        self.camera.setParam('Open', 1)
-        sleep(0.25)
-    
+        self.report = {}
 
     def start(self):
+        self._stopped.clear()
         self._recording_thread = Thread(target=self.record)
         self._recording_thread.start()
 
-    def stop(self):
-        with self._recording_state_lock:
-            self._recording_state = False
-
-    def _get_frame(self):
-        img_socket = None
-        t0 = monotonic()
-        bytes_img = self.rdk.Cam2D_Snapshot('', self.camera)
-        if isinstance(bytes_img, bytes) and bytes_img != b'':
-            log.info(f"received frame in {monotonic() - t0} seconds")
-            nparr = np.frombuffer(bytes_img, np.uint8)
-            img_socket = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return img_socket
+    def stop(self) -> dict:
+        """Stops the recording, waits for the video to be saved and returns the capture report."""
+        self._stopped.set()
+        if self._recording_thread is not None:
+            self._recording_thread.join()
+        return self.report
 
-    def _make_video_writer(self):
-        # get the frame size
-        frame = self._get_frame()
-        if frame is None:
-            raise Exception("Could not get frame from camera")
-        
+    def _make_video_writer(self, frame):
         height, width, layers = frame.shape
         # create a video writer
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Use 'mp4v' for MP4 format
-        save_file = RECORDINGS_DIR / (datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".mp4")
-        writer =  cv2.VideoWriter(str(save_file.absolute()), fourcc, 20.0, (width, height))
+        writer = cv2.VideoWriter(str(self.save_file.absolute()), fourcc, float(self.default_fps), (width, height))
         log.info(f"Video writer created. video size: {width}x{height}")
-        return writer, save_file
-    
-    def record(self):
-        with self._recording_state_lock:
-            self._recording_state = True
+        return writer
+
+    def _thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        thumb_width = min(self.settings.thumbnail_width_px, width)
+        thumb_height = max(1, round(height * thumb_width / width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+
+    def _changed(self, thumb, reference):
+        diff = cv2.absdiff(thumb, reference)
+        return np.count_nonzero(diff > self.settings.pixel_change_threshold) >= self.settings.min_changed_pixels
 
-        video_writer, save_file = self._make_video_writer()
+    def record(self):
+        frame, snapshots = None, 0
+        while frame is None and not self._stopped.is_set():
+            frame = self.frame_source()
+            snapshots += 1
+        if frame is None:
+            raise Exception("Could not get frame from camera")
+        video_writer = self._make_video_writer(frame)
+        duplicate = self.settings.mode == "duplicate"
+        start = monotonic()
+        timestamps = [0.0]
+        video_writer.write(frame)
+        last_frame, reference = frame, self._thumbnail(frame)
+        slots_written, frames_written = 1, 1
+        interval = self.frame_delay
 
         log.info("Recording started")
         while True:
-            with self._recording_state_lock:
-                if not self._recording_state:
-                    break
-            new_frame = self._get_frame()
-            if new_frame is not None:
-                video_writer.write(new_frame)
-                log.info("Frame written")
-                sleep(self.frame_delay)
-            else:
+            # wait for the next snapshot, or until the recording is stopped
+            if self._stopped.wait(max(0.0, start + slots_written * self.frame_delay + interval - self.frame_delay - monotonic())):
+                break
+            new_frame = self.frame_source()
+            snapshots += 1
+            if new_frame is None:
                 log.warning("Frame not written")
+                continue
+            elapsed = monotonic() - start
+            # output frame that covers the current time
+            slot = max(slots_written, int(elapsed / self.frame_delay))
+            thumb = self._thumbnail(new_frame)
+            changed = self._changed(thumb, reference)
+            if duplicate:
+                for _ in range(slot - slots_written):
+                    video_writer.write(last_frame)
+                video_writer.write(new_frame)
+                frames_written += slot - slots_written + 1
+            elif changed:
+                video_writer.write(new_frame)
+                timestamps.append(elapsed)
+                frames_written += 1
+            slots_written = slot + 1
+            last_frame = new_frame
+            if changed:
+                reference = thumb
+                interval = self.frame_delay
+            elif self.settings.adaptive:
+                interval = min(2 * interval, max(self.settings.idle_interval_s, self.frame_delay))
+            log.debug(f"slot {slot}, changed: {changed}, next snapshot in {interval:.2f}s")
+        elapsed = monotonic() - start
+        if duplicate:
+            # the last frame stays on screen until the recording was stopped
+            total_slots = max(slots_written, int(elapsed / self.frame_delay))
+            for _ in range(total_slots - slots_written):
+                video_writer.write(last_frame)
+            frames_written += total_slots - slots_written
+            slots_written = total_slots
         video_writer.release()
+        timed_file = None
+        if not duplicate:
+            timestamps_file = self.save_file.with_suffix(".timestamps.txt")
+            with open(timestamps_file, "w") as f:
+                # mkvmerge timestamp format, in video time (real time / timelapse_multiplier)
+                f.write("# timestamp format v2\n")
+                f.writelines(f"{t * 1000 / (self.frame_delay * self.default_fps):.3f}\n" for t in timestamps)
+            timed_file = self._mux_timestamps(timestamps_file)
+
+        output_slots = max(slots_written, int(elapsed / self.frame_delay))
+        self.report = {
+            "duration_s": elapsed,
+            "output_slots": output_slots,
+            "snapshots": snapshots,
+            "snapshots_saved": max(0, output_slots - snapshots),
+            "frames_written": frames_written,
+            "frames_not_written": output_slots - frames_written,
+            "video_bytes": self.save_file.stat().st_size,
+            "timed_video": timed_file,
+        }
         log.info("Recording stopped")
-        log.info("Video saved at %s", save_file.absolute())
+        log.info(
+            f"{snapshots} snapshots for {output_slots} frames ({self.report['snapshots_saved']} saved), "
+            f"{frames_written} frames written, {self.report['video_bytes'] / 1e6:.2f} MB"
+        )
+        log.info("Video saved at %s", self.save_file.absolute())
+
+    def _mux_timestamps(self, timestamps_file: Path) -> Optional[Path]:
+        """Remux the video into an mkv playing every frame at its time in timestamps_file (None without mkvmerge)"""
+        mkvmerge = shutil.which("mkvmerge")
+        if mkvmerge is None:
+            log.warning(f"mkvmerge not found: the video plays its frames at a constant rate, their times are in {timestamps_file}")
+            return None
+        timed_file = self.save_file.with_suffix(".mkv")
+        subprocess.run(
+            [mkvmerge, "--quiet", "-o", str(timed_file), "--timestamps", f"0:{timestamps_file}", str(self.save_file)],
+            check=True,
+        )
+        log.info("Video with the real frame times saved at %s", timed_file.absolute())
+        return timed_file
+
+
+class RDKCameraRecorder(FrameRecorder):
+
+    def __init__(
+            self,
+            camera_name:str,
+            rdk:"robolink.Robolink",
+            timelapse_multiplier:float = 1.0,
+            settings: Union[RecorderSettings, None] = None):
+        from robodk import robolink
+
+        self.camera = rdk.Item(camera_name,robolink.ITEM_TYPE_CAMERA)
+        self.rdk = rdk
+        # Optimal settings: undocked, minimized, fixed sensor size
+        rdk.Cam2D_SetParams("SIZE=640x480 WINDOWFIXED", self.camera)
+        assert self.camera.Valid(),"Camera not found"
+        super().__init__(self._get_frame, timelapse_multiplier, settings)
+        self.camera.setParam('Open', 1)
+        sleep(0.25)
+
+    def _get_frame(self):
+        img_socket = None
+        t0 = monotonic()
+        with span("camera_snapshot"):
+            bytes_img = self.rdk.Cam2D_Snapshot('', self.camera)
+        if isinstance(bytes_img, bytes) and bytes_img != b'':
+            log.debug(f"received frame in {monotonic() - t0} seconds")
+            with span("camera_decode"):
+                nparr = np.frombuffer(bytes_img, np.uint8)
+                img_socket = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return img_socket
+
+
+class SyntheticFrames:
+    """
+    Frame source for testing: a blank canvas that stays still for idle_s seconds,
+    then gets a spiral drawn on it for draw_s seconds, and stays still again.
+    """
+
+    def __init__(self, idle_s: float = 2.0, draw_s: float = 2.0, size=(640, 480), snapshot_s: float = 0.0):
+        self.idle_s = idle_s
+        self.draw_s = draw_s
+        self.size = size
+        self.snapshot_s = snapshot_s
+        self._start = None
+        self.calls = 0
+
+    def __call__(self):
+        if self._start is None:
+            self._start = monotonic()
+        self.calls += 1
+        # a real camera takes a while to render and send a frame
+        sleep(self.snapshot_s)
+        width, height = self.size
+        frame = np.full((height, width, 3), 255, dtype=np.uint8)
+        progress = np.clip((monotonic() - self._start - self.idle_s) / self.draw_s, 0, 1)
+        t = np.linspace(0, 8 * np.pi * progress, max(2, int(2000 * progress)))
+        r = t / (8 * np.pi) * min(width, height) * 0.45
+        points = np.stack([width / 2 + r * np.cos(t), height / 2 + r * np.sin(t)], axis=1).astype(np.int32)
+        if progress > 0:
+            cv2.polylines(frame, [points.reshape(-1, 1, 2)], False, (0, 0, 0), 2)
+        return frame
+
 
 if __name__ == "__main__":
-    rdk = robolink.Robolink()
-    rdk.Command("API_NODELAY","1")
-    camera_recorder = RDKCameraRecorder("Camera", rdk, timelapse_multiplier=5.0)
-    camera_recorder.start()
-    input("Press enter to stop recording")
-    camera_recorder.stop()
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument(
+        "--synthetic", action="store_true",
+        help="Record synthetic frames (idle, drawing, idle) with and without adaptive capture and compare them",
+    )
+    parser.add_argument("--duration", type=float, default=6.0, help="Length of the synthetic recording (s)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        reports = {}
+        settings = RecorderSettings.load()
+        for adaptive in (False, True):
+            source = SyntheticFrames(idle_s=args.duration / 3, draw_s=args.duration / 3, snapshot_s=0.01)
+            recorder = FrameRecorder(
+                source,
+                settings=settings.model_copy(update={"adaptive": adaptive}),
+                save_file=RECORDINGS_DIR / f"synthetic_{'adaptive' if adaptive else 'fixed'}.mp4",
+            )
+            recorder.start()
+            sleep(args.duration)
+            reports[adaptive] = recorder.stop()
+        fixed, adaptive = reports[False], reports[True]
+        log.info(
+            f"adaptive capture ({settings.mode}): {fixed['snapshots']} -> {adaptive['snapshots']} snapshots "
+            f"({1 - adaptive['snapshots'] / fixed['snapshots']:.0%} saved), "
+            f"{fixed['video_bytes']} -> {adaptive['video_bytes']} video bytes "
+            f"({1 - adaptive['video_bytes'] / fixed['video_bytes']:.0%} smaller)"
+        )
+    else:
+        from robodk import robolink
+
+        rdk = robolink.Robolink()
+        rdk.Command("API_NODELAY","1")
+        camera_recorder = RDKCameraRecorder("Camera", rdk, timelapse_multiplier=5.0)
+        camera_recorder.start()
+        input("Press enter to stop recording")
+        camera_recorder.stop()
@@ -0,0 +1,103 @@
+"""
+Execution modes of a drawing (MODE) and run_on_robot, which executes a G-code file with one of them.
+
+Kept apart from run_drawing_robot.py so that the drawing service and other long running processes
+can execute drawings without loading the voice prompts, Whisper and the audio devices.
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+from enum import Enum
+
+
+class MODE(Enum):
+    ROBODK = "robodk"
+    OCTOPRINT = "octoprint"
+    NO_ROBOT = "no_robot"
+    DISPATCH = "dispatch"
+    SERIAL = "serial"
+
+
+def uses_shards(mode: MODE, num_machines: int) -> bool:
+    """
+    Whether the drawing is split between num_machines machines (ShardSettings.num_machines).
+    Only the OCTOPRINT mode can draw shards, other modes warn and draw the whole drawing.
+    """
+    if num_machines <= 1:
+        return False
+    if mode != MODE.OCTOPRINT:
+        log.warning(f"ShardSettings.num_machines is {num_machines} but {mode.value} mode draws on one machine, the drawing is not split")
+        return False
+    return True
+
+
+def run_on_robot(mode: MODE, gcode_file, shard_files=(), rdk=None, record_robodk_video=False):
+    """
+    Executes the G-code with the selected MODE.
+    shard_files: one G-code file per machine, when the drawing is split between several octoprint machines.
+    rdk: already loaded RoboDK station (loaded here if None and mode is ROBODK).
+    """
+    if shard_files and mode != MODE.OCTOPRINT:
+        raise ValueError(f"{mode.value} mode cannot draw shards, only octoprint mode can")
+
+    if mode == MODE.NO_ROBOT:
+        log.info(f"Skipping execution on robot as mode is set to NO_ROBOT")
+
+    elif mode == MODE.OCTOPRINT and shard_files:
+        # one region of the drawing per machine of the fleet, all drawing at the same time
+        from concurrent.futures import ThreadPoolExecutor
+        from octoprint import upload_file, get_client
+        from dispatcher import DispatcherSettings
+
+        printers = DispatcherSettings.load().printers
+        if len(printers) < len(shard_files):
+            raise ValueError(
+                f"The drawing is split between {len(shard_files)} machines but DispatcherSettings lists "
+                f"{len(printers)} printers, it must list one printer per machine"
+            )
+        with ThreadPoolExecutor(len(shard_files)) as pool:
+            uploads = [
+                pool.submit(
+                    upload_file,
+                    str(shard_file.absolute()),
+                    get_client(printer.base_url, printer.api_key.get_secret_value()),
+                )
+                for printer, shard_file in zip(printers, shard_files)
+            ]
+            for upload in uploads:
+                upload.result()
+
+    elif mode == MODE.OCTOPRINT:
+        from octoprint import upload_file
+
+        upload_file(str(gcode_file.absolute()))
+
+    elif mode == MODE.DISPATCH:
+        from dispatcher import submit
+
+        submit(gcode_file)
+
+    elif mode == MODE.SERIAL:
+        from serial_stream import stream_gcode_file
+
+        stream_gcode_file(gcode_file)
+
+    elif mode == MODE.ROBODK:
+        from simulation.launch_rdk import load_station
+        from simulation.robot_program import make_robot_program, draw_on_canvas
+
+        if rdk is None:
+            rdk = load_station()
+        recorder = None
+
+        prog = make_robot_program(gcode_file, rdk)
+        if record_robodk_video:
+            from recorder import RDKCameraRecorder
+
+            recorder = RDKCameraRecorder("Camera", rdk, 5.0)
+            input("Press Enter to start recording")
+            recorder.start()
+        draw_on_canvas(rdk, prog)
+        if recorder:
+            recorder.stop()
@@ -14,6 +14,8 @@ The main steps of the script include:
 Depending on the MODE selected, the script will then execute the following steps:
   a. Uploading the G-code to an OctoPrint server for a 3D printer (set up as pen plotter) connected to the server.
   b. Loading the robot simulation environment (RoboDK) and creating a robot program using the generated G-code.
+  c. Submitting the G-code to the multi-printer dispatcher queue (see dispatcher.py).
+  d. Streaming the G-code directly to a GRBL/Marlin controller over a serial port (see serial_stream.py).
 """
 
 from project_init import SharedLogger, ArgParser
@@ -26,13 +28,9 @@ from drawing.generate_img import generate_drawing
 from drawing.trace_edges import trace_image
 from drawing.canvas_scale import scale_contours_to_canvas
 from drawing.gcode import GcodeGenerator
-from enum import Enum
-
-
-class MODE(Enum):
-    ROBODK = "robodk"
-    OCTOPRINT = "octoprint"
-    NO_ROBOT = "no_robot"
+from drawing.shard import ShardSettings, shard_to_gcode
+from drawing.gcode_analysis import check_time_budget, TimeBudgetExceeded
+from robot_modes import MODE, run_on_robot, uses_shards
 
 
 recordings = Recordings.load()
@@ -89,45 +87,40 @@ if __name__ == "__main__":
             )
 
         img = generate_drawing(human_prompt)
-        img.show()
+        from PIL import Image
+
+        Image.fromarray(img).show()
         continue_drawing = input("Would you like to continue drawing? (y/n)")
         if continue_drawing.lower() != "y":
             log.info("User chose not to continue drawing. Exiting...")
             exit()
     else:
-        from PIL import Image
+        from drawing.image_io import read_grayscale
 
-        img = Image.open(args.img_path)
+        play_audio = False
+        img = read_grayscale(args.img_path)
 
     contours = trace_image(img)
     canvas_contours = scale_contours_to_canvas(contours)
     gcode_generator = GcodeGenerator.load()
     gcode_file = gcode_generator.make_gcode_from_countours(canvas_contours)
-
-    if args.mode == MODE.NO_ROBOT:
-        log.info(f"Skipping execution on robot as mode is set to NO_ROBOT")
-
-    elif args.mode == MODE.OCTOPRINT:
-        from octoprint import upload_file
-
-        upload_file(str(gcode_file.absolute()))
-
-    elif args.mode == MODE.ROBODK:
+    log.info(f"Saved gcode to {gcode_file}")
+    shard_settings = ShardSettings.load()
+    shard_files = []
+    if uses_shards(args.mode, shard_settings.num_machines):
+        shard_files = shard_to_gcode(canvas_contours, gcode_generator, shard_settings)
+    try:
+        # shards are drawn at the same time, the longest one is the drawing time
+        check_time_budget(shard_files or gcode_file)
+    except TimeBudgetExceeded as e:
+        log.error(f"Drawing rejected: {e}")
+        exit(1)
+
+    rdk = None
+    if args.mode == MODE.ROBODK:
         from simulation.launch_rdk import load_station
-        from simulation.robot_program import make_robot_program, draw_on_canvas
 
         rdk = load_station()
         if play_audio:
             play_audio_promp(text="Drawing is ready. I will start drawing now.")
-        recorder = None
-
-        prog = make_robot_program(gcode_file, rdk)
-        if args.record_robodk_video:
-            from recorder import RDKCameraRecorder
-
-            recorder = RDKCameraRecorder("Camera", rdk, 5.0)
-            input("Press Enter to start recording")
-            recorder.start()
-        draw_on_canvas(rdk, prog)
-        if recorder:
-            recorder.stop()
+    run_on_robot(args.mode, gcode_file, shard_files, rdk, args.record_robodk_video)
@@ -0,0 +1,310 @@
+"""
+Streams G-code directly to a GRBL/Marlin style controller over a serial port.
+
+Instead of sending one line and waiting for its "ok" (ping-pong), the streamer keeps track of how many
+characters are sitting in the controller's receive buffer and keeps it as full as possible
+(character-counting flow control), so the controller never starves between lines.
+If the controller reports an error, streaming stops with a StreamFault holding the line number,
+and the file can be restarted from that line with a safe pen-up travel to the resume point,
+or from the start of a contour (--start-contour, --start-time) using the file's contour index (see toolpath_index.py).
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import re
+from collections import deque
+from pathlib import Path
+from time import sleep, monotonic
+from typing import Union
+
+from pydantic import BaseModel
+
+from settings.settings_base import BaseSettingsModel
+from tracing import traced
+
+
+class SerialStreamSettings(BaseSettingsModel):
+    """Serial streaming settings:
+
+    port: str = "/dev/ttyUSB0"
+        - Serial port the controller is connected to.
+
+    baudrate: int = 115200
+        - Baudrate of the serial connection.
+
+    rx_buffer_bytes: int = 128
+        - Size of the controller's serial receive buffer (GRBL: 128, Marlin: RX_BUFFER_SIZE).
+
+    startup_delay_s: float = 2.0
+        - Most controllers reset when the port is opened. Time to wait before streaming.
+
+    response_timeout_s: float = 30.0
+        - Maximum time to wait for an acknowledgement before giving up.
+
+    pen_up_mm: float = 25.0
+        - Z height used for the travel move when resuming a stream from a given line.
+    """
+    port: str = "/dev/ttyUSB0"
+    baudrate: int = 115200
+    rx_buffer_bytes: int = 128
+    startup_delay_s: float = 2.0
+    response_timeout_s: float = 30.0
+    pen_up_mm: float = 25.0
+
+
+class StreamFault(Exception):
+    """Raised when the controller rejects a line. Streaming can be resumed from `line`."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"controller error at line {line}: {message}")
+        self.line = line
+        self.message = message
+
+
+class StreamStats(BaseModel):
+    lines_sent: int = 0
+    bytes_sent: int = 0
+    elapsed_s: float = 0.0
+    lines_per_s: float = 0.0
+    mean_buffer_occupancy: float = 0.0
+    max_buffer_occupancy: float = 0.0
+
+
+_AXIS_RE = re.compile(r"([XYZF])(-?\d*\.?\d+)")
+
+
+def clean_line(line: str) -> str:
+    """strip comments and whitespace"""
+    return line.split(";", 1)[0].strip()
+
+
+def resume_preamble(
+    lines: list[str], start_line: int, pen_up_mm: float, pen_up_command: str = None, pen_down_command: str = None,
+) -> list[str]:
+    """
+    Commands that bring the machine to the state it would be in right before start_line:
+    units, absolute positioning (G90), feedrate, pen up (pen_up_command, then pen_up_mm), travel to the last position,
+    pen back to its height (then pen_down_command if the pen was down).
+    The pen commands are those of GcodeGenerator unless given.
+    Raises a ValueError if a move before start_line is relative (G91): the position cannot be known.
+    """
+    if pen_up_command is None or pen_down_command is None:
+        from drawing.gcode import GcodeGenerator
+
+        generator = GcodeGenerator.load()
+        pen_up_command = generator.pen_up_command if pen_up_command is None else pen_up_command
+        pen_down_command = generator.pen_down_command if pen_down_command is None else pen_down_command
+    pen_up = [cmd for cmd in map(clean_line, (pen_up_command or "").splitlines()) if cmd]
+    pen_down = [cmd for cmd in map(clean_line, (pen_down_command or "").splitlines()) if cmd]
+
+    units, pos, feedrate, relative, pen_is_down = None, {}, None, False, False
+    for idx, line in enumerate(lines[:start_line]):
+        line = clean_line(line)
+        if not line:
+            continue
+        if line.startswith(("G20", "G21")):
+            units = line
+        elif line.startswith("G90"):
+            relative = False
+        elif line.startswith("G91"):
+            relative = True
+        elif pen_down and line == pen_down[-1]:
+            pen_is_down = True
+        elif pen_up and line == pen_up[-1]:
+            pen_is_down = False
+        if line.startswith(("G0", "G1")):
+            axes = _AXIS_RE.findall(line)
+            if relative and any(axis != "F" for axis, _ in axes):
+                raise ValueError(f"line {idx} is a relative move (G91), the position at line {start_line} is unknown")
+            for axis, value in axes:
+                if axis == "F":
+                    feedrate = value
+                else:
+                    pos[axis] = value
+    preamble = [units] if units else []
+    preamble.append("G90")
+    if feedrate is not None:
+        preamble.append(f"G0 F{feedrate}")
+    preamble.extend(pen_up)
+    preamble.append(f"G0 Z{pen_up_mm}")
+    if "X" in pos and "Y" in pos:
+        preamble.append(f"G0 X{pos['X']} Y{pos['Y']}")
+    if "Z" in pos:
+        preamble.append(f"G1 Z{pos['Z']}")
+        if pen_is_down:
+            preamble.extend(pen_down)
+    return preamble
+
+
+class GcodeStreamer:
+    """
+    Character-counting G-code streamer.
+
+    port: an open serial port (or any object with write(bytes) and readline() -> bytes)
+    """
+
+    def __init__(self, port, rx_buffer_bytes: int = 128, response_timeout_s: float = 30.0):
+        self.port = port
+        self.rx_buffer_bytes = rx_buffer_bytes
+        self.response_timeout_s = response_timeout_s
+
+    def _read_response(self) -> str:
+        t0 = monotonic()
+        while True:
+            response = self.port.readline().decode(errors="replace").strip()
+            if response:
+                return response
+            if monotonic() - t0 > self.response_timeout_s:
+                raise TimeoutError(f"no response from controller in {self.response_timeout_s}s")
+
+    def stream(self, lines: list[str], start_line: int = 0, preamble: list[str] = (), progress_cb=None) -> StreamStats:
+        """
+        Sends lines[start_line:] (after the preamble commands), keeping the controller's receive buffer full.
+        Raises StreamFault with the index (in lines) of the first rejected line.
+        progress_cb(line_index, stats) is called after every acknowledged line.
+        """
+        # (line index in lines, or None for preamble commands, encoded command)
+        queue = [(None, (cmd + "\n").encode()) for cmd in preamble]
+        for idx in range(start_line, len(lines)):
+            cmd = clean_line(lines[idx])
+            if cmd:
+                queue.append((idx, (cmd + "\n").encode()))
+
+        stats = StreamStats()
+        in_flight = deque()
+        in_flight_bytes = 0
+        occupancy_sum = 0.0
+        t0 = monotonic()
+
+        def acknowledge():
+            nonlocal in_flight_bytes
+            response = self._read_response()
+            if response.startswith("ok"):
+                idx, length = in_flight.popleft()
+                in_flight_bytes -= length
+                if progress_cb is not None and idx is not None:
+                    progress_cb(idx, stats)
+            # GRBL: "error:20", "ALARM:1", Marlin: "Error:Printer halted"
+            elif response.lower().startswith(("error", "alarm")):
+                idx, _ = in_flight[0]
+                raise StreamFault(start_line if idx is None else idx, response)
+            else:
+                log.debug(f"controller: {response}")
+
+        for idx, data in queue:
+            if len(data) > self.rx_buffer_bytes:
+                raise ValueError(f"line {idx} is longer than the controller's receive buffer")
+            while in_flight_bytes + len(data) > self.rx_buffer_bytes:
+                acknowledge()
+            self.port.write(data)
+            in_flight.append((idx, len(data)))
+            in_flight_bytes += len(data)
+            stats.lines_sent += 1
+            stats.bytes_sent += len(data)
+            occupancy = in_flight_bytes / self.rx_buffer_bytes
+            occupancy_sum += occupancy
+            stats.max_buffer_occupancy = max(stats.max_buffer_occupancy, occupancy)
+        while in_flight:
+            acknowledge()
+
+        stats.elapsed_s = monotonic() - t0
+        stats.lines_per_s = stats.lines_sent / stats.elapsed_s if stats.elapsed_s else 0.0
+        stats.mean_buffer_occupancy = occupancy_sum / stats.lines_sent if stats.lines_sent else 0.0
+        return stats
+
+
+def open_port(settings: SerialStreamSettings, port: str = None):
+    """Open the serial port and wait for the controller to be ready"""
+    import serial
+
+    ser = serial.Serial(port or settings.port, settings.baudrate, timeout=0.5)
+    # opening the port resets most controllers, wait for the startup banner and discard it
+    sleep(settings.startup_delay_s)
+    ser.reset_input_buffer()
+    return ser
+
+
+@traced()
+def stream_gcode_file(
+    gcode_file: Union[str, Path], start_line: int = 0, port: str = None, settings: SerialStreamSettings = None,
+    start_contour: int = None,
+) -> StreamStats:
+    """
+    Streams a G-code file to the controller configured in SerialStreamSettings.
+    If start_line > 0, the stream resumes at that line (0 based) after a safe travel to the resume point.
+    If start_contour is given, the stream resumes at the start of that contour (0 based), found with the file's
+    contour index, and only the rest of the file is read.
+    """
+    if settings is None:
+        settings = SerialStreamSettings.load()
+    index = None
+    if start_contour is not None:
+        from drawing.toolpath_index import ToolpathIndex
+
+        index = ToolpathIndex(gcode_file)
+        preamble, lines, first_line = index.resume_lines(start_contour, settings.pen_up_mm)
+        start_line = 0
+    else:
+        with open(gcode_file, "r") as f:
+            lines = f.read().splitlines()
+        preamble = resume_preamble(lines, start_line, settings.pen_up_mm) if start_line > 0 else []
+        first_line = 0
+    total_lines = first_line + len(lines)
+    last_report = monotonic()
+
+    def report(idx, stats):
+        nonlocal last_report
+        if monotonic() - last_report > 5.0:
+            last_report = monotonic()
+            log.info(f"streamed line {first_line + idx + 1}/{total_lines}")
+
+    ser = open_port(settings, port)
+    try:
+        streamer = GcodeStreamer(ser, settings.rx_buffer_bytes, settings.response_timeout_s)
+        log.info(f"Streaming {gcode_file} to {ser.port} from line {first_line + start_line}")
+        try:
+            stats = streamer.stream(lines, start_line, preamble, progress_cb=report)
+        except StreamFault as fault:
+            # line numbers in the whole file
+            fault = StreamFault(first_line + fault.line, fault.message)
+            if index is None:
+                log.error(f"{fault}. Resume with --start-line {fault.line}")
+            else:
+                log.error(f"{fault}. Resume with --start-line {fault.line} or --start-contour {index.contour_of_line(fault.line)}")
+            raise fault
+    finally:
+        ser.close()
+    log.info(
+        f"Streamed {stats.lines_sent} lines in {stats.elapsed_s:.1f}s ({stats.lines_per_s:.0f} lines/s), "
+        f"buffer occupancy mean {stats.mean_buffer_occupancy:.0%} max {stats.max_buffer_occupancy:.0%}"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--file", required=True, help="G-code file to stream")
+    parser.add_argument("--start-line", type=int, default=0, help="Resume streaming from this line (0 based)")
+    parser.add_argument("--start-contour", type=int, default=None, help="Resume streaming from the start of this contour (0 based)")
+    parser.add_argument("--start-time", type=float, default=None, help="Resume streaming from the contour being drawn after this many seconds (estimated)")
+    parser.add_argument("--port", type=str, default=None, help="Serial port (defaults to the settings file)")
+    parser.add_argument("--emulate", action="store_true", help="Stream to an emulated GRBL controller instead of real hardware")
+    args = parser.parse_args()
+
+    settings = SerialStreamSettings.load()
+    start_contour = args.start_contour
+    if args.start_time is not None:
+        from drawing.toolpath_index import ToolpathIndex
+
+        start_contour = ToolpathIndex(args.file).contour_at(args.start_time)
+    if args.emulate:
+        from simulation.fake_grbl import FakeGrbl
+
+        with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes) as grbl:
+            settings.startup_delay_s = 0.1
+            stream_gcode_file(args.file, args.start_line, grbl.port, settings, start_contour)
+    else:
+        stream_gcode_file(args.file, args.start_line, args.port, settings, start_contour)
@@ -73,3 +73,15 @@ class BaseSettingsModel(BaseModel):
             return default_instance
         
 
+    def save(self, name: str = None) -> Path:
+        """save the settings to the settings file `name` (the current settings file if not given).
+        a new settings file starts as a copy of the current one, so that it holds every section."""
+        current_file = self.settings_file()
+        settings_file = current_file if name is None else SETTINGS_DIR / f"settings_files/{name}.json"
+        with open(settings_file if settings_file.exists() else current_file, "r") as f:
+            settings_dict = json.load(f)
+        settings_dict[type(self).__name__] = self.model_dump(mode="json")
+        with open(settings_file, "w") as f:
+            json.dump(settings_dict, f, indent=4)
+        log.info(f"saved settings for {type(self).__name__} to {settings_file}")
+        return settings_file
@@ -0,0 +1,101 @@
+"""
+Emulates a GRBL controller on a pseudo-terminal, to test serial streaming without hardware.
+
+The emulator exposes a serial port path (the pty slave) that can be opened with pyserial.
+It holds incoming characters in a receive buffer of `rx_buffer_bytes`, executes one line every
+`seconds_per_line` and answers "ok" (or "error:<code>" for the line given in `fail_at_line`).
+Any moment where more characters are waiting than the buffer can hold is counted as an overflow,
+which a correct character-counting streamer must never cause.
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import os
+import select
+import tty
+from threading import Thread, Event
+from time import sleep
+
+
+class FakeGrbl:
+    """
+    Usage:
+        with FakeGrbl(rx_buffer_bytes=128) as grbl:
+            serial.Serial(grbl.port, 115200)
+    """
+
+    banner = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+
+    def __init__(self, rx_buffer_bytes: int = 128, seconds_per_line: float = 0.0005, fail_at_line: int = None):
+        self.rx_buffer_bytes = rx_buffer_bytes
+        self.seconds_per_line = seconds_per_line
+        self.fail_at_line = fail_at_line
+        self.lines_received: list[str] = []
+        self.overflows = 0
+        self.max_buffered = 0
+        self._stop = Event()
+        self._thread = None
+        self._master = None
+        self._slave = None
+        self.port = None
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        os.write(self._master, self.banner)
+        buffer = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.01)
+            if readable:
+                try:
+                    buffer += os.read(self._master, 4096)
+                except OSError:
+                    break
+                self.max_buffered = max(self.max_buffered, len(buffer))
+                if len(buffer) > self.rx_buffer_bytes:
+                    self.overflows += 1
+                    log.warning(f"fake grbl: receive buffer overflow ({len(buffer)} bytes)")
+            # execute the buffered lines, one at a time
+            while b"\n" in buffer and not self._stop.is_set():
+                line, _, rest = bytes(buffer).partition(b"\n")
+                buffer = bytearray(rest)
+                sleep(self.seconds_per_line)
+                self.lines_received.append(line.decode().strip())
+                if self.fail_at_line is not None and len(self.lines_received) - 1 == self.fail_at_line:
+                    self.fail_at_line = None
+                    os.write(self._master, b"error:9\r\n")
+                else:
+                    os.write(self._master, b"ok\r\n")
+                # pick up characters that arrived meanwhile, as the real controller keeps receiving
+                readable, _, _ = select.select([self._master], [], [], 0)
+                if readable:
+                    buffer += os.read(self._master, 4096)
+                    self.max_buffered = max(self.max_buffered, len(buffer))
+                    if len(buffer) > self.rx_buffer_bytes:
+                        self.overflows += 1
+                        log.warning(f"fake grbl: receive buffer overflow ({len(buffer)} bytes)")
+
+
+if __name__ == "__main__":
+    grbl = FakeGrbl().start()
+    input(f"Fake GRBL listening on {grbl.port}. Press enter to stop")
+    grbl.stop()
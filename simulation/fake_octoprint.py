@@ -0,0 +1,310 @@
+"""
+Minimal in-process OctoPrint server used to exercise the OctoPrint clients and the dispatcher
+without real printers.
+
+Implements the subset of the API used in this project:
+version, connection, file upload/select, job commands, job info and printer state.
+A "print" lasts `seconds_per_line` per G-code line of the selected file (scaled down so simulations run fast),
+and every request can be delayed by `latency_s` to emulate slow or remote printers.
+For client tests, the printer state counts requests (per method, and how many were in flight at once)
+and can answer the next `fail_next_requests` requests with `fail_status`.
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import json
+import email
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import sleep, monotonic
+from urllib import parse as urlparse
+
+
+class FakePrinterState:
+    """State of the simulated printer, shared between request handler threads"""
+
+    def __init__(self, seconds_per_line: float = 0.001, api_key: str = None):
+        self.seconds_per_line = seconds_per_line
+        self.api_key = api_key
+        self.lock = Lock()
+        self.connected = True
+        self.files: dict[str, bytes] = {}
+        self.selected = None
+        self.print_started_at = None
+        self.print_time = None
+        self.paused_at = None
+        self.finished = False
+        self.completed_jobs = 0
+        self.requests = {"GET": 0, "POST": 0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_next_requests = 0
+        self.fail_status = 503
+
+    def _update(self):
+        """finish the current job if its simulated print time is over"""
+        if self.print_started_at is None or self.paused_at is not None:
+            return
+        if monotonic() - self.print_started_at >= self.print_time:
+            self.print_started_at = None
+            self.finished = True
+            self.completed_jobs += 1
+
+    def state_text(self):
+        self._update()
+        if not self.connected:
+            return "Closed"
+        if self.print_started_at is not None:
+            return "Paused" if self.paused_at is not None else "Printing"
+        return "Operational"
+
+    def select(self, name, start=False):
+        if name not in self.files:
+            return False
+        self.selected = name
+        lines = self.files[name].count(b"\n") + 1
+        self.print_time = lines * self.seconds_per_line
+        if start:
+            self.start()
+        return True
+
+    def start(self):
+        self._update()
+        if self.selected is None or self.print_started_at is not None:
+            return False
+        self.print_started_at = monotonic()
+        self.paused_at = None
+        self.finished = False
+        return True
+
+    def cancel(self):
+        self.print_started_at = None
+        self.paused_at = None
+        self.finished = False
+
+    def pause(self, action):
+        if self.print_started_at is None:
+            return
+        paused = self.paused_at is not None
+        if action == "pause" or (action == "toggle" and not paused):
+            if not paused:
+                self.paused_at = monotonic()
+        elif paused:
+            # shift the start time so the paused interval does not count
+            self.print_started_at += monotonic() - self.paused_at
+            self.paused_at = None
+
+    def job_info(self):
+        state = self.state_text()
+        elapsed, left, completion = None, None, None
+        if self.print_started_at is not None:
+            now = self.paused_at or monotonic()
+            elapsed = now - self.print_started_at
+            left = max(self.print_time - elapsed, 0.0)
+            completion = 100.0 * elapsed / self.print_time if self.print_time else 100.0
+        elif self.finished:
+            # OctoPrint keeps reporting the last job as complete until a new one starts
+            elapsed, left, completion = self.print_time, 0.0, 100.0
+        return {
+            "job": {
+                "file": {"name": self.selected, "origin": "local"},
+                "estimatedPrintTime": self.print_time,
+            },
+            "progress": {
+                "completion": completion,
+                "printTime": elapsed,
+                "printTimeLeft": left,
+            },
+            "state": state,
+        }
+
+    def printer(self):
+        state = self.state_text()
+        return {
+            "state": {
+                "text": state,
+                "flags": {
+                    "operational": state in ("Operational", "Printing", "Paused"),
+                    "printing": state == "Printing",
+                    "paused": state == "Paused",
+                    "ready": state == "Operational",
+                    "closedOrError": state == "Closed",
+                },
+            },
+            "temperature": {},
+        }
+
+
+def _make_handler(printer: FakePrinterState, latency_s: float):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            log.debug("fake octoprint: " + format % args)
+
+        def _reply(self, status=200, body=None):
+            payload = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def _begin(self, method) -> bool:
+            """Counts the request and applies the latency. Returns False if it was answered with an injected failure."""
+            with printer.lock:
+                printer.requests[method] += 1
+                printer.in_flight += 1
+                printer.max_in_flight = max(printer.max_in_flight, printer.in_flight)
+                fail = printer.fail_next_requests > 0
+                if fail:
+                    printer.fail_next_requests -= 1
+            sleep(latency_s)
+            with printer.lock:
+                printer.in_flight -= 1
+            if fail:
+                self._read_body()
+                self._reply(printer.fail_status, {"error": "Injected failure"})
+            return not fail
+
+        def _authorized(self):
+            if printer.api_key is None or self.headers.get("X-Api-Key") == printer.api_key:
+                return True
+            self._reply(403, {"error": "Invalid API key"})
+            return False
+
+        def do_GET(self):
+            if not self._begin("GET") or not self._authorized():
+                return
+            path = urlparse.urlparse(self.path).path
+            with printer.lock:
+                if path == "/api/version":
+                    self._reply(200, {"api": "0.1", "server": "1.9.3", "text": "OctoPrint (fake)"})
+                elif path == "/api/connection":
+                    self._reply(200, {"current": {"state": printer.state_text()}, "options": {}})
+                elif path == "/api/job":
+                    self._reply(200, printer.job_info())
+                elif path == "/api/printer":
+                    if not printer.connected:
+                        self._reply(409, {"error": "Printer is not operational"})
+                    else:
+                        self._reply(200, printer.printer())
+                else:
+                    self._reply(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if not self._begin("POST"):
+                return
+            body = self._read_body()
+            if not self._authorized():
+                return
+            path = urlparse.urlparse(self.path).path
+            content_type = self.headers.get("Content-Type", "")
+            with printer.lock:
+                if path == "/api/files/local" and content_type.startswith("multipart/form-data"):
+                    self._upload(content_type, body)
+                elif path.startswith("/api/files/local/"):
+                    data = json.loads(body or b"{}")
+                    name = path[len("/api/files/local/"):]
+                    if data.get("command") != "select" or not printer.select(name, bool(data.get("print"))):
+                        self._reply(409, {"error": "Cannot select file"})
+                    else:
+                        self._reply(204)
+                elif path == "/api/job":
+                    data = json.loads(body or b"{}")
+                    command = data.get("command")
+                    if command == "start" and not printer.start():
+                        self._reply(409, {"error": "Printer is busy or no file is selected"})
+                        return
+                    if command == "cancel":
+                        printer.cancel()
+                    elif command == "pause":
+                        printer.pause(data.get("action", "toggle"))
+                    self._reply(204)
+                elif path == "/api/connection":
+                    data = json.loads(body or b"{}")
+                    printer.connected = data.get("command") == "connect"
+                    self._reply(204)
+                else:
+                    self._reply(404, {"error": "Not found"})
+
+        def _upload(self, content_type, body):
+            message = email.message_from_bytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body, policy=HTTP
+            )
+            fields, filename, content = {}, None, None
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "file":
+                    filename = part.get_filename()
+                    content = part.get_payload(decode=True)
+                else:
+                    fields[name] = part.get_content().strip().lower()
+            if filename is None:
+                self._reply(400, {"error": "No file included"})
+                return
+            printer.files[filename] = content
+            if fields.get("select") == "true":
+                printer.select(filename, start=fields.get("print") == "true")
+            self._reply(201, {"done": True, "files": {"local": {"name": filename, "origin": "local"}}})
+
+    return Handler
+
+
+class FakeOctoPrint:
+    """
+    Runs a fake OctoPrint server on a background thread.
+
+    Usage:
+        with FakeOctoPrint(latency_s=0.05) as server:
+            client = OctoRest(url=server.url, apikey="key")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_s=0.0, seconds_per_line=0.001, api_key=None):
+        self.printer = FakePrinterState(seconds_per_line=seconds_per_line, api_key=api_key)
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self.printer, latency_s))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        log.debug(f"fake OctoPrint listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("--latency-s", type=float, default=0.0, help="Delay added to every request")
+    parser.add_argument("--seconds-per-line", type=float, default=0.01, help="Simulated print time per G-code line")
+    args = parser.parse_args()
+    server = FakeOctoPrint(port=args.port, latency_s=args.latency_s, seconds_per_line=args.seconds_per_line)
+    server.start()
+    input(f"Fake OctoPrint running at {server.url}. Press enter to stop")
+    server.stop()
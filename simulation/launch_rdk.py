@@ -5,11 +5,13 @@ log = SharedLogger.get_logger()
 
 from robodk.robolink import Robolink
 from pathlib import Path
+from tracing import traced
 
 STATION_PATH = Path(__file__).parent / "main_station.rdk"
 
 assert STATION_PATH.exists(), f"Station file not found at {STATION_PATH.absolute()}"
 
+@traced()
 def load_station():
     """Loads the station from the file"""
     rdk = Robolink()
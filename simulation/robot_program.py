@@ -7,7 +7,9 @@ from robodk import robolink
 from typing import Union
 from pathlib import Path
 from time import sleep
+from tracing import traced
 
+@traced()
 def make_robot_program(gcode_file:Path, rdk:Union[robolink.Robolink,None],run=False):
     """
     Sends gcode to robot
@@ -28,6 +30,7 @@ def make_robot_program(gcode_file:Path, rdk:Union[robolink.Robolink,None],run=Fa
         draw_on_canvas(rdk,prog)
     return prog
 
+@traced()
 def draw_on_canvas(rdk,prog):
     """Draws on the canvas"""
     rdk.Spray_Clear()
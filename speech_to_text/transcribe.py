@@ -8,11 +8,47 @@ log = SharedLogger.get_logger()
 import sounddevice as sd
 import scipy.io.wavfile as wav
 import whisper
+from functools import lru_cache
 from pathlib import Path
+from typing import Union
+from settings.settings_base import BaseSettingsModel
+from tracing import traced
 
 SAVE_DIR = Path(__file__).parent / "recordings"
 SAVE_DIR.mkdir(exist_ok=True)
 
+
+class TranscriptionSettings(BaseSettingsModel):
+    """Transcription settings:
+
+    model: str = "tiny.en"
+        - Whisper model name.
+
+    device: str = ""
+        - "cpu" or "cuda" (empty picks cuda when available).
+
+    quantize: bool = False
+        - Quantize the linear layers of the model to int8 (dynamic quantization, runs on cpu only).
+
+    num_threads: int = 0
+        - Threads torch uses for each operation (0 keeps torch's default, usually one per core).
+
+    greedy: bool = False
+        - Decode each segment once with the most likely tokens, without retrying at higher temperatures.
+
+    max_tokens: int = 0
+        - Longest transcription, in tokens, of each 30s segment (0 keeps whisper's limit of 224).
+          Drawing prompts are one sentence, so about 48 is enough.
+    """
+    model: str = "tiny.en"
+    device: str = ""
+    quantize: bool = False
+    num_threads: int = 0
+    greedy: bool = False
+    max_tokens: int = 0
+
+
+@traced()
 def record_audio(duration, fs = 44100):
     """
     Records audio for a specified duration.
@@ -41,21 +77,75 @@ def save_audio(audio, fs = 44100, filename='recording.wav'):
     wav.write(filename, fs, audio)
     log.info(f"Audio saved as {filename}")
 
-def transcribe_audio(filename):
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of the linear layers (weights stored as int8, activations quantized on the fly).
+    Whisper uses its own Linear subclass, which torch's quantization does not recognize,
+    so those layers are first swapped for plain nn.Linear layers sharing the same weights.
+    """
+    import torch
+
+    for module in list(model.modules()):
+        for child_name, child in module.named_children():
+            if isinstance(child, whisper.model.Linear):
+                linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                linear.weight = child.weight
+                linear.bias = child.bias
+                setattr(module, child_name, linear)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+@lru_cache(maxsize=None)
+def get_model(name="tiny.en", device=None, quantize=False):
+    """Load a whisper model once per process (once per combination of arguments)."""
+    if quantize:
+        device = "cpu"
+    log.info(f"Loading whisper model {name} (device: {device or 'auto'}, quantized: {quantize})")
+    model = whisper.load_model(name, device=device)
+    if quantize:
+        model = quantize_model(model)
+    return model
+
+def load_model(settings: Union[TranscriptionSettings, None] = None):
+    """The model described by the settings (loaded once per process)."""
+    if settings is None:
+        settings = TranscriptionSettings.load()
+    if settings.num_threads:
+        import torch
+
+        # a process wide setting rather than part of the model, so it is applied on every call
+        torch.set_num_threads(settings.num_threads)
+    return get_model(settings.model, settings.device or None, settings.quantize)
+
+def decoding_options(settings: TranscriptionSettings) -> dict:
+    """Keyword arguments of model.transcribe for the settings"""
+    options = {}
+    if settings.greedy:
+        # a single pass at temperature 0 (no retries with sampling), without predicting timestamp tokens
+        options.update(temperature=0.0, beam_size=None, without_timestamps=True)
+    if settings.max_tokens:
+        options["sample_len"] = settings.max_tokens
+    return options
+
+@traced()
+def transcribe_audio(filename, settings: Union[TranscriptionSettings, None] = None):
     """
     Transcribes the audio using the Whisper library.
 
     Parameters:
     - filename (str or Path): The path to the audio file.
+    - settings (TranscriptionSettings): Model and decoding settings (loaded from the settings file if not given).
 
     Returns:
     - transcription (str): The transcribed text.
     """
-    model = whisper.load_model("tiny.en")
-    result = model.transcribe(str(filename))
+    if settings is None:
+        settings = TranscriptionSettings.load()
+    model = load_model(settings)
+    # fp16 is only used on gpu (whisper warns and falls back to fp32 otherwise)
+    result = model.transcribe(str(filename), fp16=model.device.type == "cuda", **decoding_options(settings))
     return result['text']
 
-def record_and_transcribe(duration, filename, keep_file = False):
+def record_and_transcribe(duration, filename, keep_file = False, settings: Union[TranscriptionSettings, None] = None):
     """
     Records audio, saves it as a WAV file, and transcribes the audio.
 
@@ -63,6 +153,7 @@ def record_and_transcribe(duration, filename, keep_file = False):
     - duration (int): The duration of the recording in seconds.
     - filename (str or Path): The name or path of the file to save the recording.
     - keep_file (bool): Whether to keep the recording file after transcription (default: False).
+    - settings (TranscriptionSettings): Model and decoding settings (loaded from the settings file if not given).
 
     Returns:
     - transcription (str): The transcribed text.
@@ -71,7 +162,7 @@ def record_and_transcribe(duration, filename, keep_file = False):
         filename = SAVE_DIR / filename
     audio = record_audio(duration)
     save_audio(audio, filename=filename)
-    transcription = transcribe_audio(filename)
+    transcription = transcribe_audio(filename, settings)
     if not keep_file:
         filename.unlink()
     return transcription
@@ -0,0 +1,12 @@
+"""Shared fixtures: every test reads and writes its settings files in a temporary directory."""
+import pytest
+
+from settings import settings_base
+
+
+@pytest.fixture(autouse=True)
+def settings_dir(tmp_path, monkeypatch):
+    (tmp_path / "settings_files").mkdir()
+    monkeypatch.setattr(settings_base, "SETTINGS_DIR", tmp_path)
+    monkeypatch.setenv("SETTINGS_NAME", "default")
+    return tmp_path / "settings_files"
@@ -0,0 +1,179 @@
+import asyncio
+import json
+
+import pytest
+
+from dispatcher import Dispatcher, DispatcherSettings, PrinterConfig, PrinterStats, QueueState, JobStatus, submit, queue_metrics
+from simulation.fake_octoprint import FakeOctoPrint
+
+
+def _gcode(tmp_path, name: str, lines: int = 50):
+    path = tmp_path / f"{name}.gcode"
+    path.write_text("G0 F3000\n" + "G1 X10 Y10 Z0\nG1 X0 Y0 Z0\n" * lines)
+    return path
+
+
+def _settings(*urls, max_attempts: int = 3, offline_timeout_s: float = 600.0):
+    return DispatcherSettings(
+        printers=[PrinterConfig(name=f"p{i}", base_url=url, api_key="key") for i, url in enumerate(urls)],
+        poll_interval_s=0.02,
+        max_attempts=max_attempts,
+        offline_timeout_s=offline_timeout_s,
+    )
+
+
+@pytest.fixture
+def dispatch_dir(tmp_path):
+    return tmp_path / "dispatch"
+
+
+def test_ingest_moves_submitted_files_into_the_saved_queue(tmp_path, dispatch_dir):
+    ids = [submit(_gcode(tmp_path, f"job_{i}"), dispatch_dir) for i in range(3)]
+    dispatcher = Dispatcher(_settings("http://printer/"), dispatch_dir)
+    dispatcher._ingest_inbox()
+    assert [job.id for job in dispatcher.state.jobs] == ids
+    assert all(job.status == JobStatus.QUEUED and job.estimated_time_s > 0 for job in dispatcher.state.jobs)
+    assert not list((dispatch_dir / "inbox").glob("*.gcode"))
+    saved = json.loads((dispatch_dir / "queue.json").read_text())
+    assert [job["id"] for job in saved["jobs"]] == ids
+
+
+def test_orphaned_job_files_are_requeued(tmp_path, dispatch_dir):
+    dispatcher = Dispatcher(_settings("http://printer/"), dispatch_dir)
+    dispatcher._ingest_inbox()
+    # crash between moving the file out of the inbox and saving the state
+    (dispatch_dir / "jobs").mkdir(exist_ok=True)
+    _gcode(dispatch_dir / "jobs", "orphan")
+    restarted = Dispatcher(_settings("http://printer/"), dispatch_dir)
+    assert [job.id for job in restarted.state.jobs] == ["orphan"]
+    assert [job.id for job in QueueState.load_or_create(dispatch_dir / "queue.json").jobs] == ["orphan"]
+
+
+def test_assign_sends_the_oldest_jobs_to_the_fastest_idle_machines(tmp_path, dispatch_dir):
+    for i in range(3):
+        submit(_gcode(tmp_path, f"job_{i}"), dispatch_dir)
+    dispatcher = Dispatcher(_settings("http://a/", "http://b/", "http://c/"), dispatch_dir)
+    dispatcher._ingest_inbox()
+    dispatcher.state.printers["p0"] = PrinterStats(speed_ratio=2.0)
+    dispatcher.state.printers["p1"] = PrinterStats(speed_ratio=0.5)
+    dispatcher.state.printers["p2"] = PrinterStats(speed_ratio=1.0)
+    jobs = dispatcher.state.jobs
+    assert [(job.id, name) for job, name in dispatcher._assign(["p0", "p1"])] == [(jobs[0].id, "p1"), (jobs[1].id, "p0")]
+    jobs[0].status = JobStatus.RUNNING
+    assert [(job.id, name) for job, name in dispatcher._assign(["p2"])] == [(jobs[1].id, "p2")]
+    assert dispatcher._assign([]) == []
+
+
+def test_failed_jobs_are_retried_then_given_up(tmp_path, dispatch_dir):
+    submit(_gcode(tmp_path, "job"), dispatch_dir)
+    # nothing listens on port 9
+    dispatcher = Dispatcher(_settings("http://127.0.0.1:9/", max_attempts=2), dispatch_dir)
+    dispatcher._ingest_inbox()
+    job = dispatcher.state.jobs[0]
+
+    async def start_twice():
+        try:
+            await dispatcher._start_job(job, "p0")
+            assert job.status == JobStatus.QUEUED and job.attempts == 1 and job.printer is None
+            await dispatcher._start_job(job, "p0")
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(start_twice())
+    assert job.status == JobStatus.FAILED
+    assert job.attempts == 2
+    assert dispatcher.state.printers["p0"].jobs_failed == 2
+
+
+def test_jobs_run_on_the_fleet_and_the_state_survives_a_restart(tmp_path, dispatch_dir):
+    servers = [FakeOctoPrint(seconds_per_line=0.0005, api_key="key").start() for _ in range(2)]
+    try:
+        ids = [submit(_gcode(tmp_path, f"job_{i}"), dispatch_dir) for i in range(4)]
+        settings = _settings(*[server.url for server in servers])
+        dispatcher = Dispatcher(settings, dispatch_dir)
+        asyncio.run(asyncio.wait_for(dispatcher.run(until_empty=True), timeout=60))
+        assert all(job.status == JobStatus.DONE for job in dispatcher.state.jobs)
+        assert sum(server.printer.completed_jobs for server in servers) == len(ids)
+
+        restarted = Dispatcher(settings, dispatch_dir)
+        assert [job.id for job in restarted.state.jobs] == ids
+        assert restarted.metrics()["jobs_done"] == len(ids)
+        assert sum(stats.jobs_done for stats in restarted.state.printers.values()) == len(ids)
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def test_a_job_still_printing_in_the_job_info_is_not_failed(tmp_path, dispatch_dir):
+    submit(_gcode(tmp_path, "job"), dispatch_dir)
+    dispatcher = Dispatcher(_settings("http://printer/"), dispatch_dir)
+    dispatcher._ingest_inbox()
+    job = dispatcher.state.jobs[0]
+    job.status, job.printer, job.started_at, job.attempts = JobStatus.RUNNING, "p0", 0.0, 1
+    ready = {"state": {"flags": {"ready": True, "printing": False, "paused": False}}}
+
+    def job_info(state, completion):
+        return {"job": {"file": {"name": job.gcode_file.name}}, "progress": {"completion": completion}, "state": state}
+
+    # job info fetched right before the print finished, printer state right after
+    idle = dispatcher._update_printers({"p0": {"job": job_info("Printing", 97.0), "printer": ready}}, 1.0)
+    assert idle == [] and job.status == JobStatus.RUNNING
+    idle = dispatcher._update_printers({"p0": {"job": job_info("Operational", 100.0), "printer": ready}}, 1.0)
+    assert idle == ["p0"] and job.status == JobStatus.DONE
+    assert dispatcher.state.printers["p0"].jobs_failed == 0
+
+
+def test_status_metrics_do_not_touch_the_queue(tmp_path, dispatch_dir):
+    dispatcher = Dispatcher(_settings("http://printer/"), dispatch_dir)
+    submit(_gcode(tmp_path, "job"), dispatch_dir)
+    dispatcher._ingest_inbox()
+    # a job file not in the state file yet: only a Dispatcher requeues it
+    _gcode(dispatch_dir / "jobs", "orphan")
+    saved = (dispatch_dir / "queue.json").read_text()
+    metrics = queue_metrics(QueueState.load_or_create(dispatch_dir / "queue.json"))
+    assert metrics == dispatcher.metrics() | {"jobs_per_hour": metrics["jobs_per_hour"]}
+    assert metrics["queue_depth"] == 1
+    assert (dispatch_dir / "queue.json").read_text() == saved
+
+
+def test_a_job_on_a_printer_offline_too_long_is_requeued(tmp_path, dispatch_dir, monkeypatch):
+    submit(_gcode(tmp_path, "job"), dispatch_dir)
+    dispatcher = Dispatcher(_settings("http://a/", "http://b/", offline_timeout_s=60.0), dispatch_dir)
+    dispatcher._ingest_inbox()
+    job = dispatcher.state.jobs[0]
+    job.status, job.printer, job.started_at, job.attempts = JobStatus.RUNNING, "p0", 0.0, 1
+    ready = {"state": {"flags": {"ready": True, "printing": False, "paused": False}}}
+    idle_b = {"job": {"job": {"file": {"name": None}}, "progress": {"completion": None}, "state": "Operational"}, "printer": ready}
+    now = [1000.0]
+    monkeypatch.setattr("dispatcher.time", lambda: now[0])
+
+    assert dispatcher._update_printers({"p0": {"error": "timeout"}, "p1": idle_b}, 1.0) == ["p1"]
+    now[0] += 30
+    dispatcher._update_printers({"p0": {"error": "timeout"}, "p1": idle_b}, 30.0)
+    assert job.status == JobStatus.RUNNING and job.printer == "p0"
+    now[0] += 31
+    dispatcher._update_printers({"p0": {"error": "timeout"}, "p1": idle_b}, 31.0)
+    assert job.status == JobStatus.QUEUED and job.printer is None
+    assert dispatcher.state.printers["p0"].jobs_failed == 1
+    assert [(queued.id, name) for queued, name in dispatcher._assign(["p1"])] == [(job.id, "p1")]
+
+
+def test_a_printer_back_online_restarts_the_offline_timeout(tmp_path, dispatch_dir, monkeypatch):
+    submit(_gcode(tmp_path, "job"), dispatch_dir)
+    dispatcher = Dispatcher(_settings("http://printer/", offline_timeout_s=60.0), dispatch_dir)
+    dispatcher._ingest_inbox()
+    job = dispatcher.state.jobs[0]
+    job.status, job.printer, job.started_at, job.attempts = JobStatus.RUNNING, "p0", 0.0, 1
+    printing = {
+        "job": {"job": {"file": {"name": job.gcode_file.name}}, "progress": {"completion": 50.0}, "state": "Printing"},
+        "printer": {"state": {"flags": {"ready": False, "printing": True, "paused": False}}},
+    }
+    now = [1000.0]
+    monkeypatch.setattr("dispatcher.time", lambda: now[0])
+
+    for status in ({"error": "timeout"}, printing, {"error": "timeout"}, {"error": "timeout"}):
+        dispatcher._update_printers({"p0": status}, 40.0)
+        now[0] += 40
+    assert job.status == JobStatus.RUNNING
+    dispatcher._update_printers({"p0": {"error": "timeout"}}, 40.0)
+    assert job.status == JobStatus.QUEUED
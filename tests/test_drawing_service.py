@@ -0,0 +1,88 @@
+import subprocess
+import sys
+from pathlib import Path
+from queue import Full
+from threading import Thread
+
+import cv2
+import pytest
+
+import drawing_service
+from drawing_service import DrawingService, ServiceSettings, JobStatus
+from benchmarks.pipeline import synthetic_line_art
+from drawing.canvas_scale import CanvasScaleSettings
+from drawing.gcode import GcodeGenerator
+from drawing.gcode_analysis import GcodeAnalysisSettings
+from drawing.shard import ShardSettings
+from drawing.trace_edges import TraceSettings
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(drawing_service, "JOBS_DIR", tmp_path / "jobs")
+    service = DrawingService(ServiceSettings(voice_prompts=False, max_queued_jobs=2))
+    # what warm_up loads, without the OpenAI client
+    service.trace_settings = TraceSettings()
+    service.canvas_settings = CanvasScaleSettings()
+    service.gcode_generator = GcodeGenerator()
+    service.shard_settings = ShardSettings()
+    service.use_shards = False
+    service.analysis_settings = GcodeAnalysisSettings()
+    return service
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "drawing.png"
+    cv2.imwrite(str(path), synthetic_line_art(256, 10))
+    return str(path)
+
+
+def test_service_does_not_load_the_voice_stack():
+    code = (
+        "import sys, drawing_service, robot_modes;"
+        "drawing_service.DrawingService(drawing_service.ServiceSettings(voice_prompts=False));"
+        "print(sorted(m for m in ('whisper', 'sounddevice', 'run_drawing_robot', 'speech_to_text.transcribe') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_stop_finishes_a_full_queue(service, image):
+    jobs = [service.submit(img_path=image) for _ in range(2)]
+    with pytest.raises(Full):
+        service.submit(img_path=image)
+    service.start()
+    stopper = Thread(target=service.stop)
+    stopper.start()
+    stopper.join(timeout=60)
+    assert not stopper.is_alive()
+    for job in jobs:
+        info = service.job_info(job.id)
+        assert info["status"] == JobStatus.DONE.value, info["error"]
+        assert {"load_image", "trace", "scale", "gcode", "analyze", "draw"} <= set(info["timings"])
+    # no new jobs once stopping
+    with pytest.raises(Full):
+        service.submit(img_path=image)
+
+
+def test_job_info_is_a_copy(service, image):
+    job = service.submit(img_path=image)
+    info = service.job_info(job.id)
+    service._timed(job, "trace", lambda: None)
+    assert info["timings"] == {}
+    assert set(service.job_info(job.id)["timings"]) == {"trace"}
+    assert [j["id"] for j in service.job_info()] == [job.id]
+    assert service.job_info("unknown") is None
+
+
+def test_only_the_latest_finished_jobs_are_kept(service, image):
+    service.settings.finished_jobs_retained = 1
+    jobs = [service.submit(img_path=image) for _ in range(2)]
+    service.start()
+    service.stop()
+    assert service.job_info(jobs[0].id) is None
+    assert service.job_info(jobs[1].id)["status"] == JobStatus.DONE.value
+    assert service.metrics()["jobs"][JobStatus.DONE.value] == 1
@@ -0,0 +1,41 @@
+import numpy as np
+
+from drawing.gcode_analysis import MachineProfile, parse_gcode, move_times, analyze
+
+
+def _polyline_gcode(points) -> str:
+    return "\n".join(["G21", "G90", "G1 F30000"] + [f"G1 X{x:.4f} Y{y:.4f} Z0" for x, y in points])
+
+
+def _straight_line(jitter_mm: float = 0.0, seed: int = 0):
+    """200 mm line made of 1 mm moves, with random perpendicular jitter"""
+    rng = np.random.default_rng(seed)
+    x = np.arange(201, dtype=float)
+    y = rng.uniform(-jitter_mm, jitter_mm, len(x)) if jitter_mm else np.zeros(len(x))
+    return list(zip(x, y))
+
+
+def test_jittered_line_takes_as_long_as_a_straight_one():
+    profile = MachineProfile()
+    straight = move_times(parse_gcode(_polyline_gcode(_straight_line())), profile).sum()
+    jittered = move_times(parse_gcode(_polyline_gcode(_straight_line(0.0005))), profile).sum()
+    assert abs(jittered - straight) / straight < 0.01
+
+
+def test_nearly_straight_junctions_do_not_stop():
+    profile = MachineProfile()
+    # 0.1 degree of deviation at every junction
+    angles = np.radians(0.1) * np.arange(200)
+    points = np.cumsum(np.stack([np.cos(angles), np.sin(angles)], axis=1), axis=0)
+    toolpath = parse_gcode(_polyline_gcode(points))
+    stops = move_times(toolpath, profile).sum()
+    # full stop at every junction: each move accelerates from and decelerates to 0 (2 * sqrt(L / a))
+    assert stops < 0.5 * len(points) * 2 * np.sqrt(1 / profile.acceleration_mm_per_s2[0])
+
+
+def test_square_corners_slow_down():
+    profile = MachineProfile()
+    square = [(0, 0), (100, 0), (100, 100), (0, 100), (0, 0)]
+    stats = analyze(parse_gcode(_polyline_gcode(square)), profile)
+    straight = analyze(parse_gcode(_polyline_gcode([(0, 0), (400, 0)])), profile)
+    assert stats.estimated_time_s > straight.estimated_time_s
@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from drawing.image_io import archive, decode_grayscale, read_grayscale
+
+
+def _encoded(mode: str, fmt: str, size=(96, 64)) -> bytes:
+    rng = np.random.default_rng(0)
+    # smooth gradients (as in drawings) plus noise, so that every rounding case shows up
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    rgb = np.stack([x * 255 // size[0], y * 255 // size[1], (x + y) % 256], axis=2) + rng.integers(0, 40, (*size[::-1], 3))
+    img = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).convert(mode)
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("mode, fmt", [
+    ("RGB", "PNG"), ("RGB", "JPEG"), ("L", "PNG"), ("L", "JPEG"), ("P", "PNG"), ("RGBA", "PNG"), ("LA", "PNG"),
+    ("RGB", "BMP"), ("RGB", "WEBP"),
+])
+def test_grayscale_matches_pil(mode, fmt, tmp_path):
+    data = _encoded(mode, fmt)
+    expected = np.asarray(Image.open(io.BytesIO(data)).convert("L"))
+    decoded = decode_grayscale(data)
+    assert decoded.dtype == np.uint8
+    assert np.array_equal(decoded, expected)
+    path = tmp_path / f"drawing.{fmt.lower()}"
+    path.write_bytes(data)
+    assert np.array_equal(read_grayscale(path), expected)
+
+
+def test_undecodable_bytes_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        decode_grayscale(b"not an image")
+    with pytest.raises(ValueError):
+        read_grayscale(tmp_path / "missing.png")
+
+
+def test_archive_writes_the_original_bytes(tmp_path):
+    data = _encoded("RGB", "PNG")
+    archive(data, tmp_path / "drawing.png").result()
+    assert (tmp_path / "drawing.png").read_bytes() == data
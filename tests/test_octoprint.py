@@ -0,0 +1,61 @@
+import pytest
+
+import octoprint
+from octoprint import OctoprintSettings, get_client, clear_clients, upload_file
+from simulation.fake_octoprint import FakeOctoPrint
+
+
+@pytest.fixture
+def settings():
+    return OctoprintSettings(max_retries=3, retry_backoff_s=0.0, connect_timeout_s=1.0, read_timeout_s=5.0)
+
+
+@pytest.fixture(autouse=True)
+def no_cached_clients():
+    clear_clients()
+    yield
+    clear_clients()
+
+
+@pytest.fixture
+def server():
+    with FakeOctoPrint(api_key="key") as server:
+        yield server
+
+
+def test_clients_are_reused_per_url_and_key(settings):
+    client = get_client("http://printer-a/", "key", settings)
+    assert get_client("http://printer-a", "key", settings) is client
+    assert get_client("http://printer-a/", "other key", settings) is not client
+    assert get_client("http://printer-b/", "key", settings) is not client
+    assert len(octoprint._clients) == 3
+    clear_clients()
+    assert get_client("http://printer-a/", "key", settings) is not client
+
+
+def test_cached_client_skips_the_version_handshake(server, settings):
+    client = get_client(server.url, "key", settings)
+    assert server.printer.requests["GET"] == 0
+    client.job_info()
+    get_client(server.url, "key", settings).job_info()
+    assert server.printer.requests["GET"] == 2
+
+
+def test_get_requests_are_retried(server, settings):
+    server.printer.fail_next_requests = 2
+    assert get_client(server.url, "key", settings).job_info()["state"] == "Operational"
+    assert server.printer.requests["GET"] == 3
+
+
+def test_post_requests_are_not_retried(server, settings, tmp_path):
+    gcode_file = tmp_path / "drawing.gcode"
+    gcode_file.write_text("G1 X1 Y1 Z0\n")
+    client = get_client(server.url, "key", settings)
+    server.printer.fail_next_requests = 1
+    with pytest.raises(RuntimeError):
+        upload_file(str(gcode_file), client)
+    assert server.printer.requests["POST"] == 1
+    # a new upload goes through, and starts the print
+    upload_file(str(gcode_file), client)
+    assert server.printer.files == {"drawing.gcode": b"G1 X1 Y1 Z0\n"}
+    assert server.printer.state_text() in ("Printing", "Operational")
@@ -0,0 +1,82 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+
+from octoprint_async import AsyncOctoRest, poll_status
+from simulation.fake_octoprint import FakeOctoPrint
+
+
+def _client(server, **kwargs):
+    return AsyncOctoRest(url=server.url, apikey="key", timeout=5.0, **kwargs)
+
+
+@pytest.fixture
+def server():
+    with FakeOctoPrint(api_key="key") as server:
+        yield server
+
+
+def test_get_requests_are_retried(server):
+    server.printer.fail_next_requests = 2
+
+    async def main():
+        async with _client(server, retries=3) as client:
+            return await client.job_info()
+
+    assert asyncio.run(main())["state"] == "Operational"
+    assert server.printer.requests["GET"] == 3
+
+
+def test_post_requests_are_not_retried(server, tmp_path):
+    gcode_file = tmp_path / "drawing.gcode"
+    gcode_file.write_text("G1 X1 Y1 Z0\n")
+    server.printer.fail_next_requests = 1
+
+    async def main():
+        async with _client(server, retries=3) as client:
+            with pytest.raises(RuntimeError):
+                await client.upload(gcode_file, select=True, print=True)
+            await client.upload(str(gcode_file), select=True)
+
+    asyncio.run(main())
+    assert server.printer.requests["POST"] == 2
+    assert server.printer.files == {"drawing.gcode": b"G1 X1 Y1 Z0\n"}
+    assert server.printer.selected == "drawing.gcode"
+
+
+def test_concurrency_is_limited_per_host():
+    latency_s = 0.05
+    with FakeOctoPrint(latency_s=latency_s) as slow, FakeOctoPrint(latency_s=latency_s) as other:
+
+        async def main():
+            # two clients of the same host share its limit
+            clients = [_client(slow, max_concurrency_per_host=2) for _ in range(2)] + [_client(other, max_concurrency_per_host=2)]
+            try:
+                t0 = perf_counter()
+                await asyncio.gather(*[client.get_version() for client in clients for _ in range(4)])
+                return perf_counter() - t0
+            finally:
+                for client in clients:
+                    await client.close()
+
+        elapsed = asyncio.run(main())
+        assert slow.printer.max_in_flight == 2
+        assert other.printer.max_in_flight == 2
+        # 8 requests to the slow host, 2 at a time; the other host is not held back by it
+        assert elapsed < 8 * latency_s
+        assert slow.printer.requests["GET"] == 8
+
+
+def test_poll_status_reports_unreachable_printers(server):
+    async def main():
+        clients = [_client(server), AsyncOctoRest(url="http://127.0.0.1:9/", timeout=1.0)]
+        try:
+            return await poll_status(clients)
+        finally:
+            for client in clients:
+                await client.close()
+
+    up, down = asyncio.run(main())
+    assert up["printer"]["state"]["flags"]["ready"]
+    assert "error" in down
@@ -0,0 +1,90 @@
+import shutil
+from time import sleep
+
+import cv2
+import pytest
+
+from recorder import FrameRecorder, RecorderSettings, SyntheticFrames
+
+IDLE_S, DRAW_S, DURATION_S = 0.6, 0.5, 1.8
+
+
+def _record(tmp_path, **settings):
+    source = SyntheticFrames(idle_s=IDLE_S, draw_s=DRAW_S, size=(160, 120))
+    save_file = tmp_path / f"{settings.get('mode', 'default')}.mp4"
+    recorder = FrameRecorder(source, settings=RecorderSettings(idle_interval_s=0.2, **settings), save_file=save_file)
+    recorder.start()
+    sleep(DURATION_S)
+    return recorder.stop(), source, save_file
+
+
+def _video_frames(path) -> int:
+    capture = cv2.VideoCapture(str(path))
+    frames = 0
+    while capture.read()[0]:
+        frames += 1
+    capture.release()
+    return frames
+
+
+def test_drop_writes_only_the_frames_that_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+    report, source, save_file = _record(tmp_path, mode="drop")
+    # 20 fps: about 36 frames of real time, about 10 of them while drawing
+    assert report["output_slots"] >= 30
+    assert 5 <= report["frames_written"] <= 15
+    assert report["frames_written"] + report["frames_not_written"] == report["output_slots"]
+    assert source.calls == report["snapshots"] < report["output_slots"]
+    assert _video_frames(save_file) == report["frames_written"]
+
+    lines = save_file.with_suffix(".timestamps.txt").read_text().splitlines()
+    assert lines[0] == "# timestamp format v2"
+    timestamps = [float(line) / 1000 for line in lines[1:]]
+    assert len(timestamps) == report["frames_written"]
+    assert timestamps == sorted(timestamps)
+    # the first stroke is seen within idle_interval_s (plus some scheduling slack)
+    assert IDLE_S <= timestamps[1] <= IDLE_S + 0.2 + 0.15
+    # without mkvmerge, the timestamps file is all there is
+    assert report["timed_video"] is None
+
+
+@pytest.mark.skipif(shutil.which("mkvmerge") is None, reason="mkvmerge is not installed")
+def test_drop_is_remuxed_with_the_real_frame_times(tmp_path):
+    report, source, save_file = _record(tmp_path, mode="drop")
+    assert report["timed_video"] == save_file.with_suffix(".mkv")
+    assert _video_frames(report["timed_video"]) == report["frames_written"]
+
+
+def test_duplicate_keeps_real_time(tmp_path):
+    # the default mode
+    report, source, save_file = _record(tmp_path)
+    assert report["frames_written"] == report["output_slots"]
+    assert report["frames_not_written"] == 0
+    assert report["snapshots"] < report["output_slots"]
+    assert _video_frames(save_file) == report["frames_written"]
+    assert not save_file.with_suffix(".timestamps.txt").exists()
+    assert report["timed_video"] is None
+
+
+def test_fixed_rate_capture_snapshots_every_frame(tmp_path):
+    report, source, save_file = _record(tmp_path, adaptive=False, mode="duplicate")
+    assert report["snapshots"] >= report["output_slots"] - 2
+    assert _video_frames(save_file) == report["frames_written"] == report["output_slots"]
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        FrameRecorder(SyntheticFrames(), settings=RecorderSettings(mode="interpolate"))
+
+
+def test_mux_timestamps_calls_mkvmerge(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(shutil, "which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr("recorder.subprocess.run", lambda args, check: calls.append(args))
+    recorder = FrameRecorder(SyntheticFrames(), settings=RecorderSettings(mode="drop"), save_file=tmp_path / "video.mp4")
+    timed_file = recorder._mux_timestamps(tmp_path / "video.timestamps.txt")
+    assert timed_file == tmp_path / "video.mkv"
+    assert calls == [[
+        "/usr/bin/mkvmerge", "--quiet", "-o", str(tmp_path / "video.mkv"),
+        "--timestamps", f"0:{tmp_path / 'video.timestamps.txt'}", str(tmp_path / "video.mp4"),
+    ]]
@@ -0,0 +1,124 @@
+import pytest
+
+from drawing.gcode import GcodeGenerator
+from serial_stream import GcodeStreamer, SerialStreamSettings, StreamFault, stream_gcode_file, resume_preamble, clean_line
+from simulation.fake_grbl import FakeGrbl
+
+
+def _program(tmp_path, n: int = 300):
+    """G-code with comments and blank lines between the moves"""
+    lines = ["G21 ; millimeters", "G90", "", "G0 F3000"]
+    for i in range(n):
+        lines.append(f"G1 X{i % 50}.125 Y{i // 50}.5 Z{0 if i % 7 else 5}")
+        if i % 25 == 0:
+            lines.append(f"; contour {i // 25}")
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines))
+    return path, lines
+
+
+def _settings(rx_buffer_bytes: int = 64):
+    return SerialStreamSettings(rx_buffer_bytes=rx_buffer_bytes, startup_delay_s=0.1, response_timeout_s=5.0)
+
+
+def test_stream_never_overflows_the_receive_buffer(tmp_path):
+    path, lines = _program(tmp_path)
+    settings = _settings()
+    with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes) as grbl:
+        stats = stream_gcode_file(path, port=grbl.port, settings=settings)
+    assert grbl.overflows == 0
+    assert grbl.max_buffered <= settings.rx_buffer_bytes
+    assert grbl.lines_received == [clean_line(line) for line in lines if clean_line(line)]
+    assert stats.lines_sent == len(grbl.lines_received)
+    # more than one line in flight: the buffer is kept full rather than ping-ponged
+    assert stats.max_buffer_occupancy > 0.5
+
+
+def test_fault_reports_the_rejected_file_line(tmp_path):
+    path, lines = _program(tmp_path)
+    commands = [idx for idx, line in enumerate(lines) if clean_line(line)]
+    settings = _settings()
+    with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes, fail_at_line=100) as grbl:
+        with pytest.raises(StreamFault) as fault:
+            stream_gcode_file(path, port=grbl.port, settings=settings)
+    assert fault.value.line == commands[100]
+    assert grbl.lines_received[100] == clean_line(lines[fault.value.line])
+    assert fault.value.message.startswith("error")
+
+
+def test_resume_preamble_restores_the_machine_state():
+    lines = ["G21", "G90 ; absolute", "G0 F1500", "G1 X10 Y20 Z0", "G0 Z5", "G1 X30.5 Y-4", "G1 Z0", "G1 X31 Y-4"]
+    assert resume_preamble(lines, 7, pen_up_mm=25) == [
+        "G21", "G90", "G0 F1500", "G0 Z25", "G0 X30.5 Y-4", "G1 Z0",
+    ]
+    # nothing moved yet: only the setup and the pen lift
+    assert resume_preamble(lines, 2, pen_up_mm=25) == ["G21", "G90", "G0 Z25"]
+
+
+def test_resume_preamble_lifts_a_servo_pen_before_the_travel():
+    lines = ["G21", "G90", "G0 X1 Y1 Z25", "G1 X1 Y1 Z0", "M280 P0 S0", "G1 X2 Y1 Z0", "G1 X3 Y1 Z0"]
+    assert resume_preamble(lines, 6, 25, pen_up_command="M280 P0 S90", pen_down_command="M280 P0 S0") == [
+        "G21", "G90", "M280 P0 S90", "G0 Z25", "G0 X2 Y1", "G1 Z0", "M280 P0 S0",
+    ]
+    # pen up at the resume point: it stays up
+    lines += ["G1 X3 Y1 Z0", "G0 X3 Y1 Z25", "M280 P0 S90", "G0 X5 Y5 Z25"]
+    assert resume_preamble(lines, 10, 25, pen_up_command="M280 P0 S90", pen_down_command="M280 P0 S0")[-2:] == [
+        "G0 X3 Y1", "G1 Z25",
+    ]
+    # the commands of the settings by default
+    GcodeGenerator(pen_up_command="M5").save()
+    assert resume_preamble(lines, 6, 25)[2] == "M5"
+
+
+def test_resume_preamble_is_absolute():
+    # relative mode without moves, then absolute moves: the travel is absolute
+    lines = ["G91", "G0 F1500", "G90", "G1 X10 Y20 Z0", "G1 X11 Y20 Z0"]
+    assert resume_preamble(lines, 4, 25, "", "") == ["G90", "G0 F1500", "G0 Z25", "G0 X10 Y20", "G1 Z0"]
+    with pytest.raises(ValueError):
+        resume_preamble(["G21", "G91", "G1 X1 Y1", "G1 X1 Y1"], 3, 25, "", "")
+
+
+class _ScriptedPort:
+    """Replies with the given responses, one per line written"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.pending = 0
+
+    def write(self, data):
+        self.pending += 1
+
+    def readline(self):
+        if not self.pending:
+            return b""
+        self.pending -= 1
+        return (self.responses.pop(0) + "\n").encode()
+
+
+@pytest.mark.parametrize("response", ["error:20", "ALARM:1", "Error:Printer halted. kill() called!", "alarm:3"])
+def test_controller_errors_are_faults_in_any_case(response):
+    streamer = GcodeStreamer(_ScriptedPort(["ok", response, "ok"]), rx_buffer_bytes=16, response_timeout_s=0.5)
+    with pytest.raises(StreamFault) as fault:
+        streamer.stream(["G1 X1", "G1 X2", "G1 X3"])
+    assert fault.value.line == 1
+    assert fault.value.message == response
+
+
+def test_resume_from_a_line(tmp_path):
+    path, lines = _program(tmp_path)
+    start_line = 120
+    settings = _settings()
+    with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes) as grbl:
+        stream_gcode_file(path, start_line, port=grbl.port, settings=settings)
+    preamble = resume_preamble(lines, start_line, settings.pen_up_mm)
+    assert grbl.lines_received == preamble + [clean_line(line) for line in lines[start_line:] if clean_line(line)]
+    assert grbl.overflows == 0
+
+
+def test_lines_longer_than_the_buffer_are_rejected(tmp_path):
+    path = tmp_path / "long.gcode"
+    path.write_text("G1 X1 Y1 Z0 ; fine\nG1 " + " ".join(f"X{i}" for i in range(40)))
+    settings = _settings(32)
+    with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes) as grbl:
+        with pytest.raises(ValueError):
+            stream_gcode_file(path, port=grbl.port, settings=settings)
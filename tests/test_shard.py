@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from drawing.gcode import GcodeGenerator
+from drawing.gcode_analysis import GcodeAnalysisSettings, TimeBudgetExceeded, analyze_file, check_time_budget, parse_gcode
+from drawing.shard import shard_contours, make_shard_gcode, contour_stats
+from robot_modes import MODE, run_on_robot, uses_shards
+
+
+def _grid_of_squares(n: int = 20, size: float = 2.0, spacing: float = 10.0):
+    """n x n small squares spread over the canvas, centered on the origin (canvas contours, shape [N, 1, 2])"""
+    square = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=float)
+    offset = (n - 1) * spacing / 2
+    return [
+        (square + [i * spacing - offset, j * spacing - offset]).reshape(-1, 1, 2)
+        for i in range(n)
+        for j in range(n)
+    ]
+
+
+@pytest.mark.parametrize("method", ["kd", "tiles"])
+@pytest.mark.parametrize("num_machines", [1, 2, 3, 4, 5])
+def test_every_contour_goes_to_exactly_one_balanced_shard(method, num_machines):
+    contours = _grid_of_squares()
+    shards = shard_contours(contours, num_machines, method)
+    assert len(shards) == num_machines
+    assigned = [id(contour) for shard in shards for contour in shard.contours]
+    assert sorted(assigned) == sorted(id(contour) for contour in contours)
+    costs = [shard.cost_mm for shard in shards]
+    assert max(costs) / np.mean(costs) < 1.25
+    _, contour_costs = contour_stats(contours)
+    assert sum(costs) == pytest.approx(contour_costs.sum())
+
+
+def test_kd_shards_are_separate_regions():
+    shards = shard_contours(_grid_of_squares(), 2, "kd")
+    # one cut: every contour centroid of one shard is on one side of it
+    axis = int(np.argmax(np.abs(np.subtract(shards[0].center, shards[1].center))))
+    low, high = sorted(shards, key=lambda shard: shard.center[axis])
+    assert contour_stats(low.contours)[0][:, axis].max() <= contour_stats(high.contours)[0][:, axis].min()
+
+
+@pytest.mark.parametrize("method", ["kd", "tiles"])
+def test_a_blank_drawing_gives_empty_shards(method, tmp_path):
+    shards = shard_contours([], 3, method)
+    assert [shard.contours for shard in shards] == [[], [], []]
+    assert [shard.cost_mm for shard in shards] == [0.0, 0.0, 0.0]
+    files = make_shard_gcode(shards, GcodeGenerator(), output_dir=tmp_path)
+    assert all(len(_drawn_points(gcode_file)) == 0 for gcode_file in files)
+
+
+def test_the_time_budget_applies_to_the_longest_shard(tmp_path):
+    contours = _grid_of_squares()
+    generator = GcodeGenerator(smoothing_sigma=0)
+    # uneven shards: a quarter and three quarters of the drawing
+    files = make_shard_gcode(
+        [shard for shard in shard_contours(contours[:100], 1) + shard_contours(contours[100:], 1)], generator, output_dir=tmp_path,
+    )
+    times = [analyze_file(gcode_file).estimated_time_s for gcode_file in files]
+    settings = GcodeAnalysisSettings(time_budget_s=(times[0] + times[1]) / 2, reject_over_budget=True)
+    with pytest.raises(TimeBudgetExceeded):
+        check_time_budget(files, settings)
+    check_time_budget(files[0], settings)
+    settings.time_budget_s = times[1] * 1.01
+    assert check_time_budget(files, settings).estimated_time_s == pytest.approx(times[1])
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        shard_contours(_grid_of_squares(2), 2, "voronoi")
+
+
+def _drawn_points(gcode_file):
+    """end points of the moves that end with the pen down (from the first point of each contour on)"""
+    toolpath = parse_gcode(gcode_file.read_text())
+    return toolpath.end[toolpath.end[:, 2] <= 1e-3, :2]
+
+
+def test_each_machine_is_centered_on_its_shard(tmp_path):
+    generator = GcodeGenerator(smoothing_sigma=0, min_step_mm=0, xy_offset_mm=(100.0, 50.0))
+    shards = shard_contours(_grid_of_squares(), 4, "tiles")
+    files = make_shard_gcode(shards, generator, output_dir=tmp_path)
+    for shard, gcode_file in zip(shards, files):
+        points = _drawn_points(gcode_file)
+        center = (points.min(axis=0) + points.max(axis=0)) / 2
+        assert center == pytest.approx([100.0, 50.0])
+
+
+def test_machine_origins_offset_the_gcode(tmp_path):
+    generator = GcodeGenerator(smoothing_sigma=0, min_step_mm=0)
+    shards = shard_contours(_grid_of_squares(), 2, "kd")
+    origins = [(-30.0, 20.0), (40.0, -10.0)]
+    files = make_shard_gcode(shards, generator, origins, tmp_path)
+    for shard, origin, gcode_file in zip(shards, origins, files):
+        first = shard.contours[0].reshape(-1, 2)[0]
+        # the y axis is flipped in the G-code
+        assert _drawn_points(gcode_file)[0] == pytest.approx([first[0] - origin[0], -first[1] + origin[1]])
+    with pytest.raises(ValueError):
+        make_shard_gcode(shards, generator, origins[:1], tmp_path)
+
+
+def test_shards_are_only_used_in_octoprint_mode(tmp_path):
+    assert uses_shards(MODE.OCTOPRINT, 3)
+    assert not uses_shards(MODE.OCTOPRINT, 1)
+    assert not uses_shards(MODE.SERIAL, 3)
+    shard_files = [tmp_path / "drawing_toolpath_0.gcode", tmp_path / "drawing_toolpath_1.gcode"]
+    with pytest.raises(ValueError):
+        run_on_robot(MODE.NO_ROBOT, tmp_path / "drawing_toolpath.gcode", shard_files)
+    # the default DispatcherSettings lists a single printer
+    with pytest.raises(ValueError, match="one printer per machine"):
+        run_on_robot(MODE.OCTOPRINT, tmp_path / "drawing_toolpath.gcode", shard_files)
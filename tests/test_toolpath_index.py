@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from drawing.gcode import GcodeGenerator
+from drawing.gcode_analysis import MachineProfile, parse_gcode, pen_down_mask, analyze
+from drawing.toolpath_index import ToolpathIndex, index_path
+from serial_stream import SerialStreamSettings, stream_gcode_file, clean_line
+from simulation.fake_grbl import FakeGrbl
+
+
+def _squares(n: int = 5):
+    """n squares of 10 mm, as canvas contours (points of shape [N, 1, 2])"""
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)
+    return [(square + [20 * i, 5 * i]).reshape(-1, 1, 2) for i in range(n)]
+
+
+@pytest.fixture
+def gcode_file(tmp_path):
+    generator = GcodeGenerator(write_index=True, smoothing_sigma=0, pen_up_command="M280 P0 S90", pen_down_command="M280 P0 S0")
+    return generator.make_gcode_from_countours(_squares(), tmp_path / "drawing.gcode", MachineProfile())
+
+
+def _pen_down_moves(text: str) -> np.ndarray:
+    toolpath = parse_gcode(text)
+    pen_down = pen_down_mask(toolpath, 0)
+    return np.concatenate([toolpath.start[pen_down], toolpath.end[pen_down]], axis=1)
+
+
+def test_index_is_only_written_when_enabled(tmp_path):
+    path = GcodeGenerator(smoothing_sigma=0).make_gcode_from_countours(_squares(), tmp_path / "drawing.gcode")
+    assert not index_path(path).exists()
+    # built the first time it is needed
+    assert len(ToolpathIndex(path)) == len(_squares())
+
+
+def test_index_offsets_point_at_the_contour_starts(gcode_file):
+    index = ToolpathIndex(gcode_file)
+    data = gcode_file.read_bytes()
+    lines = data.decode().split("\n")
+    assert len(index) == len(_squares())
+    for entry in index.entries:
+        assert entry["offset"] == sum(len(line) + 1 for line in lines[:entry["line"]])
+        line = data[entry["offset"]:].split(b"\n", 1)[0].decode()
+        assert line == lines[entry["line"]]
+        # the travel to the first point of the contour, pen up
+        assert line == f"G0 X{round(entry['start_x'], 3)} Y{round(entry['start_y'], 3)} Z{round(entry['pen_up_z'])}"
+    assert np.all(np.diff(index.entries["time_s"]) > 0)
+    total = analyze(parse_gcode(data.decode()), MachineProfile()).estimated_time_s
+    assert index.entries["time_s"][-1] < total
+
+
+def test_contour_lookups(gcode_file):
+    index = ToolpathIndex(gcode_file)
+    times, lines = index.entries["time_s"], index.entries["line"]
+    assert index.contour_at(0) == 0
+    assert index.contour_at(times[3] + 1e-6) == 3
+    assert index.contour_of_line(lines[2] + 1) == 2
+    with pytest.raises(IndexError):
+        index.resume_preamble(len(index))
+
+
+def test_resume_preamble_lifts_the_pen_before_the_travel(gcode_file):
+    index = ToolpathIndex(gcode_file)
+    preamble = index.resume_preamble(2, pen_up_command="M280 P0 S90")
+    assert preamble[:2] == ["G21", "G90"]
+    lift, raise_z, travel = preamble.index("M280 P0 S90"), preamble.index("G0 Z25.0"), len(preamble) - 1
+    assert lift < raise_z < travel
+    assert preamble[travel] == f"G0 X{index.entries['start_x'][2]} Y{index.entries['start_y'][2]}"
+    # no servo command configured
+    assert "M280 P0 S90" not in index.resume_preamble(2, pen_up_command="")
+
+
+def test_resume_program_draws_the_rest_of_the_file(gcode_file, tmp_path):
+    index = ToolpathIndex(gcode_file)
+    resumed = index.write_resume_program(2, tmp_path / "resume.gcode", pen_up_command="M280 P0 S90")
+    original = _pen_down_moves(gcode_file.read_text())
+    rest = _pen_down_moves(resumed.read_text())
+    # contours 2, 3 and 4 are drawn exactly as in the original
+    assert np.array_equal(rest, original[-len(rest):])
+    assert len(rest) == len(original) * 3 // 5
+
+
+def test_serial_resume_from_contour(gcode_file):
+    # the pen up command comes from the settings file
+    GcodeGenerator(pen_up_command="M280 P0 S90").save()
+    index = ToolpathIndex(gcode_file)
+    settings = SerialStreamSettings(startup_delay_s=0.1, response_timeout_s=5.0)
+    preamble, lines, _ = index.resume_lines(3, settings.pen_up_mm)
+    assert "M280 P0 S90" in preamble
+    with FakeGrbl(rx_buffer_bytes=settings.rx_buffer_bytes) as grbl:
+        stream_gcode_file(gcode_file, port=grbl.port, settings=settings, start_contour=3)
+    expected = preamble + [clean_line(line) for line in lines if clean_line(line)]
+    assert grbl.lines_received == expected
+    assert grbl.overflows == 0
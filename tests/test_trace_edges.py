@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.pipeline import synthetic_line_art, reference_drawings
+from drawing.trace_edges import TraceSettings, trace_image
+
+TILE_PX = 128
+
+
+def _corner_strokes(size: int = 640) -> np.ndarray:
+    """Strokes through the corners and along the seams of 128px tiles, small dots on the corners, a ring around one"""
+    img = np.full((size, size - 37), 255, dtype=np.uint8)
+    cv2.line(img, (0, 0), (size - 1, size - 1), 0, 2)
+    cv2.line(img, (size - 100, 3), (3, size - 100), 0, 1)
+    cv2.line(img, (TILE_PX, 5), (TILE_PX, size - 5), 0, 1)
+    cv2.line(img, (5, 2 * TILE_PX - 1), (size - 60, 2 * TILE_PX - 1), 0, 3)
+    for corner in range(TILE_PX, size, TILE_PX):
+        cv2.circle(img, (corner, corner - 60), 2, 0, -1)
+        cv2.rectangle(img, (corner - 1, 3 * TILE_PX - 1), (corner, 3 * TILE_PX), 0, -1)
+    cv2.circle(img, (2 * TILE_PX, 2 * TILE_PX), 70, 0, 2, cv2.LINE_AA)
+    return img
+
+
+def _images():
+    images = {"corners": _corner_strokes(), "line_art": synthetic_line_art(700, 40)}
+    images.update(reference_drawings(512))
+    return images
+
+
+def _assert_same_contours(tiled, whole):
+    assert len(tiled) == len(whole)
+    for a, b in zip(tiled, whole):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize("tile_size_px, tile_margin_px", [(TILE_PX, 0), (TILE_PX, 16), (200, 64), (97, 130)])
+def test_tiled_tracing_gives_the_whole_image_contours(tile_size_px, tile_margin_px):
+    whole_settings = TraceSettings(tiled_above_px=10**12)
+    tiled_settings = TraceSettings(tiled_above_px=0, tile_size_px=tile_size_px, tile_margin_px=tile_margin_px, workers=2)
+    for name, img in _images().items():
+        whole = trace_image(img, whole_settings)
+        assert whole, name
+        _assert_same_contours(trace_image(img, tiled_settings), whole)
+
+
+def test_tiled_tracing_of_a_pil_image():
+    img = _corner_strokes()
+    rgb = Image.fromarray(img).convert("RGB")
+    tiled = trace_image(rgb, TraceSettings(tiled_above_px=0, tile_size_px=TILE_PX, tile_margin_px=16, workers=2))
+    _assert_same_contours(tiled, trace_image(img, TraceSettings(tiled_above_px=10**12)))
+
+
+def test_blank_image_has_no_contours():
+    img = np.full((300, 300), 255, dtype=np.uint8)
+    assert trace_image(img, TraceSettings(tiled_above_px=0, tile_size_px=TILE_PX, workers=1)) == []
+    assert trace_image(img, TraceSettings()) == []
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def traced_run(monkeypatch):
+    monkeypatch.setattr(tracing, "_enabled", True)
+    monkeypatch.setattr(tracing, "_events", tracing.deque(maxlen=10))
+    monkeypatch.setattr(tracing, "_stage_totals", {})
+
+
+def test_the_event_buffer_is_capped_but_the_totals_cover_every_span(traced_run, tmp_path):
+    for i in range(25):
+        with tracing.span("snapshot", frame=i):
+            pass
+    with tracing.span("draw"):
+        pass
+    assert len(tracing._events) == 10
+    stats = tracing.summary()
+    assert stats["snapshot"]["count"] == 25 and stats["draw"]["count"] == 1
+    assert stats["snapshot"]["max_s"] >= stats["snapshot"]["mean_s"] > 0
+
+    tracing.write_results(tmp_path, log_table=False)
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert [event["args"]["frame"] for event in events[:-1]] == list(range(16, 25))
+    assert "snapshot" in (tmp_path / "timing_summary.txt").read_text()
+
+
+def test_results_can_be_written_repeatedly(traced_run, tmp_path):
+    @tracing.traced()
+    def stage():
+        pass
+
+    stage()
+    tracing.write_results(tmp_path, log_table=False)
+    stage()
+    tracing.write_results(tmp_path, log_table=False)
+    assert len(json.loads((tmp_path / "trace.json").read_text())["traceEvents"]) == 2
+    assert tracing.summary()["stage"]["count"] == 2
+
+
+def test_disabled_spans_are_not_recorded(monkeypatch):
+    monkeypatch.setattr(tracing, "_enabled", False)
+    monkeypatch.setattr(tracing, "_stage_totals", {})
+    with tracing.span("anything"):
+        pass
+    assert tracing.summary() == {}
@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+transcribe = pytest.importorskip("speech_to_text.transcribe")
+
+
+def _tiny_whisper():
+    dims = whisper.model.ModelDimensions(
+        n_mels=80, n_audio_ctx=8, n_audio_state=32, n_audio_head=2, n_audio_layer=1,
+        n_vocab=64, n_text_ctx=8, n_text_state=32, n_text_head=2, n_text_layer=1,
+    )
+    return whisper.model.Whisper(dims).eval()
+
+
+def test_quantize_model_replaces_every_linear_layer():
+    torch.manual_seed(0)
+    model = _tiny_whisper()
+    mel, tokens = torch.randn(1, 80, 16), torch.randint(0, 64, (1, 4))
+    with torch.no_grad():
+        expected = model(mel, tokens)
+
+    quantized = transcribe.quantize_model(copy.deepcopy(model))
+    modules = list(quantized.modules())
+    assert not any(isinstance(module, whisper.model.Linear) for module in modules)
+    assert any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in modules)
+    with torch.no_grad():
+        logits = quantized(mel, tokens)
+    assert logits.shape == expected.shape
+    assert torch.allclose(logits, expected, atol=0.1 * expected.abs().max().item())
+
+
+@pytest.fixture
+def fake_load(monkeypatch):
+    loaded = []
+
+    def load_model(name, device=None):
+        loaded.append((name, device))
+        return _tiny_whisper()
+
+    monkeypatch.setattr(whisper, "load_model", load_model)
+    transcribe.get_model.cache_clear()
+    threads = torch.get_num_threads()
+    yield loaded
+    transcribe.get_model.cache_clear()
+    torch.set_num_threads(threads)
+
+
+def test_thread_count_follows_the_settings_of_each_call(fake_load):
+    model = transcribe.load_model(transcribe.TranscriptionSettings(num_threads=1))
+    assert torch.get_num_threads() == 1
+    assert transcribe.load_model(transcribe.TranscriptionSettings(num_threads=2)) is model
+    assert torch.get_num_threads() == 2
+    assert fake_load == [("tiny.en", None)]
@@ -0,0 +1,66 @@
+import numpy as np
+
+from drawing.canvas_scale import CanvasScaleSettings, scale_contours_to_canvas
+from drawing.gcode import GcodeGenerator
+from tune import pareto_front, pick_best, fidelity, stroke_outlines, _pixel_transform
+
+
+def _point(time_s, size, score):
+    return {"estimated_time_s": time_s, "gcode_bytes": size, "fidelity": score}
+
+
+def test_pareto_front_keeps_only_undominated_points():
+    points = [
+        _point(10, 100, 0.9),
+        _point(20, 100, 0.9),  # slower than the first
+        _point(5, 200, 0.8),
+        _point(5, 200, 0.7),   # less faithful than the previous one
+        _point(30, 300, 0.95),
+        _point(10, 100, 0.9),  # same as the first: neither dominates the other
+    ]
+    assert pareto_front(points) == [0, 2, 4, 5]
+
+
+def test_pick_best_trades_fidelity_for_time_within_the_tolerance():
+    points = [_point(10, 100, 0.9), _point(5, 200, 0.8), _point(30, 300, 0.95), _point(10, 50, 0.9)]
+    front = pareto_front(points)
+    assert pick_best(points, front, 0.0) == 2
+    assert pick_best(points, front, 0.05) == 3
+    assert pick_best(points, front, 0.2) == 1
+
+
+def test_fidelity():
+    reference = np.zeros((40, 40), bool)
+    reference[10:30, 20] = True
+    assert fidelity(reference, reference, 0) == 1.0
+    assert fidelity(np.zeros_like(reference), reference, 2) == 0.0
+    shifted = np.roll(reference, 2, axis=1)
+    assert fidelity(shifted, reference, 2) == 1.0
+    assert fidelity(shifted, reference, 1) == 0.0
+    # half of the line drawn: perfect precision, half the recall
+    half = reference.copy()
+    half[20:30] = False
+    assert np.isclose(fidelity(half, reference, 0), 2 * 0.5 / 1.5)
+
+
+def test_stroke_outlines_follow_the_threshold():
+    img = np.full((30, 30), 255, np.uint8)
+    img[5:15, 5:15] = 0
+    img[5:15, 18:28] = 150
+    dark = stroke_outlines(img, 128)
+    assert dark[5, 5] and not dark[10, 10] and not dark[5, 18]
+    both = stroke_outlines(img, 200)
+    assert both[5, 5] and both[5, 18] and not both[10, 22]
+
+
+def test_pixel_transform_inverts_the_canvas_scaling():
+    rng = np.random.default_rng(0)
+    contours = [rng.integers(0, 500, (20, 1, 2)).astype(np.int32) for _ in range(3)]
+    canvas_settings = CanvasScaleSettings(canvas_width_mm=300, canvas_height_mm=200, margin_mm=10)
+    generator = GcodeGenerator(xy_offset_mm=(100.0, 50.0))
+    to_pixels = _pixel_transform(contours, canvas_settings, generator)
+    for contour, canvas_contour in zip(contours, scale_contours_to_canvas(contours, canvas_settings)):
+        canvas_xy = canvas_contour.reshape(-1, 2)
+        # as written by GcodeGenerator: y flipped, then offset
+        gcode_xy = canvas_xy * np.array([1.0, -1.0]) + np.array(generator.xy_offset_mm)
+        assert np.allclose(to_pixels(gcode_xy), contour.reshape(-1, 2))
@@ -15,7 +15,9 @@ from pathlib import Path
 from openai import OpenAI
 from pydantic import BaseModel, RootModel
 from datetime import datetime
+from functools import lru_cache
 from numpy import zeros
+from tracing import traced
 
 DICTATIONS_DIR = Path(__file__).parent / "dictations"
 DICTATIONS_DIR.mkdir(exist_ok=True)
@@ -55,6 +57,7 @@ class Recording(BaseModel):
     settings: RecordingSetting
     filename: Path
 
+    @traced("tts_playback")
     def play(self):
         """
         Play the recorded audio file.
@@ -143,6 +146,12 @@ class Recordings(RootModel):
         self.root.append(Recording(settings=settings, filename=filename))
         return self.root[-1]
 
+@lru_cache(maxsize=None)
+def _openai() -> OpenAI:
+    # gets OPENAI_API_KEY from your environment variables
+    return OpenAI()
+
+@traced()
 def tts(text, speech_file_path) -> None:
     """
     Create a text-to-speech audio file.
@@ -151,7 +160,7 @@ def tts(text, speech_file_path) -> None:
     - text: The text to convert to speech.
     - speech_file_path: The path to save the audio file.
     """
-    openai = OpenAI()
+    openai = _openai()
     with openai.audio.speech.with_streaming_response.create(
         model="tts-1",
         voice="alloy",
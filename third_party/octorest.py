@@ -3,11 +3,13 @@
 import os
 from contextlib import contextmanager
 from urllib import parse as urlparse
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 from enum import Enum
 from time import sleep
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class AuthorizationRequestPollingResult(Enum):
@@ -23,16 +25,159 @@ class WorkflowAppKeyRequestResult(Enum):
     TIMED_OUT = 4
 
 
+class RequestSpec(NamedTuple):
+    """
+    Method, path and payload of one API call, independent of the HTTP library
+    """
+
+    method: str
+    path: str
+    params: Optional[dict] = None
+    json: Optional[dict] = None
+
+
+class OctoRequests:
+    """
+    Builds the requests shared by OctoRest and its asyncio counterpart
+    (octoprint_async.AsyncOctoRest), so that both clients speak exactly
+    the same API
+    """
+
+    @staticmethod
+    def prepend_local(location):
+        if location.split("/")[0] not in ("local", "sdcard"):
+            return "local/" + location
+        return location
+
+    @staticmethod
+    def version():
+        return RequestSpec("GET", "/api/version")
+
+    @staticmethod
+    def connection_info():
+        return RequestSpec("GET", "/api/connection")
+
+    @staticmethod
+    def connect(
+        port=None, baudrate=None, printer_profile=None, save=None, autoconnect=None
+    ):
+        data = {"command": "connect"}
+        if port is not None:
+            data["port"] = port
+        if baudrate is not None:
+            data["baudrate"] = baudrate
+        if printer_profile is not None:
+            data["printerProfile"] = printer_profile
+        if save is not None:
+            data["save"] = save
+        if autoconnect is not None:
+            data["autoconnect"] = autoconnect
+        return RequestSpec("POST", "/api/connection", json=data)
+
+    @staticmethod
+    def disconnect():
+        return RequestSpec("POST", "/api/connection", json={"command": "disconnect"})
+
+    @staticmethod
+    def upload(location="local"):
+        return RequestSpec("POST", "/api/files/{}".format(location))
+
+    @staticmethod
+    def upload_fields(select=False, print=False, userdata=None, path=None):
+        """
+        Form fields sent next to the file of an upload, as (filename, value) tuples
+        """
+        fields = {
+            "select": (None, select),
+            "print": (None, print),
+        }
+        if userdata:
+            fields["userdata"] = (None, userdata)
+        if path:
+            fields["path"] = (None, path)
+        return fields
+
+    @classmethod
+    def select(cls, location, print=False):
+        location = cls.prepend_local(location)
+        data = {
+            "command": "select",
+            "print": print,
+        }
+        return RequestSpec("POST", "/api/files/{}".format(location), json=data)
+
+    @staticmethod
+    def job_command(command, **kwargs):
+        data = {"command": command}
+        data.update(kwargs)
+        return RequestSpec("POST", "/api/job", json=data)
+
+    @staticmethod
+    def job_info():
+        return RequestSpec("GET", "/api/job")
+
+    @staticmethod
+    def hwinfo(url, exclude=None, history=False, limit=None):
+        params = {}
+        if exclude:
+            params["exclude"] = ",".join(exclude)
+        if history:
+            params["history"] = "true"  # or 'yes' or 'y' or '1'
+        if limit:
+            params["limit"] = limit
+        return RequestSpec("GET", url, params=params)
+
+    @classmethod
+    def printer(cls, exclude=None, history=False, limit=None):
+        return cls.hwinfo(
+            "/api/printer", exclude=exclude, history=history, limit=limit
+        )
+
+
+def check_status(url, status_code, text):
+    """
+    Raise a RuntimeError when the status code is not 20x OK-ish
+    """
+    if not (200 <= status_code < 210):
+        msg = "Reply for {} was not OK: {} ({})"
+        msg = msg.format(url, text, status_code)
+        raise RuntimeError(msg)
+
+
 class OctoRest:
     """
     Encapsulates communication with one OctoPrint instance
     """
 
-    def __init__(self, *, url=None, apikey=None, session=None):
+    def __init__(
+        self,
+        *,
+        url=None,
+        apikey=None,
+        session=None,
+        timeout=None,
+        retries=0,
+        backoff_factor=0.0,
+        pool_maxsize=10,
+        lazy=False
+    ):
         """
         Initialize the object with URL and API key
 
         If a session is provided, it will be used (mostly for testing)
+
+        timeout: Optional, passed to every request. Either a number of seconds
+        or a (connect, read) tuple, as accepted by requests.
+
+        retries: Number of retries (with exponential backoff controlled by
+        backoff_factor) for failed connections and for idempotent requests
+        (GET, PUT, DELETE, ...) answered with 429/502/503/504.
+        POST requests are only retried when the connection could not be made.
+
+        pool_maxsize: Number of keep-alive connections kept to the server.
+
+        lazy: If True, the API key is not checked against the server
+        at construction time. The version is fetched on first access instead.
         """
         if not url:
             raise TypeError("Required argument 'url' not found or empty")
@@ -44,17 +189,37 @@ class OctoRest:
             raise TypeError("Provided URL is empty")
 
         self.url = "{}://{}".format(parsed.scheme, parsed.netloc)
-
-        self.session = session or requests.Session()
+        self.timeout = timeout
+        self._version = None
+
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
 
         if apikey:
-            self.load_api_key(apikey)
+            self.load_api_key(apikey, check=not lazy)
 
-    def load_api_key(self, apikey: str) -> None:
+    def load_api_key(self, apikey: str, check: bool = True) -> None:
         """Use the given API key for all future communication with the OctoPrint server.
 
         Raises TypeError if 'apikey' is None or empty.
-        Raises RuntimeError if the API key is rejected by the server.
+        Raises RuntimeError if the API key is rejected by the server
+        (only when 'check' is True, otherwise on first use).
 
         """
         if not apikey:
@@ -64,7 +229,19 @@ class OctoRest:
 
         # Try a simple request to see if the API key works
         # Keep the info, in case we need it later
-        self.version = self.get_version()
+        if check:
+            self._version = self.get_version()
+
+    @property
+    def version(self):
+        """Server version information, fetched on first access"""
+        if self._version is None:
+            self._version = self.get_version()
+        return self._version
+
+    @version.setter
+    def version(self, value):
+        self._version = value
 
     def _get(self, path, params=None):
         """
@@ -78,7 +255,7 @@ class OctoRest:
         Returns JSON decoded data
         """
         url = urlparse.urljoin(self.url, path)
-        response = self.session.get(url, params=params)
+        response = self.session.get(url, params=params, timeout=self.timeout)
         self._check_response(response)
 
         return response.json()
@@ -95,7 +272,9 @@ class OctoRest:
         Returns JSON decoded data
         """
         url = urlparse.urljoin(self.url, path)
-        response = self.session.post(url, data=data, files=files, json=json)
+        response = self.session.post(
+            url, data=data, files=files, json=json, timeout=self.timeout
+        )
         self._check_response(response)
 
         if ret:
@@ -113,7 +292,7 @@ class OctoRest:
         Returns nothing
         """
         url = urlparse.urljoin(self.url, path)
-        response = self.session.delete(url)
+        response = self.session.delete(url, timeout=self.timeout)
         self._check_response(response)
 
     def _put(self, path, data=None, files=None, json=None, ret=True):
@@ -128,7 +307,9 @@ class OctoRest:
         Returns JSON decoded data
         """
         url = urlparse.urljoin(self.url, path)
-        response = self.session.put(url, data=data, files=files, json=json)
+        response = self.session.put(
+            url, data=data, files=files, json=json, timeout=self.timeout
+        )
         self._check_response(response)
 
         if ret:
@@ -146,7 +327,9 @@ class OctoRest:
         Returns JSON decoded data
         """
         url = urlparse.urljoin(self.url, path)
-        response = self.session.patch(url, data=data, files=files, json=json)
+        response = self.session.patch(
+            url, data=data, files=files, json=json, timeout=self.timeout
+        )
         self._check_response(response)
 
         if ret:
@@ -156,13 +339,17 @@ class OctoRest:
         """
         Make sure the response status code was 20x, raise otherwise
         """
-        if not (200 <= response.status_code < 210):
-            error = response.text
-            msg = "Reply for {} was not OK: {} ({})"
-            msg = msg.format(response.url, error, response.status_code)
-            raise RuntimeError(msg)
+        check_status(response.url, response.status_code, response.text)
         return response
 
+    def _send(self, spec, ret=True):
+        """
+        Perform the request described by a RequestSpec
+        """
+        if spec.method == "GET":
+            return self._get(spec.path, params=spec.params)
+        return self._post(spec.path, json=spec.json, ret=ret)
+
     ###########################
     ### VERSION INFORMATION ###
     ###########################
@@ -176,7 +363,7 @@ class OctoRest:
 
         Retrieve information regarding server and API version
         """
-        return self._get("/api/version")
+        return self._send(OctoRequests.version())
 
     ##############
     ### LOGIN  ###
@@ -234,7 +421,7 @@ class OctoRest:
         Returns True if the workflow is supported, otherwise returns False.
         """
         url = urlparse.urljoin(self.url, "/plugin/appkeys/probe")
-        response = self.session.get(url)
+        response = self.session.get(url, timeout=self.timeout)
 
         if response.status_code == 204:
             return True
@@ -265,7 +452,7 @@ class OctoRest:
             data["user"] = user
 
         url = urlparse.urljoin(self.url, "/plugin/appkeys/request")
-        response = self.session.post(url, json=data)
+        response = self.session.post(url, json=data, timeout=self.timeout)
         self._check_response(response)
 
         location = response.headers["Location"]
@@ -284,7 +471,7 @@ class OctoRest:
         and if the result type is GRANTED, the tuple's second item is the API key.
         """
 
-        response = self.session.get(url)
+        response = self.session.get(url, timeout=self.timeout)
 
         if response.status_code == 202:
             return (AuthorizationRequestPollingResult.STILL_WAITING, None)
@@ -357,7 +544,7 @@ class OctoRest:
         regarding the available baudrates and serial ports and the
         current connection state.
         """
-        return self._get("/api/connection")
+        return self._send(OctoRequests.connection_info())
 
     def state(self):
         """
@@ -398,18 +585,14 @@ class OctoRest:
         on OctoPrint's startup in the future. If not set no changes will be
         made to the current configuration.
         """
-        data = {"command": "connect"}
-        if port is not None:
-            data["port"] = port
-        if baudrate is not None:
-            data["baudrate"] = baudrate
-        if printer_profile is not None:
-            data["printerProfile"] = printer_profile
-        if save is not None:
-            data["save"] = save
-        if autoconnect is not None:
-            data["autoconnect"] = autoconnect
-        self._post("/api/connection", json=data, ret=False)
+        spec = OctoRequests.connect(
+            port=port,
+            baudrate=baudrate,
+            printer_profile=printer_profile,
+            save=save,
+            autoconnect=autoconnect,
+        )
+        self._send(spec, ret=False)
 
     def disconnect(self):
         """Issue a connection command
@@ -417,8 +600,7 @@ class OctoRest:
 
         Instructs OctoPrint to disconnect from the printer
         """
-        data = {"command": "disconnect"}
-        self._post("/api/connection", json=data, ret=False)
+        self._send(OctoRequests.disconnect(), ret=False)
 
     def fake_ack(self):
         """Issue a connection command
@@ -438,9 +620,7 @@ class OctoRest:
     #######################
 
     def _prepend_local(self, location):
-        if location.split("/")[0] not in ("local", "sdcard"):
-            return "local/" + location
-        return location
+        return OctoRequests.prepend_local(location)
 
     def files(self, location=None, recursive=False):
         """Retrieve all files
@@ -528,18 +708,15 @@ class OctoRest:
         Upload a given file
         It can be a path or a tuple with a filename and a file-like object
         """
+        spec = OctoRequests.upload(location)
         with self._file_tuple(file) as file_tuple:
-            files = {
-                "file": file_tuple,
-                "select": (None, select),
-                "print": (None, print),
-            }
-            if userdata:
-                files["userdata"] = (None, userdata)
-            if path:
-                files["path"] = (None, path)
-
-            return self._post("/api/files/{}".format(location), files=files)
+            files = {"file": file_tuple}
+            files.update(
+                OctoRequests.upload_fields(
+                    select=select, print=print, userdata=userdata, path=path
+                )
+            )
+            return self._post(spec.path, files=files)
 
     def new_folder(self, folder_name, location="local"):
         """Upload file or create folder
@@ -563,12 +740,7 @@ class OctoRest:
         Location is target/filename, defaults to local/filename
         If print is True, the selected file starts to print immediately
         """
-        location = self._prepend_local(location)
-        data = {
-            "command": "select",
-            "print": print,
-        }
-        self._post("/api/files/{}".format(location), json=data, ret=False)
+        self._send(OctoRequests.select(location, print=print), ret=False)
 
     def slice(
         self,
@@ -657,8 +829,7 @@ class OctoRest:
 
         Use select() to select a file
         """
-        data = {"command": "start"}
-        self._post("/api/job", json=data, ret=False)
+        self._send(OctoRequests.job_command("start"), ret=False)
 
     def cancel(self):
         """Issue a job command
@@ -668,8 +839,7 @@ class OctoRest:
 
         There must be an active print job for this to work
         """
-        data = {"command": "cancel"}
-        self._post("/api/job", json=data, ret=False)
+        self._send(OctoRequests.job_command("cancel"), ret=False)
 
     def restart(self):
         """Issue a job command
@@ -706,11 +876,7 @@ class OctoRest:
             pausing it if it’s printing and resuming it
             if it’s currently paused.
         """
-        data = {
-            "command": "pause",
-            "action": action,
-        }
-        self._post("/api/job", json=data, ret=False)
+        self._send(OctoRequests.job_command("pause", action=action), ret=False)
 
     def pause(self):
         """Issue a job command
@@ -746,7 +912,7 @@ class OctoRest:
 
         Retrieve information about the current job (if there is one)
         """
-        return self._get("/api/job")
+        return self._send(OctoRequests.job_info())
 
     #################
     ### LANGUAGES ###
@@ -833,14 +999,7 @@ class OctoRest:
         """
         Helper method for printer(), tool(), bed() and sd()
         """
-        params = {}
-        if kwargs.get("exclude"):
-            params["exclude"] = ",".join(kwargs["exclude"])
-        if kwargs.get("history"):
-            params["history"] = "true"  # or 'yes' or 'y' or '1'
-        if kwargs.get("limit"):
-            params["limit"] = kwargs["limit"]
-        return self._get(url, params=params)
+        return self._send(OctoRequests.hwinfo(url, **kwargs))
 
     def printer(self, *, exclude=None, history=False, limit=None):
         """Retrieve the current printer state
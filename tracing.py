@@ -0,0 +1,222 @@
+"""
+Lightweight per-stage timing for every run.
+
+Stages are wrapped in spans, either with the `span` context manager or the `traced` decorator:
+
+    with span("trace_image"):
+        ...
+
+    @traced("generate_drawing")
+    def generate_drawing(...):
+        ...
+
+When tracing is disabled (the default until `enable` is called) a span costs one flag check.
+When enabled, every span is added to the totals of its stage and to a buffer of the last MAX_EVENTS spans,
+so long runs use bounded memory. At exit (or whenever `write_results` is called) the run writes to LOG_DIR:
+- trace.json: Chrome trace / Perfetto file of the buffered spans (open in chrome://tracing or https://ui.perfetto.dev)
+- timing_summary.txt: table of count, total, mean and max duration per stage, over every span of the run
+A sampling profiler can also be attached to one stage (`profile_stage`), which writes
+profile_<stage>.folded (collapsed stacks, for flamegraph tools) and logs the hottest functions.
+"""
+from project_init import SharedLogger, LOG_DIR
+
+log = SharedLogger.get_logger()
+
+import atexit
+import json
+import os
+import sys
+import threading
+from collections import Counter, deque
+from functools import wraps
+from pathlib import Path
+from time import perf_counter_ns, sleep
+
+# spans kept for trace.json; older ones only count in the stage totals
+MAX_EVENTS = 100_000
+
+_enabled = False
+_events = deque(maxlen=MAX_EVENTS)
+# name -> [count, total_us, max_us]
+_stage_totals = {}
+_events_lock = threading.Lock()
+_profiled_stage = None
+_profile_interval_s = 0.001
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval and counts collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval_s: float = 0.001):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            sleep(self.interval_s)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def hottest(self, n=10):
+        """functions with the most samples at the top of the stack"""
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        return own.most_common(n)
+
+
+class _Span:
+    __slots__ = ("name", "args", "start", "profiler")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.profiler = None
+
+    def __enter__(self):
+        if self.name == _profiled_stage:
+            self.profiler = SamplingProfiler(threading.get_ident(), _profile_interval_s)
+            self.profiler.start()
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if self.args:
+            event["args"] = self.args
+        with _events_lock:
+            _events.append(event)
+            totals = _stage_totals.setdefault(self.name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += event["dur"]
+            totals[2] = max(totals[2], event["dur"])
+        if self.profiler is not None:
+            self.profiler.stop()
+            profile_file = LOG_DIR / f"profile_{self.name}.folded"
+            self.profiler.write(profile_file)
+            log.info(
+                f"Profile of {self.name} saved to {profile_file}. Hottest functions:\n"
+                + "\n".join(f"{count:6d} {name}" for name, count in self.profiler.hottest())
+            )
+        return False
+
+
+def span(name: str, **args):
+    """Context manager timing the enclosed block as stage `name` (no-op when tracing is disabled)."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(name, args)
+
+
+def traced(name: str = None):
+    """Decorator timing every call of the function as stage `name` (defaults to the function name)."""
+
+    def decorator(fn):
+        stage = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(stage, None):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(write_at_exit: bool = True):
+    """Start recording spans. Results are written to LOG_DIR when the process exits."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    if write_at_exit:
+        atexit.register(write_results)
+
+
+def profile_stage(stage: str, interval_s: float = 0.001):
+    """Attach the sampling profiler to every span named `stage` (enables tracing)."""
+    global _profiled_stage, _profile_interval_s
+    _profiled_stage = stage
+    _profile_interval_s = interval_s
+    enable()
+
+
+def summary() -> dict[str, dict]:
+    """count, total, mean and max duration (seconds) per stage"""
+    with _events_lock:
+        totals = {name: list(values) for name, values in _stage_totals.items()}
+    return {
+        name: {"count": count, "total_s": total_us / 1e6, "mean_s": total_us / count / 1e6, "max_s": max_us / 1e6}
+        for name, (count, total_us, max_us) in totals.items()
+    }
+
+
+def format_summary(stats: dict[str, dict]) -> str:
+    lines = [f"{'stage':<28}{'count':>8}{'total [s]':>12}{'mean [s]':>12}{'max [s]':>12}"]
+    for name, values in sorted(stats.items(), key=lambda item: -item[1]["total_s"]):
+        lines.append(
+            f"{name:<28}{values['count']:>8}{values['total_s']:>12.3f}{values['mean_s']:>12.3f}{values['max_s']:>12.3f}"
+        )
+    return "\n".join(lines)
+
+
+def write_results(log_dir: Path = LOG_DIR, log_table: bool = True):
+    """Write trace.json and timing_summary.txt (can be called repeatedly, each call rewrites both files)"""
+    with _events_lock:
+        events = list(_events)
+        dropped = sum(count for count, _, _ in _stage_totals.values()) - len(events)
+    if not events:
+        return
+    trace_file = log_dir / "trace.json"
+    with open(trace_file, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    table = format_summary(summary())
+    with open(log_dir / "timing_summary.txt", "w") as f:
+        f.write(table + "\n")
+    if dropped:
+        log.debug(f"trace.json holds the last {len(events)} spans, {dropped} older ones are only in the totals")
+    if log_table:
+        log.info(f"Stage timings (trace saved to {trace_file}):\n{table}")
@@ -0,0 +1,296 @@
+"""
+Parameter sweep tuner for the image -> G-code pipeline.
+
+Sweeps the knobs that trade drawing quality for drawing time over a set of reference images, on all cores:
+    - TraceSettings.threshold (which pixels are strokes)
+    - CanvasScaleSettings.small_area_cutoff_sqr_mm (small contours that are dropped)
+    - GcodeGenerator.smoothing_sigma / smoothing_radius (smoothing of each contour)
+    - GcodeGenerator.min_step_mm (decimation of each contour)
+Every combination is scored on its estimated drawing time (gcode_analysis, with the selected machine profile),
+the size of its G-code and its fidelity: the F1 score between the drawn lines, rasterized back to image pixels,
+and the outlines of the strokes (pixels darker than reference_threshold) of the source image (within tolerance_px).
+
+Intermediate results are shared: each image is traced once per threshold and scaled once per cutoff,
+and all the smoothing and decimation combinations are generated from that.
+The combinations that no other combination beats on all three scores form the Pareto front; the fastest of them
+whose fidelity is within fidelity_tolerance of the best one is reported, and saved with --save-as.
+
+Examples:
+    python tune.py --images reference_images/ --save-as ender3_tuned
+    python tune.py --output sweep.json      # built-in reference drawings, nothing saved
+"""
+from project_init import SharedLogger
+
+log = SharedLogger.get_logger()
+
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+from time import perf_counter
+from typing import Union
+
+import cv2
+import numpy as np
+
+from settings.settings_base import BaseSettingsModel
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"}
+
+_worker_state = {}
+
+
+class TuneSettings(BaseSettingsModel):
+    """Parameter sweep settings:
+
+    thresholds: list[int] = [160, 200, 220, 240]
+        - TraceSettings.threshold values.
+
+    small_area_cutoffs_sqr_mm: list[Union[None, float]] = [None, 1.0, 4.0, 16.0]
+        - CanvasScaleSettings.small_area_cutoff_sqr_mm values (None keeps every contour).
+
+    smoothing_sigmas: list[float] = [0.0, 1.0, 2.0]
+        - GcodeGenerator.smoothing_sigma values (the radius is 3 sigma).
+
+    min_steps_mm: list[float] = [0.1, 0.2, 0.5, 1.0]
+        - GcodeGenerator.min_step_mm values.
+
+    reference_threshold: int = 128
+        - Source pixels darker than this are the strokes the drawings are scored against.
+          The same strokes for every combination, so that the thresholds are compared with each other;
+          this favors the thresholds closest to it (lighter strokes traced by a higher threshold count against its
+          precision, darker ones missed by a lower threshold against its recall).
+          0 scores each combination against the strokes of its own threshold instead,
+          which leaves the threshold to be picked on drawing time and size alone.
+
+    tolerance_px: int = 2
+        - Distance (in image pixels) within which a drawn line matches a stroke outline.
+
+    fidelity_tolerance: float = 0.02
+        - Fidelity (F1) that can be given up for a faster drawing when picking the best combination.
+
+    workers: int = 0
+        - Worker processes (0 uses every core).
+    """
+    thresholds: list[int] = [160, 200, 220, 240]
+    small_area_cutoffs_sqr_mm: list[Union[None, float]] = [None, 1.0, 4.0, 16.0]
+    smoothing_sigmas: list[float] = [0.0, 1.0, 2.0]
+    min_steps_mm: list[float] = [0.1, 0.2, 0.5, 1.0]
+    reference_threshold: int = 128
+    tolerance_px: int = 2
+    fidelity_tolerance: float = 0.02
+    workers: int = 0
+
+
+def load_images(images_dir: Union[Path, None]) -> dict[str, np.ndarray]:
+    """Grayscale reference images (the benchmark reference drawings if no directory is given)"""
+    if images_dir is None:
+        from benchmarks.pipeline import reference_drawings, synthetic_line_art
+
+        images = reference_drawings(1024)
+        images["synthetic"] = synthetic_line_art(1024, 100)
+        return images
+    from drawing.image_io import read_grayscale
+
+    return {
+        path.stem: read_grayscale(path)
+        for path in sorted(images_dir.iterdir())
+        if path.suffix.lower() in IMAGE_SUFFIXES
+    }
+
+
+def stroke_outlines(img: np.ndarray, threshold: int) -> np.ndarray:
+    """Outline pixels of the strokes (pixels darker than threshold) of the source image"""
+    strokes = (img < threshold).astype(np.uint8)
+    return (strokes & ~cv2.erode(strokes, np.ones((3, 3), np.uint8)).astype(bool)).astype(bool)
+
+
+def fidelity(drawn: np.ndarray, reference: np.ndarray, tolerance_px: int) -> float:
+    """F1 score of the drawn pixels against the reference pixels, each matching within tolerance_px"""
+    kernel = np.ones((2 * tolerance_px + 1, 2 * tolerance_px + 1), np.uint8)
+    drawn_count, reference_count = np.count_nonzero(drawn), np.count_nonzero(reference)
+    if drawn_count == 0 or reference_count == 0:
+        return 0.0
+    precision = np.count_nonzero(drawn & cv2.dilate(reference.astype(np.uint8), kernel).astype(bool)) / drawn_count
+    recall = np.count_nonzero(reference & cv2.dilate(drawn.astype(np.uint8), kernel).astype(bool)) / reference_count
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def rasterize(toolpath, pen_down, to_pixels, shape) -> np.ndarray:
+    """Draws the pen down moves of the toolpath (G-code coordinates) in an image of the given shape"""
+    drawn = np.zeros(shape, dtype=np.uint8)
+    segments = np.stack([to_pixels(toolpath.start[pen_down, :2]), to_pixels(toolpath.end[pen_down, :2])], axis=1)
+    cv2.polylines(drawn, list(np.round(segments).astype(np.int32)), False, 255, 1)
+    return drawn.astype(bool)
+
+
+def _pixel_transform(contours, canvas_settings, gcode_generator):
+    """Inverse of scale_contours_to_canvas (and of the G-code y flip and offset): G-code xy -> image pixels"""
+    points = np.concatenate([contour.reshape(-1, 2) for contour in contours])
+    bbox_min = points.min(axis=0).astype(float)
+    pixel_dims = points.max(axis=0) - bbox_min
+    axis = int(np.argmax(pixel_dims))
+    scaling_factor = canvas_settings.canvas_dims[axis] / pixel_dims[axis]
+    offset = np.asarray(gcode_generator.xy_offset_mm, dtype=float)
+
+    def to_pixels(xy):
+        canvas = (xy - offset) * np.array([1.0, -1.0])
+        return canvas / scaling_factor + bbox_min + pixel_dims / 2
+
+    return to_pixels
+
+
+def _init_worker(state: dict):
+    _worker_state.update(state)
+
+
+def sweep_traced(image_name: str, threshold: int) -> list[dict]:
+    """Scores every cutoff / smoothing / decimation combination of one image traced with one threshold"""
+    from drawing.trace_edges import trace_image
+    from drawing.canvas_scale import scale_contours_to_canvas
+    from drawing.gcode_analysis import parse_gcode, analyze, pen_down_mask
+
+    img = _worker_state["images"][image_name]
+    settings: TuneSettings = _worker_state["tune"]
+    reference = stroke_outlines(img, settings.reference_threshold or threshold)
+    contours = trace_image(img, _worker_state["trace"].model_copy(update={"threshold": threshold}))
+    scores = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gcode_path = Path(tmp_dir) / "sweep.gcode"
+        for cutoff in settings.small_area_cutoffs_sqr_mm:
+            canvas_settings = _worker_state["canvas"].model_copy(update={"small_area_cutoff_sqr_mm": cutoff})
+            canvas_contours = scale_contours_to_canvas(contours, canvas_settings) if contours else []
+            for sigma, min_step in product(settings.smoothing_sigmas, settings.min_steps_mm):
+                generator = _worker_state["gcode"].model_copy(update={
+                    "smoothing_sigma": sigma,
+                    "smoothing_radius": max(1, round(3 * sigma)),
+                    "min_step_mm": min_step,
+                })
+                data = generator.make_gcode_from_countours(canvas_contours, gcode_path).read_bytes()
+                toolpath = parse_gcode(data.decode())
+                stats = analyze(toolpath, _worker_state["profile"], generator.pen_down_mm)
+                score = 0.0
+                if canvas_contours:
+                    to_pixels = _pixel_transform(contours, canvas_settings, generator)
+                    drawn = rasterize(toolpath, pen_down_mask(toolpath, generator.pen_down_mm), to_pixels, img.shape)
+                    score = float(fidelity(drawn, reference, settings.tolerance_px))
+                scores.append({
+                    "image": image_name,
+                    "params": {
+                        "threshold": threshold,
+                        "small_area_cutoff_sqr_mm": cutoff,
+                        "smoothing_sigma": sigma,
+                        "min_step_mm": min_step,
+                    },
+                    "estimated_time_s": stats.estimated_time_s,
+                    "gcode_bytes": len(data),
+                    "fidelity": score,
+                })
+    return scores
+
+
+def pareto_front(points: list[dict]) -> list[int]:
+    """Indices of the points not dominated by any other (lower time, lower size, higher fidelity)"""
+    costs = np.array([[p["estimated_time_s"], p["gcode_bytes"], -p["fidelity"]] for p in points])
+    no_worse = (costs[:, None, :] <= costs[None, :, :]).all(axis=2)
+    better = (costs[:, None, :] < costs[None, :, :]).any(axis=2)
+    # dominated[j]: some point i is no worse on every score and better on one
+    dominated = (no_worse & better).any(axis=0)
+    return [int(i) for i in np.flatnonzero(~dominated)]
+
+
+def pick_best(points: list[dict], front: list[int], fidelity_tolerance: float) -> int:
+    """Fastest point of the front (smallest on ties) within fidelity_tolerance of the best fidelity"""
+    best_fidelity = max(points[i]["fidelity"] for i in front)
+    candidates = [i for i in front if points[i]["fidelity"] >= best_fidelity - fidelity_tolerance]
+    return min(candidates, key=lambda i: (points[i]["estimated_time_s"], points[i]["gcode_bytes"]))
+
+
+def run_sweep(images: dict[str, np.ndarray], settings: TuneSettings) -> dict:
+    from drawing.trace_edges import TraceSettings
+    from drawing.canvas_scale import CanvasScaleSettings
+    from drawing.gcode import GcodeGenerator
+    from drawing.gcode_analysis import GcodeAnalysisSettings
+
+    # loaded once here, as loading a settings section for the first time writes it to the settings file
+    state = {
+        "images": images,
+        "tune": settings,
+        "trace": TraceSettings.load(),
+        "canvas": CanvasScaleSettings.load(),
+        "gcode": GcodeGenerator.load(),
+        "profile": GcodeAnalysisSettings.load().profile(),
+    }
+    tasks = list(product(images, settings.thresholds))
+    n_points = len(settings.small_area_cutoffs_sqr_mm) * len(settings.smoothing_sigmas) * len(settings.min_steps_mm)
+    log.info(f"Sweeping {len(tasks) * n_points} combinations ({len(images)} images x {len(settings.thresholds)} thresholds x {n_points})")
+    t0 = perf_counter()
+    per_image = []
+    with ProcessPoolExecutor(settings.workers or os.cpu_count(), initializer=_init_worker, initargs=(state,)) as pool:
+        for scores in pool.map(sweep_traced, *zip(*tasks)):
+            per_image.extend(scores)
+
+    # totals over the images for every combination
+    points = {}
+    for score in per_image:
+        key = json.dumps(score["params"], sort_keys=True)
+        point = points.setdefault(key, {"params": score["params"], "estimated_time_s": 0.0, "gcode_bytes": 0, "fidelity": 0.0})
+        point["estimated_time_s"] += score["estimated_time_s"]
+        point["gcode_bytes"] += score["gcode_bytes"]
+        point["fidelity"] += score["fidelity"] / len(images)
+    points = list(points.values())
+    front = pareto_front(points)
+    best = pick_best(points, front, settings.fidelity_tolerance)
+    log.info(f"Swept {len(points)} combinations in {perf_counter() - t0:.1f}s, {len(front)} on the Pareto front")
+    for i in sorted(front, key=lambda i: points[i]["estimated_time_s"]):
+        point = points[i]
+        log.info(
+            f"{'*' if i == best else ' '} {point['params']}: {point['estimated_time_s']:.0f}s, "
+            f"{point['gcode_bytes'] / 1e3:.0f}kB, fidelity {point['fidelity']:.3f}"
+        )
+    return {
+        "images": list(images),
+        "points": points,
+        "pareto_front": [points[i] for i in front],
+        "best": points[best],
+        "per_image": per_image,
+    }
+
+
+def save_params(params: dict, name: str) -> Path:
+    """Writes the parameters into the settings file `name`, on top of the current settings"""
+    from drawing.trace_edges import TraceSettings
+    from drawing.canvas_scale import CanvasScaleSettings
+    from drawing.gcode import GcodeGenerator
+
+    TraceSettings.load().model_copy(update={"threshold": params["threshold"]}).save(name)
+    CanvasScaleSettings.load().model_copy(update={"small_area_cutoff_sqr_mm": params["small_area_cutoff_sqr_mm"]}).save(name)
+    return GcodeGenerator.load().model_copy(update={
+        "smoothing_sigma": params["smoothing_sigma"],
+        "smoothing_radius": max(1, round(3 * params["smoothing_sigma"])),
+        "min_step_mm": params["min_step_mm"],
+    }).save(name)
+
+
+if __name__ == "__main__":
+    from project_init import ArgParser
+
+    parser = ArgParser(description=__doc__)
+    parser.add_argument("--images", type=str, default=None, help="Directory of reference images (built-in drawings if not given)")
+    parser.add_argument("--save-as", type=str, default=None, help="Settings name to save the best combination to (e.g. ender3_tuned)")
+    parser.add_argument("--output", type=str, default=None, help="Write every score as JSON to this file")
+    args = parser.parse_args()
+
+    images = load_images(Path(args.images) if args.images else None)
+    if not images:
+        raise ValueError(f"No images found in {args.images}")
+    results = run_sweep(images, TuneSettings.load())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        log.info(f"Results saved to {args.output}")
+    if args.save_as:
+        settings_file = save_params(results["best"]["params"], args.save_as)
+        log.info(f"Best combination saved to {settings_file}, use it with --settings-name {args.save_as}")